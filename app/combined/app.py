@@ -0,0 +1,48 @@
+"""
+Combined Service - products, orders and users in one process (see shared/combined.py)
+"""
+from flask import Flask, jsonify
+import os, sys
+from datetime import datetime
+PORT = int(os.getenv("PORT", 5000))
+INSTANCE_NAME = os.getenv("INSTANCE_NAME", "combined-1")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+import combined
+from metrics import requests_handled
+import profiling
+
+MOUNTS = {
+    "/api/products": "products",
+    "/api/orders": "orders",
+    "/api/auth": "users",
+    "/api/users": "users",
+}
+
+root = Flask(__name__)
+# Server-Timing on the root routes, and /debug/profile when enabled (profiling.py)
+profiling.install(root)
+app = combined.Combined(root, MOUNTS)
+
+stats = {'pid': os.getpid(), 'started_at': datetime.now()}
+
+@root.route('/')
+def home():
+    return jsonify({
+        "service": "Combined",
+        "services": sorted(set(MOUNTS.values())),
+        "instance": INSTANCE_NAME,
+        "port": PORT,
+        "pid": os.getpid(),
+        "requests_handled": requests_handled(),
+        "uptime_seconds": (datetime.now() - stats['started_at']).seconds
+    })
+
+@root.route('/health')
+def health():
+    return jsonify({"status": "healthy", "instance": INSTANCE_NAME})
+
+if __name__ == "__main__":
+    from server import serve_app
+    print(f"[{INSTANCE_NAME}] Starting on port {PORT} (PID: {os.getpid()})")
+    serve_app(app, int(PORT), threads=4, channel_timeout=60)
@@ -2,41 +2,71 @@
 Orders Service
 """
 from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_cors import CORS
+from sqlalchemy.exc import OperationalError
 import os, sys
 from datetime import datetime
 PORT = os.environ.get("PORT", 5011)
 INSTANCE_NAME = os.getenv("INSTANCE_NAME", "order-1")
-sys.path.insert(0, 'C:/production/shared')
-from models import db, Order, OrderItem, Product
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+import bulk
+from cache import ResponseCache
+import database
+import identity
+from metrics import requests_handled
+from group_commit import GroupCommitBusy, GroupCommitter, Rollback, run_jobs
+from models import db, Order
+import inventory
+import pagination
+import profiling
+import serialization
+from serialization import ORDER, order_dicts
 # from config import config
 
 
 
 app = Flask(__name__)
-
-db.init_app(app)
-JWTManager(app)
+# app.config.from_object(config['production'])
+app.config['SECRET_KEY'] = 'production-secret-key'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///C:/production/database/ecommerce.db')
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['JWT_SECRET_KEY'] = 'jwt-secret-key'
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'SimpleCache')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT') == '1'
+app.config['GROUP_COMMIT_MAX_BATCH'] = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 64))
+app.config['GROUP_COMMIT_MAX_WAIT_MS'] = float(os.environ.get('GROUP_COMMIT_MAX_WAIT_MS', 2))
+database.init_app(app)
+# verified token claims are kept until they expire, see identity.py
+identity.manager.init_app(app)
 CORS(app)
-limiter = Limiter(app=app, key_func=get_remote_address, storage_uri="memory://")
-
-stats = {'requests_handled': 0, 'pid': os.getpid(), 'started_at': datetime.now()}
-
-with app.app_context():
-    db.create_all()
+serialization.install(app)
+# Server-Timing headers and per-route CPU/SQL/JSON metrics (profiling.py)
+profiling.install(app)
+# orders change product stock, so they invalidate the products service's cache
+products_cache = ResponseCache('products', app)
+# optional: batch concurrent order writes into one transaction (group_commit.py)
+committer = None
+if app.config['GROUP_COMMIT']:
+    committer = GroupCommitter(app, max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+                               max_wait=app.config['GROUP_COMMIT_MAX_WAIT_MS'] / 1000)
+
+def find_order(session, **filters):
+    """Order.to_dict() of the matching order, or None; two queries, no ORM objects"""
+    row = ORDER.query(session.query(Order).filter_by(**filters)).first()
+    return order_dicts([row], session)[0] if row else None
+
+stats = {'pid': os.getpid(), 'started_at': datetime.now()}
 
 @app.route('/')
 def home():
-    stats['requests_handled'] += 1
     return jsonify({
         "service": "Orders",
         "instance": INSTANCE_NAME,
         "port": PORT,
-        "pid": stats['pid'],
-        "requests_handled": stats['requests_handled']
+        "pid": os.getpid(),
+        "requests_handled": requests_handled()
     })
 
 @app.route('/health')
@@ -46,64 +76,132 @@ def health():
 @app.route('/api/orders', methods=['GET'])
 @jwt_required()
 def get_orders():
-    stats['requests_handled'] += 1
     user_id = int(get_jwt_identity())
-    orders = Order.query.filter_by(user_id=user_id).all()
-    return jsonify({
+    page, error = pagination.page_params(request.args)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    reader = database.reader()
+    # orders are always serialised with their items and product names: one
+    # query for the orders, one for the items of the whole batch
+    query = ORDER.query(reader.query(Order).filter_by(user_id=user_id))
+    if page["stream"]:
+        return pagination.stream_json("orders", query, Order, page, INSTANCE_NAME,
+                                      to_dicts=lambda rows: order_dicts(rows, reader))
+    orders, next_after_id = pagination.paginate(query, Order, page)
+    payload = {
         "success": True,
-        "orders": [o.to_dict() for o in orders],
+        "orders": order_dicts(orders, reader),
         "total": len(orders),
         "instance": INSTANCE_NAME
-    })
+    }
+    if page["limit"] is not None:
+        payload["next_after_id"] = next_after_id
+    return jsonify(payload)
 
 @app.route('/api/orders/<int:order_id>', methods=['GET'])
 @jwt_required()
 def get_order(order_id):
-    stats['requests_handled'] += 1
     user_id = int(get_jwt_identity())
-    order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+    order = find_order(database.reader(), id=order_id, user_id=user_id)
     if not order:
         return jsonify({"success": False, "error": "Order not found"}), 404
-    return jsonify({"success": True, "order": order.to_dict(), "instance": INSTANCE_NAME})
+    return jsonify({"success": True, "order": order, "instance": INSTANCE_NAME})
+
+def busy_response():
+    response = jsonify({"success": False, "error": "Database busy, try again"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def order_job(user_id, wanted):
+    """create_order's writes, run by the group committer"""
+    order_id, failures = inventory.order_in_transaction(user_id, wanted)
+    if failures:
+        raise Rollback((None, failures))
+    return order_id, []
+
+def status_job(order_id, status):
+    """update_order_status's write, run by the group committer"""
+    Order.query.filter_by(id=order_id).update({'status': status, 'updated_at': datetime.utcnow()})
 
 @app.route('/api/orders', methods=['POST'])
 @jwt_required()
 def create_order():
-    stats['requests_handled'] += 1
     user_id = int(get_jwt_identity())
     data = request.get_json()
 
-    if 'items' not in data or not data['items']:
-        return jsonify({"success": False, "error": "Items required"}), 400
-
-    total = 0
-    order_items = []
-
-    for item in data['items']:
-        product = Product.query.get(item['product_id'])
-        if not product:
-            return jsonify({"success": False, "error": f"Product {item['product_id']} not found"}), 404
-        if product.stock < item['quantity']:
-            return jsonify({"success": False, "error": f"Insufficient stock for {product.name}"}), 400
-        total += product.price * item['quantity']
-        order_items.append({'product': product, 'quantity': item['quantity'], 'price': product.price})
-
-    order = Order(user_id=user_id, total_amount=round(total, 2), status='pending')
-    db.session.add(order)
-    db.session.flush()
-
-    for item in order_items:
-        oi = OrderItem(order_id=order.id, product_id=item['product'].id, quantity=item['quantity'], price=item['price'])
-        db.session.add(oi)
-        item['product'].stock -= item['quantity']
-
-    db.session.commit()
-    return jsonify({"success": True, "order": order.to_dict(), "instance": INSTANCE_NAME}), 201
+    wanted, error = inventory.parse_items(data.get('items'))
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+
+    try:
+        if committer is not None:
+            order_id, failures = committer.submit(order_job, user_id, wanted)
+        else:
+            order_id, failures = inventory.place_order(user_id, wanted)
+    except (inventory.InventoryBusy, GroupCommitBusy, OperationalError) as e:
+        if not inventory.is_busy(e):
+            raise
+        return busy_response()
+    if failures:
+        first = failures[0]
+        if first['reason'] == 'not_found':
+            error, status = f"Product {first['product_id']} not found", 404
+        else:
+            error, status = f"Insufficient stock for {first['name']}", 400
+        return jsonify({"success": False, "error": error, "failures": failures}), status
+
+    products_cache.invalidate()
+    order = find_order(db.session, id=order_id)
+    return jsonify({"success": True, "order": order, "instance": INSTANCE_NAME}), 201
+
+@app.route('/api/orders/bulk', methods=['POST'])
+@jwt_required()
+def create_orders_bulk():
+    """Place many orders in one transaction, each in its own savepoint"""
+    user_id = int(get_jwt_identity())
+    records, error = bulk.parse_records(request.get_json(silent=True), 'orders')
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+
+    results, valid, jobs = [], [], []
+    for index, data in enumerate(records):
+        wanted, error = inventory.parse_items(data.get('items') if isinstance(data, dict) else None)
+        if error:
+            results.append({"index": index, "success": False, "error": error})
+        else:
+            valid.append(index)
+            jobs.append((order_job, (user_id, wanted)))
+
+    if jobs:
+        try:
+            db.session.rollback()  # the jobs' transaction must be the session's first
+            outcomes = run_jobs(jobs)
+        except OperationalError as e:
+            if not inventory.is_busy(e):
+                raise
+            return busy_response()
+        for index, (value, exc) in zip(valid, outcomes):
+            if exc is not None:
+                # raised inside its savepoint job; exc_info keeps the job's own traceback
+                app.logger.exception("[%s] bulk order %d failed", INSTANCE_NAME, index, exc_info=exc)
+                results.append({"index": index, "success": False, "error": "Order failed"})
+                continue
+            order_id, failures = value
+            if failures:
+                results.append({"index": index, "success": False, "error": "Order could not be placed",
+                                "failures": failures})
+            else:
+                results.append({"index": index, "success": True, "id": order_id})
+
+    body = bulk.response_body(results)
+    if body["created"]:
+        products_cache.invalidate()
+    body["instance"] = INSTANCE_NAME
+    return jsonify(body), 201 if body["created"] else 400
 
 @app.route('/api/orders/<int:order_id>/status', methods=['PUT'])
 @jwt_required()
 def update_order_status(order_id):
-    stats['requests_handled'] += 1
     user_id = int(get_jwt_identity())
     order = Order.query.filter_by(id=order_id, user_id=user_id).first()
     if not order:
@@ -112,11 +210,21 @@ def update_order_status(order_id):
     valid_statuses = ['pending', 'confirmed', 'shipped', 'delivered', 'cancelled']
     if data.get('status') not in valid_statuses:
         return jsonify({"success": False, "error": "Invalid status"}), 400
-    order.status = data['status']
-    db.session.commit()
-    return jsonify({"success": True, "order": order.to_dict(), "instance": INSTANCE_NAME})
+    if committer is not None:
+        # end our read transaction first: the writer cannot commit past it
+        db.session.rollback()
+        try:
+            committer.submit(status_job, order_id, data['status'])
+        except (GroupCommitBusy, OperationalError) as e:
+            if not inventory.is_busy(e):
+                raise
+            return busy_response()
+    else:
+        order.status = data['status']
+        db.session.commit()
+    return jsonify({"success": True, "order": find_order(db.session, id=order_id), "instance": INSTANCE_NAME})
 
 if __name__ == "__main__":
-    from waitress import serve
+    from server import serve_app
     print(f"[{INSTANCE_NAME}] Starting on port {PORT} (PID: {os.getpid()})")
-    serve(app, host='127.0.0.1', port=PORT, threads=4)
+    serve_app(app, int(PORT), threads=4)
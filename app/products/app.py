@@ -3,9 +3,7 @@ Products Service - Single file, master spawns multiple copies
 """
 
 from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, jwt_required
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask_jwt_extended import jwt_required
 from flask_cors import CORS
 import os
 import sys
@@ -15,8 +13,18 @@ INSTANCE_NAME = os.getenv("INSTANCE_NAME", "products-1")
 
 PORT = int(os.getenv("PORT", 5001))
 
-sys.path.insert(0, 'C:/production/shared')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+import bulk
+from cache import ResponseCache, cached_response
+import database
+import identity
+from metrics import requests_handled
 from models import db, Product
+import pagination
+import profiling
+import search
+import serialization
+from serialization import PRODUCT
 # from config import config
 
 # Instance info comes from environment variables
@@ -25,32 +33,34 @@ from models import db, Product
 app = Flask(__name__)
 # app.config.from_object(config['production'])
 app.config['SECRET_KEY'] = 'production-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///C:/production/database/ecommerce.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///C:/production/database/ecommerce.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-key'
-db.init_app(app)
-JWTManager(app)
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'SimpleCache')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+database.init_app(app)
+# verified token claims are kept until they expire, see identity.py
+identity.manager.init_app(app)
 CORS(app)
-limiter = Limiter(app=app, key_func=get_remote_address, storage_uri="memory://")
+serialization.install(app)
+# Server-Timing headers and per-route CPU/SQL/JSON metrics (profiling.py)
+profiling.install(app)
+cache = ResponseCache('products', app)
 
 stats = {
-    'requests_handled': 0,
     'started_at': datetime.now(),
     'pid': os.getpid()
 }
 
-with app.app_context():
-    db.create_all()
-
 @app.route('/')
 def home():
-    stats['requests_handled'] += 1
     return jsonify({
         "service": "Products",
         "instance": INSTANCE_NAME,
         "port": PORT,
-        "pid": stats['pid'],
-        "requests_handled": stats['requests_handled'],
+        "pid": os.getpid(),
+        "requests_handled": requests_handled(),
         "uptime_seconds": (datetime.now() - stats['started_at']).seconds
     })
 
@@ -60,67 +70,109 @@ def health():
 
 @app.route('/api/products', methods=['GET'])
 def get_products():
-    stats['requests_handled'] += 1
     category = request.args.get('category')
-    query = Product.query.filter_by(is_active=True)
+    page, error = pagination.page_params(request.args)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    query = database.reader().query(Product).filter_by(is_active=True)
     if category:
         query = query.filter_by(category=category)
-    products = query.all()
-    return jsonify({
-        "success": True,
-        "products": [p.to_dict() for p in products],
-        "total": len(products),
-        "instance": INSTANCE_NAME
-    })
+    query = PRODUCT.query(query)
+    if page["stream"]:
+        return pagination.stream_json("products", query, Product, page, INSTANCE_NAME, to_dicts=PRODUCT.to_dicts)
+
+    def build():
+        products, next_after_id = pagination.paginate(query, Product, page)
+        payload = {"success": True, "products": PRODUCT.to_dicts(products), "total": len(products)}
+        if page["limit"] is not None:
+            payload["next_after_id"] = next_after_id
+        return payload
+
+    key = f"list:{category or ''}:{page['after_id']}:{page['limit']}"
+    return cached_response(cache, key, build, INSTANCE_NAME)
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
-    stats['requests_handled'] += 1
-    product = Product.query.get(product_id)
-    if not product:
+    def build():
+        row = PRODUCT.query(database.reader().query(Product).filter_by(id=product_id)).first()
+        return {"success": True, "product": PRODUCT.to_dict(row)} if row else None
+
+    response = cached_response(cache, f"item:{product_id}", build, INSTANCE_NAME)
+    if response is None:
         return jsonify({"success": False, "error": "Product not found"}), 404
-    return jsonify({"success": True, "product": product.to_dict(), "instance": INSTANCE_NAME})
+    return response
 
 @app.route('/api/products/search', methods=['GET'])
 def search_products():
-    stats['requests_handled'] += 1
     q = request.args.get('q', '')
     if not q:
         return jsonify({"success": False, "error": "Query required"}), 400
-    products = Product.query.filter(
-        db.or_(Product.name.ilike(f'%{q}%'), Product.description.ilike(f'%{q}%')),
-        Product.is_active == True
-    ).all()
+    limit = request.args.get('limit', 50, type=int)
+    if not 1 <= limit <= 1000:
+        return jsonify({"success": False, "error": "limit must be between 1 and 1000"}), 400
+    products = search.search_products(q, limit, database.reader())
     return jsonify({
         "success": True,
         "query": q,
-        "products": [p.to_dict() for p in products],
+        "products": PRODUCT.to_dicts(products),
         "total": len(products),
         "instance": INSTANCE_NAME
     })
 
+def product_row(data):
+    """Validate a product record -> (column values, error message)"""
+    if not isinstance(data, dict) or 'name' not in data or 'price' not in data:
+        return None, "Name and price required"
+    try:
+        price, stock = float(data['price']), int(data.get('stock', 0))
+    except (TypeError, ValueError):
+        return None, "Price must be a number and stock an integer"
+    return {
+        'name': data['name'],
+        'description': data.get('description', ''),
+        'price': price,
+        'stock': stock,
+        'category': data.get('category', 'general')
+    }, None
+
 @app.route('/api/products', methods=['POST'])
 @jwt_required()
 def create_product():
-    stats['requests_handled'] += 1
-    data = request.get_json()
-    if 'name' not in data or 'price' not in data:
-        return jsonify({"success": False, "error": "Name and price required"}), 400
-    product = Product(
-        name=data['name'],
-        description=data.get('description', ''),
-        price=float(data['price']),
-        stock=int(data.get('stock', 0)),
-        category=data.get('category', 'general')
-    )
+    row, error = product_row(request.get_json())
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    product = Product(**row)
     db.session.add(product)
     db.session.commit()
+    cache.invalidate()
     return jsonify({"success": True, "product": product.to_dict(), "instance": INSTANCE_NAME}), 201
 
+@app.route('/api/products/bulk', methods=['POST'])
+@jwt_required()
+def create_products_bulk():
+    records, error = bulk.parse_records(request.get_json(silent=True), 'products')
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    results, valid, rows = [], [], []
+    for index, data in enumerate(records):
+        row, error = product_row(data)
+        if error:
+            results.append({"index": index, "success": False, "error": error})
+        else:
+            valid.append(index)
+            rows.append(row)
+    if rows:
+        ids = bulk.insert_rows(Product, rows)
+        db.session.commit()
+        cache.invalidate()
+        results.extend({"index": index, "success": True, "id": product_id} for index, product_id in zip(valid, ids))
+    body = bulk.response_body(results)
+    body["instance"] = INSTANCE_NAME
+    return jsonify(body), 201 if rows else 400
+
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
 @jwt_required()
 def update_product(product_id):
-    stats['requests_handled'] += 1
     product = Product.query.get(product_id)
     if not product:
         return jsonify({"success": False, "error": "Product not found"}), 404
@@ -129,20 +181,21 @@ def update_product(product_id):
         if field in data:
             setattr(product, field, data[field])
     db.session.commit()
+    cache.invalidate()
     return jsonify({"success": True, "product": product.to_dict(), "instance": INSTANCE_NAME})
 
 @app.route('/api/products/<int:product_id>', methods=['DELETE'])
 @jwt_required()
 def delete_product(product_id):
-    stats['requests_handled'] += 1
     product = Product.query.get(product_id)
     if not product:
         return jsonify({"success": False, "error": "Product not found"}), 404
     product.is_active = False
     db.session.commit()
+    cache.invalidate()
     return jsonify({"success": True, "message": "Product deleted", "instance": INSTANCE_NAME})
 
 if __name__ == "__main__":
-    from waitress import serve
+    from server import serve_app
     print(f"[{INSTANCE_NAME}] Starting on port {PORT} (PID: {os.getpid()})")
-    serve(app, host='127.0.0.1', port=PORT, threads=4, channel_timeout=60)
\ No newline at end of file
+    serve_app(app, int(PORT), threads=4, channel_timeout=60)
\ No newline at end of file
@@ -2,9 +2,7 @@
 Users Service
 """
 from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 import os, sys
 from datetime import datetime
@@ -12,7 +10,15 @@ import os
 PORT = int(os.getenv("PORT", 5021))
 INSTANCE_NAME = os.getenv("INSTANCE_NAME", "products-1")
 
-sys.path.insert(0, 'C:/production/shared')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'shared'))
+from cache import cached_response
+import database
+import identity
+from metrics import requests_handled
+import passwords
+import profiling
+import ratelimit  # registers the unicorn:// limiter storage
+import serialization
 from models import db, User
 # from config import config
 
@@ -21,38 +27,51 @@ from models import db, User
 app = Flask(__name__)
 # app.config.from_object(config['production'])
 app.config['SECRET_KEY'] = 'production-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///C:/production/database/ecommerce.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///C:/production/database/ecommerce.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-key'
-db.init_app(app)
-JWTManager(app)
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'SimpleCache')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED') != '0'
+database.init_app(app)
+# verified token claims are kept until they expire, see identity.py
+identity.manager.init_app(app)
 CORS(app)
-limiter = Limiter(app=app, key_func=get_remote_address, storage_uri="memory://")
+serialization.install(app)
+# Server-Timing headers and per-route CPU/SQL/JSON metrics (profiling.py)
+profiling.install(app)
+# counters shared by every worker through the master (ratelimit.py)
+limiter = ratelimit.limiter(app)
+# password hashes run in a small process pool, see passwords.py
+hasher = passwords.PasswordHasher(app)
+# /api/users/me bodies by user id
+identities = identity.identity_cache(app)
 
-stats = {'requests_handled': 0, 'pid': os.getpid(), 'started_at': datetime.now()}
-
-with app.app_context():
-    db.create_all()
+stats = {'pid': os.getpid(), 'started_at': datetime.now()}
 
 @app.route('/')
 def home():
-    stats['requests_handled'] += 1
     return jsonify({
         "service": "Users",
         "instance": INSTANCE_NAME,
         "port": PORT,
-        "pid": stats['pid'],
-        "requests_handled": stats['requests_handled']
+        "pid": os.getpid(),
+        "requests_handled": requests_handled()
     })
 
 @app.route('/health')
 def health():
     return jsonify({"status": "healthy", "instance": INSTANCE_NAME})
 
+@app.errorhandler(passwords.HashingBusy)
+def hashing_busy(e):
+    response = jsonify({"success": False, "error": "Server busy, try again", "instance": INSTANCE_NAME})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/api/auth/register', methods=['POST'])
 @limiter.limit("5 per hour")
 def register():
-    stats['requests_handled'] += 1
     data = request.get_json()
     for field in ['username', 'email', 'password']:
         if field not in data:
@@ -62,7 +81,7 @@ def register():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({"success": False, "error": "Email already exists"}), 400
     user = User(username=data['username'], email=data['email'])
-    user.set_password(data['password'])
+    user.password_hash = hasher.hash(data['password'])
     db.session.add(user)
     db.session.commit()
     access_token = create_access_token(identity=str(user.id))
@@ -78,13 +97,19 @@ def register():
 @app.route('/api/auth/login', methods=['POST'])
 @limiter.limit("10 per hour")
 def login():
-    stats['requests_handled'] += 1
     data = request.get_json()
     if 'username' not in data or 'password' not in data:
         return jsonify({"success": False, "error": "Username and password required"}), 400
     user = User.query.filter_by(username=data['username']).first()
-    if not user or not user.check_password(data['password']):
+    if not user or not hasher.check(user.password_hash, data['password']):
         return jsonify({"success": False, "error": "Invalid credentials"}), 401
+    if hasher.needs_rehash(user.password_hash):
+        # made with older parameters; upgrade it while we have the password
+        try:
+            user.password_hash = hasher.hash(data['password'])
+            db.session.commit()
+        except passwords.HashingBusy:
+            pass  # a later login will
     access_token = create_access_token(identity=str(user.id))
     refresh_token = create_refresh_token(identity=str(user.id))
     return jsonify({
@@ -98,7 +123,6 @@ def login():
 @app.route('/api/auth/refresh', methods=['POST'])
 @jwt_required(refresh=True)
 def refresh():
-    stats['requests_handled'] += 1
     user_id = get_jwt_identity()
     access_token = create_access_token(identity=str(user_id))
     return jsonify({"success": True, "access_token": access_token, "instance": INSTANCE_NAME})
@@ -106,17 +130,20 @@ def refresh():
 @app.route('/api/users/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    stats['requests_handled'] += 1
     user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
-    if not user:
+
+    def build():
+        user = database.reader().get(User, int(user_id))
+        return {"success": True, "user": user.to_dict()} if user else None
+
+    response = cached_response(identities, user_id, build, INSTANCE_NAME)
+    if response is None:
         return jsonify({"success": False, "error": "User not found"}), 404
-    return jsonify({"success": True, "user": user.to_dict(), "instance": INSTANCE_NAME})
+    return response
 
 @app.route('/api/users/me', methods=['PUT'])
 @jwt_required()
 def update_current_user():
-    stats['requests_handled'] += 1
     user_id = get_jwt_identity()
     user = User.query.get(int(user_id))
     if not user:
@@ -128,11 +155,12 @@ def update_current_user():
             return jsonify({"success": False, "error": "Email already in use"}), 400
         user.email = data['email']
     if 'password' in data:
-        user.set_password(data['password'])
+        user.password_hash = hasher.hash(data['password'])
     db.session.commit()
+    identities.invalidate(user_id)
     return jsonify({"success": True, "user": user.to_dict(), "instance": INSTANCE_NAME})
 
 if __name__ == "__main__":
-    from waitress import serve
+    from server import serve_app
     print(f"[{INSTANCE_NAME}] Starting on port {PORT} (PID: {os.getpid()})")
-    serve(app, host='127.0.0.1', port=PORT, threads=4)
\ No newline at end of file
+    serve_app(app, int(PORT), threads=4)
\ No newline at end of file
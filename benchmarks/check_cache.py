@@ -0,0 +1,65 @@
+"""
+Cross-service invalidation of the response caches in shared/cache.py
+
+Boots the combined service in process (no unicorn_master, so no
+run/generations file) on a throwaway SQLite database, reads a product
+through the products cache, places an order for it through the orders
+service and reads it again. Exits 1 unless the second read shows the
+stock the order left, i.e. orders' products_cache.invalidate() evicted
+what the products service had cached in the same process.
+
+Usage: python benchmarks/check_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import warnings
+from pathlib import Path
+
+from werkzeug.test import Client
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app" / "combined"))
+
+STOCK = 3
+ORDERED = 2
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="check_cache_")
+    os.environ.update(DATABASE_URL=f"sqlite:///{workdir}/cache.db", RATELIMIT_ENABLED="0", PASSWORD_WORKERS="0")
+    os.environ.pop("UNICORN_GENERATIONS", None)
+    warnings.simplefilter("ignore")   # the services' short JWT secret
+    import app as service
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Product
+    import migrations
+
+    orders = sys.modules["orders_app"].app
+    with orders.app_context():
+        migrations.bootstrap(db.engine)   # unicorn_master's step, the services no longer do it
+        db.session.add(User(username="buyer", email="buyer@example.com", password_hash="x"))
+        db.session.add(Product(name="Last few", price=10.0, stock=STOCK, category="general"))
+        db.session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(identity='1')}"}
+    client = Client(service.app)
+
+    def stock():
+        return client.get("/api/products/1").json["product"]["stock"]
+
+    failed = False
+    before = [stock(), stock()]   # the second one is served from the cache
+    ordered = client.post("/api/orders", headers=headers,
+                          json={"items": [{"product_id": 1, "quantity": ORDERED}]}).status_code
+    after = stock()
+    for ok, what in ((before == [STOCK, STOCK], f"stock {before} before the order"),
+                     (ordered == 201, f"order placed (status {ordered})"),
+                     (after == STOCK - ORDERED, f"stock {after} after it, expected {STOCK - ORDERED}")):
+        failed |= not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Correctness and cost of the JWT-route caches in shared/identity.py
+
+Boots the users service in process (test client) on a throwaway SQLite
+database and calls GET /api/users/me with --users tokens in turn:
+  uncached - JWT_CLAIMS_CACHE_SIZE=0 and an identity cache that expires
+             at once: every request verifies its token and loads the user
+  cached   - the defaults
+Exits 1 unless both return the same bytes, a PUT /api/users/me is seen by
+the next GET and leaves the other users' bodies cached, and an expired
+token is refused while its claims are cached.
+
+Usage: python benchmarks/check_identity.py [--users 50] [--requests 5000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app" / "users"))
+
+PASSWORD = "correct horse battery staple"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="check_identity_")
+    os.environ.update(DATABASE_URL=f"sqlite:///{workdir}/users.db", RATELIMIT_ENABLED="0", PASSWORD_WORKERS="0",
+                      PASSWORD_METHOD="pbkdf2:sha256:1000")
+    warnings.simplefilter("ignore")   # the services' short JWT secret
+    import app as service
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+    import migrations
+
+    app = service.app
+    manager = app.extensions["flask-jwt-extended"]
+    with app.app_context():
+        migrations.bootstrap(db.engine)   # unicorn_master's step, the services no longer do it
+        db.session.execute(db.insert(User), [{"username": f"user{i}", "email": f"user{i}@example.com",
+                                              "password_hash": service.hasher.hash(PASSWORD)}
+                                             for i in range(args.users)])
+        db.session.commit()
+        headers = [{"Authorization": f"Bearer {create_access_token(identity=str(i + 1))}"}
+                   for i in range(args.users)]
+    client = app.test_client()
+
+    def run():
+        bodies = {}
+        started = time.perf_counter()
+        for n in range(args.requests):
+            response = client.get("/api/users/me", headers=headers[n % args.users])
+            bodies[n % args.users] = response.data
+        return bodies, (time.perf_counter() - started) / args.requests * 1e6
+
+    failed = False
+    results = {}
+    for mode in ("uncached", "cached"):
+        manager.max_claims = 0 if mode == "uncached" else 4096
+        service.identities.timeout = 0 if mode == "uncached" else 60
+        run()   # warm up
+        results[mode] = run()
+        print(f"  {mode:<9} {results[mode][1]:7.1f} us per GET /api/users/me ({args.users} users)")
+    same = results["uncached"][0] == results["cached"][0]
+    failed |= not same
+    print(f"  {'ok  ' if same else 'FAIL'} same bodies")
+
+    client.get("/api/users/me", headers=headers[1])
+    client.put("/api/users/me", headers=headers[0], json={"email": "changed@example.com"})
+    seen = client.get("/api/users/me", headers=headers[0]).json["user"]["email"] == "changed@example.com"
+    failed |= not seen
+    print(f"  {'ok  ' if seen else 'FAIL'} update seen by the next read")
+    kept = service.identities.get("2")[0] is not None
+    failed |= not kept
+    print(f"  {'ok  ' if kept else 'FAIL'} other users' bodies still cached")
+
+    with app.app_context():
+        expiring = {"Authorization": "Bearer " + create_access_token(identity="1",
+                                                                     expires_delta=timedelta(seconds=2))}
+    first = client.get("/api/users/me", headers=expiring).status_code
+    time.sleep(2.5)
+    refused = first == 200 and client.get("/api/users/me", headers=expiring).status_code == 401
+    failed |= not refused
+    print(f"  {'ok  ' if refused else 'FAIL'} expired token refused")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
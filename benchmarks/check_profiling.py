@@ -0,0 +1,146 @@
+"""
+Correctness and cost of the request timings in shared/profiling.py
+
+Boots the orders service in process (test client) on a throwaway SQLite
+database with PROFILER_ENDPOINT=1, places --orders orders and checks:
+  - POST and GET /api/orders carry a Server-Timing header whose query
+    count matches the statements a separate engine listener saw, and
+    whose parts add up to no more than the total;
+  - unicorn_request_sql_queries_total has the same count per route;
+  - /debug/profile, sampled while another thread lists orders, returns
+    folded stacks ("root;frame;... count") rooted at the route and
+    reaching the view, and refuses a request that came through a proxy.
+Then it times GET /api/orders with PROFILING on and, in a second process,
+off. Exits 1 if a check fails.
+
+Usage: python benchmarks/check_profiling.py [--orders 50] [--requests 2000]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "app" / "orders"))
+
+FOLDED = re.compile(r"^[^;]+(;[^;]+)+ \d+$")
+TIMING = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) quer)?')
+
+
+def boot(args):
+    """The orders app with a user, 20 products and --orders orders; (app, client, auth headers)"""
+    workdir = tempfile.mkdtemp(prefix="check_profiling_")
+    os.environ.update(DATABASE_URL=f"sqlite:///{workdir}/orders.db", RATELIMIT_ENABLED="0",
+                      PROFILER_ENDPOINT="1")
+    warnings.simplefilter("ignore")   # the services' short JWT secret
+    import app as service
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Product
+    import migrations
+
+    app = service.app
+    with app.app_context():
+        migrations.bootstrap(db.engine)   # unicorn_master's step, the services no longer do it
+        db.session.add(User(username="buyer", email="buyer@example.com", password_hash="-"))
+        db.session.execute(db.insert(Product), [{"name": f"Product {i}", "price": 9.99, "stock": 10**9,
+                                                 "category": "bench"} for i in range(20)])
+        db.session.commit()
+        headers = {"Authorization": f"Bearer {create_access_token(identity='1')}"}
+    client = app.test_client()
+    for n in range(args.orders):
+        client.post("/api/orders", headers=headers,
+                    json={"items": [{"product_id": n % 20 + 1, "quantity": 1}, {"product_id": 20, "quantity": 2}]})
+    return app, client, headers
+
+
+def per_request(client, headers, requests):
+    client.get("/api/orders", headers=headers)   # warm up
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get("/api/orders", headers=headers)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def check(name, ok):
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return not ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--time-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    app, client, headers = boot(args)
+    if args.time_only:
+        print(per_request(client, headers, args.requests))
+        return
+
+    from sqlalchemy import event
+    from metrics import WorkerMetrics
+    from models import db
+
+    seen = [0]
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "after_cursor_execute", lambda *a: seen.__setitem__(0, seen[0] + 1))
+
+    failed = False
+    for method, path, body in (("POST", "/api/orders", {"items": [{"product_id": 1, "quantity": 1}]}),
+                               ("GET", "/api/orders", None)):
+        seen[0] = 0
+        response = client.open(path, method=method, headers=headers, json=body)
+        header = response.headers.get("Server-Timing", "")
+        print(f"  {method} {path}: {header}")
+        parts = {name: (float(dur), count) for name, dur, count in TIMING.findall(header)}
+        failed |= check(f"{method} query count matches the engine ({seen[0]})",
+                        parts.get("db", (0, None))[1] == str(seen[0]))
+        failed |= check(f"{method} parts add up to the total",
+                        sum(parts[name][0] for name in ("db", "jwt", "json", "app")) <= parts["total"][0] + 0.25)
+
+    series = WorkerMetrics.current().series
+    counted = series.get('unicorn_request_sql_queries_total{route="/api/orders",method="GET"}', [0, 0])[1]
+    failed |= check(f"GET /api/orders queries in the metrics ({counted})", counted == seen[0])
+
+    stop = threading.Event()
+
+    def list_orders():
+        other = app.test_client()
+        while not stop.is_set():
+            other.get("/api/orders", headers=headers)
+
+    lister = threading.Thread(target=list_orders)
+    lister.start()
+    try:
+        response = client.get("/debug/profile?seconds=2&hz=200")
+    finally:
+        stop.set()
+        lister.join()
+    lines = response.get_data(as_text=True).splitlines()
+    print(f"  profile: {response.headers.get('X-Profile-Samples')} samples, {len(lines)} distinct stacks")
+    failed |= check("folded stack format", bool(lines) and all(FOLDED.match(line) for line in lines))
+    failed |= check("stacks rooted at the route reach the view",
+                    any(line.startswith("GET /api/orders;") and "get_orders (orders/app.py:" in line
+                        for line in lines))
+    proxied = client.get("/debug/profile?seconds=0.1", headers={"X-Forwarded-For": "203.0.113.9"})
+    failed |= check("proxied profile request refused", proxied.status_code == 403)
+
+    on = per_request(client, headers, args.requests)
+    off = float(subprocess.run([sys.executable, __file__, "--time-only", "--orders", str(args.orders),
+                                "--requests", str(args.requests)], env=dict(os.environ, PROFILING="0"),
+                               capture_output=True, text=True, check=True).stdout.split()[-1])
+    print(f"  GET /api/orders ({args.orders} orders): {off:.0f} us with PROFILING=0, {on:.0f} us with it on")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Query-count check for the orders service
+
+Seeds a throwaway SQLite database with one user holding ORDERS orders of
+ITEMS items each, calls the orders endpoints through the Flask test client
+and counts the SQL statements each one runs. Fails (exit code 1) when an
+endpoint goes over its budget, which is what an N+1 regression looks like:
+the budgets do not grow with the number of orders or items.
+
+Usage: python benchmarks/check_queries.py [--orders 50] [--items 5] [-v]
+       (GROUP_COMMIT=1 to check the group-commit path)
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (method, url, budget); {order} is replaced with one of the seeded orders
+BUDGETS = [
+    ("GET", "/api/orders", 2),                  # orders, items joined with products
+    ("GET", "/api/orders?limit=20", 2),
+    ("GET", "/api/orders?stream=1", 2),         # per 500 orders
+    ("GET", "/api/orders/{order}", 2),
+    ("PUT", "/api/orders/{order}/status", 4),   # select, update, reload with items
+    ("POST", "/api/orders", 5),                 # reserve stock, order, items, reload
+]
+
+
+@contextmanager
+def count_queries(engines):
+    """Collect every statement sent to the database inside the block
+
+    Counts on every engine (reads go to the read-only one). BEGIN/SAVEPOINT/
+    RELEASE (group commit) are transaction control, not queries.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith(("BEGIN", "SAVEPOINT", "RELEASE", "ROLLBACK TO")):
+            statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the statements")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="check_queries_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/check.db"
+    sys.path.insert(0, str(ROOT / "app" / "orders"))
+    import app as orders
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Product, Order, OrderItem
+    import migrations
+
+    with orders.app.app_context():
+        migrations.bootstrap(db.engine)   # unicorn_master's step, the services no longer do it
+        user = User(username="buyer", email="buyer@example.com", password_hash="x")
+        db.session.add(user)
+        products = [Product(name=f"Product {i}", price=10.0, stock=10**6, category="general")
+                    for i in range(args.items * 4)]
+        db.session.add_all(products)
+        db.session.flush()
+        for n in range(args.orders):
+            order = Order(user_id=user.id, total_amount=10.0 * args.items)
+            db.session.add(order)
+            db.session.flush()
+            for i in range(args.items):
+                product = products[(n + i) % len(products)]
+                db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=10.0))
+        db.session.commit()
+        token = create_access_token(identity=str(user.id))
+        order_id = order.id
+        product_ids = [p.id for p in products[:args.items]]
+        engines = list(db.engines.values())
+
+    client = orders.app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    bodies = {
+        "PUT": {"status": "confirmed"},
+        "POST": {"items": [{"product_id": pid, "quantity": 1} for pid in product_ids]},
+    }
+
+    failed = False
+    print(f"{args.orders} orders x {args.items} items")
+    for method, url, budget in BUDGETS:
+        url = url.format(order=order_id)
+        with count_queries(engines) as statements:
+            response = client.open(url, method=method, headers=headers, json=bodies.get(method))
+            response.get_data()  # drain streamed responses inside the block
+        ok = response.status_code < 400 and len(statements) <= budget
+        failed |= not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {method:<4} {url:<28} {len(statements):>4} queries "
+              f"(budget {budget}, status {response.status_code})")
+        if args.verbose or not ok:
+            for statement in statements:
+                print("         " + " ".join(statement.split())[:150])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
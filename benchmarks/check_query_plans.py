@@ -0,0 +1,160 @@
+"""
+Query-plan check for the hot routes of all three services
+
+Seeds a throwaway SQLite database (migrated and analyzed, as production
+is), calls each route in ROUTES through the Flask test client, and runs
+EXPLAIN QUERY PLAN on every statement the route sent. Fails (exit code 1)
+when a plan reads a whole table instead of using an index:
+  - SCAN <table> (also "USING COVERING INDEX": the whole index)
+  - SEARCH <table> USING INTEGER PRIMARY KEY (rowid>?): the keyset cursor
+    alone, so every row after it is read and filtered; only routes that
+    list every active row (full=True) may do that
+  - USE TEMP B-TREE FOR ORDER BY over a range of a table: every match is
+    sorted before LIMIT, so a keyset page costs as much as the whole list
+    (sorting rows fetched by id, like the top search hits, is fine)
+The FTS index and subqueries are not tables and may be scanned.
+
+Usage: python benchmarks/check_query_plans.py [-v]
+"""
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+
+# (service, method, url, json body, full); {order} and {product} are seeded ids
+ROUTES = [
+    ("products", "GET", "/api/products", None, True),
+    ("products", "GET", "/api/products?limit=20", None, True),
+    ("products", "GET", "/api/products?stream=1", None, True),
+    ("products", "GET", "/api/products?category=books", None, False),
+    ("products", "GET", "/api/products?category=books&after_id={product}&limit=20", None, False),
+    ("products", "GET", "/api/products/{product}", None, False),
+    ("products", "GET", "/api/products/search?q=lap", None, False),
+    ("products", "PUT", "/api/products/{product}", {"stock": 500}, False),
+    ("orders", "GET", "/api/orders", None, False),
+    ("orders", "GET", "/api/orders?limit=10", None, False),
+    ("orders", "GET", "/api/orders/{order}", None, False),
+    ("orders", "POST", "/api/orders", {"items": [{"product_id": 2, "quantity": 1}, {"product_id": 3, "quantity": 2}]}, False),
+    ("orders", "PUT", "/api/orders/{order}/status", {"status": "confirmed"}, False),
+    ("users", "POST", "/api/auth/login", {"username": "buyer", "password": "secret"}, False),
+    ("users", "GET", "/api/users/me", None, False),
+    ("users", "PUT", "/api/users/me", {"email": "buyer2@example.com"}, False),
+]
+
+SCAN = re.compile(r"^SCAN (\w+)(?! VIRTUAL TABLE)")
+KEY_WALK = re.compile(r"^SEARCH (\w+) USING INTEGER PRIMARY KEY \(rowid[<>]=?\?( AND rowid[<>]=?\?)?\)$")
+SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+
+def full_reads(plan, tables, full):
+    """The plan lines that read a whole table"""
+    bad = []
+    for line in plan:
+        scan, walk = SCAN.match(line), KEY_WALK.match(line)
+        if scan and scan.group(1) in tables:
+            bad.append(line)
+        elif walk and walk.group(1) in tables and not full:
+            bad.append(line)
+        elif line == SORT and any(l.split()[1] in tables and not l.endswith("(rowid=?)")
+                                  for l in plan if l.startswith("SEARCH")):
+            bad.append(line)
+    return bad
+
+
+def load(service):
+    spec = importlib.util.spec_from_file_location(f"{service}_app", ROOT / "app" / service / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def capture(engine, statements):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return lambda: event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="check_query_plans_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/plans.db"
+    apps = {service: load(service) for service in ("products", "orders", "users")}
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Product, Order, OrderItem
+    import migrations
+
+    with apps["users"].app_context():
+        migrations.bootstrap(db.engine)   # unicorn_master's step, the services no longer do it
+        # enough users, orders and items that the statistics look like a
+        # real shop's; a table of a few rows is cheapest to scan
+        user = User(username="buyer", email="buyer@example.com")
+        user.set_password("secret")
+        db.session.add(user)
+        db.session.execute(db.insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"} for i in range(200)])
+        db.session.execute(db.insert(Product), [
+            {"name": f"Laptop {i}", "description": "a laptop", "price": 10.0, "stock": 1000,
+             "category": f"category-{i % 20}" if i % 5 else "books", "is_active": i % 10 != 0}
+            for i in range(2000)])
+        db.session.execute(db.insert(Order), [
+            {"user_id": user.id if n % 100 == 0 else 2 + n % 200, "total_amount": 10.0} for n in range(4000)])
+        db.session.execute(db.insert(OrderItem), [
+            {"order_id": n // 3 + 1, "product_id": n % 2000 + 1, "quantity": 1, "price": 10.0} for n in range(12000)])
+        db.session.commit()
+        migrations.analyze(db.engine)
+        token = create_access_token(identity=str(user.id))
+        order_id = db.session.execute(db.select(Order.id).filter_by(user_id=user.id)).scalars().first()
+        ids = {"order": order_id, "product": 4}
+        tables = set(db.metadata.tables)
+        engine = db.engine
+
+    failed = False
+    for service, method, url, body, full in ROUTES:
+        url = url.format(**ids)
+        with apps[service].app_context():
+            engines = set(db.engines.values())
+        statements = []
+        removers = [capture(e, statements) for e in engines]
+        try:
+            response = apps[service].test_client().open(
+                url, method=method, json=body, headers={"Authorization": f"Bearer {token}"})
+            response.get_data()  # drain streamed responses while capturing
+        finally:
+            for remove in removers:
+                remove()
+
+        scans = []
+        plans = []
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                plans.append((statement, plan))
+                scans += full_reads(plan, tables, full)
+        ok = response.status_code < 400 and not scans
+        failed |= not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {service:<8} {method:<4} {url:<58} {len(statements):>2} statements"
+              f"{'' if response.status_code < 400 else f', status {response.status_code}'}")
+        for statement, plan in plans:
+            if args.verbose or any(line in scans for line in plan):
+                print("         " + " ".join(statement.split())[:140])
+                for line in plan:
+                    print("           " + line)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Cross-worker accuracy and cost of the unicorn:// rate-limit storage
+
+Starts --workers processes that all hit one key as fast as they can, the
+way the workers of one service share a client's login limit, and counts
+how many hits were let through:
+  memory   - flask-limiter's old storage: every process counts alone
+  unicorn  - shared/ratelimit.py over a run/limits-style file
+Fails (exit code 1) unless the unicorn storage let through exactly
+--limit hits. It also times a single hit in one process, for both
+storages, with the slot count of the default unicorn_config.json.
+
+Usage: python benchmarks/check_rate_limits.py [--workers 4] [--limit 100] [--attempts 500]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+
+SLOTS = 19   # default unicorn_config.json: 8+1 products, 6+1 orders, 2+1 users
+
+
+def storage(kind):
+    from limits.storage import storage_from_string
+    import ratelimit  # noqa: F401 - registers unicorn://
+    return storage_from_string(f"{kind}://")
+
+
+def hammer(kind, path, slot, limit, attempts, start_at):
+    """One worker: try attempts hits on the shared key, return how many got through"""
+    from limits import parse
+    from limits.strategies import SlidingWindowCounterRateLimiter
+    os.environ.update(UNICORN_LIMITS=path, UNICORN_SLOT=str(slot))
+    limiter = SlidingWindowCounterRateLimiter(storage(kind))
+    item = parse(f"{limit} per hour")
+    limiter.test(item, "client")  # attach before the start line
+    time.sleep(max(0.0, start_at - time.time()))
+    return sum(limiter.hit(item, "client") for _ in range(attempts))
+
+
+def per_hit(kind, rounds=20000):
+    from limits import parse
+    from limits.strategies import SlidingWindowCounterRateLimiter
+    limiter = SlidingWindowCounterRateLimiter(storage(kind))
+    item = parse("1000000 per hour")
+    started = time.perf_counter()
+    for i in range(rounds):
+        limiter.hit(item, f"client-{i % 100}")
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--attempts", type=int, default=500, help="hits each worker tries")
+    args = parser.parse_args()
+
+    from ratelimit import LimitRegion
+    path = str(Path(tempfile.mkdtemp(prefix="check_rate_limits_")) / "limits")
+    context = multiprocessing.get_context("spawn")   # like unicorn_master's spawned workers
+    failed = False
+    for kind in ("memory", "unicorn"):
+        LimitRegion(path, slots=SLOTS).close()
+        start_at = time.time() + 3.0   # every worker has imported and attached by then
+        with context.Pool(args.workers) as pool:
+            results = [pool.apply_async(hammer, (kind, path, slot, args.limit, args.attempts, start_at))
+                       for slot in range(args.workers)]
+            passed = [r.get() for r in results]
+        ok = kind == "memory" or sum(passed) == args.limit
+        failed |= not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {kind:<8} {args.workers} workers x {args.attempts} hits, "
+              f"limit {args.limit}: {sum(passed)} let through {passed}")
+
+    os.environ.update(UNICORN_LIMITS=path, UNICORN_SLOT="0")
+    LimitRegion(path, slots=SLOTS).close()
+    for kind in ("memory", "unicorn"):
+        print(f"  {kind:<8} {per_hit(kind):6.1f} us per hit ({SLOTS} slots)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
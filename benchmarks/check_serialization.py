@@ -0,0 +1,129 @@
+"""
+Byte-compatibility check and timing for shared/serialization.py
+
+Seeds a throwaway SQLite database with products and orders whose values
+are awkward for a JSON encoder (non-ASCII and control characters, DEL,
+floats Python writes with an exponent, whole-second timestamps, NULLs).
+It then encodes the same lists two ways:
+  reference - ORM objects, to_dict(), Flask's default JSON provider
+  fast      - serialization.PRODUCT / order_dicts() rows, JSONProvider
+Exits 1 unless the bytes are identical. It also prints the time each
+path takes for the whole list. With the awkward floats in it, a list is
+encoded twice on the fast path (see serialization.py), so --plain times
+ordinary prices and names (accents still included).
+
+Usage: python benchmarks/check_serialization.py [--products 20000] [--orders 2000] [--plain]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+
+NAMES = ["Laptop Pro", "Café crème", "Model 1e5", "Weird \x7f del", 'Quote "q" \\ back', "Emoji \U0001F600",
+         "Tab\tnew\nline", "e-reader", "Plain"]
+PRICES = [19.99, 0.00001, 1e16, 2.5, 100.0, 1234567.891, 0.1 + 0.2, 7.0, 123.45]
+PLAIN_NAMES = ["Laptop Pro", "Café crème", "Desk lamp", "USB-C cable", "Chair", "Monitor 27\"", "Ёлка"]
+PLAIN_PRICES = [19.99, 2.5, 100.0, 1234.5, 0.1 + 0.2, 7.0, 123.45]
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--plain", action="store_true", help="no values that force the slow path")
+    args = parser.parse_args()
+    names, prices = (PLAIN_NAMES, PLAIN_PRICES) if args.plain else (NAMES, PRICES)
+
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    from models import db, User, Product, Order, OrderItem
+    import serialization
+    from serialization import PRODUCT, ORDER, order_dicts
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tempfile.mkdtemp(prefix='check_serialization_')}/s.db"
+    db.init_app(app)
+    reference, fast = DefaultJSONProvider(app), serialization.JSONProvider(app)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username="buyer", email="buyer@example.com", password_hash="x")
+        db.session.add(user)
+        db.session.flush()
+        db.session.execute(db.insert(Product), [
+            {"name": f"{names[i % len(names)]} {i}", "description": None if i % 5 == 0 else "d" * (i % 40),
+             "price": prices[i % len(prices)], "stock": i, "category": [None, "books", "garden"][i % 3],
+             "is_active": i % 11 != 0, "created_at": datetime(2024, 1, 1, 12, 0, i % 60, 0 if i % 7 == 0 else i),
+             "updated_at": datetime(2024, 1, 2, 12, 0, 0, i % 3)}
+            for i in range(args.products)])
+        db.session.execute(db.insert(Order), [
+            {"user_id": user.id, "status": "pending", "total_amount": prices[n % len(prices)]}
+            for n in range(args.orders)])
+        db.session.execute(db.insert(OrderItem), [
+            {"order_id": n // 3 + 1, "product_id": n * 7 % (args.products + 10) + 1, "quantity": n % 4 + 1,
+             "price": prices[n % len(prices)]}   # a few point at products that do not exist
+            for n in range(args.orders * 3)])
+        db.session.commit()
+
+        def encode(provider, payload):
+            return provider.dumps(payload, separators=(",", ":"))
+
+        def orm_products():
+            db.session.expunge_all()
+            return encode(reference, [p.to_dict() for p in Product.query.order_by(Product.id)])
+
+        def fast_products():
+            return encode(fast, PRODUCT.to_dicts(PRODUCT.query(Product.query.order_by(Product.id))))
+
+        def orm_orders():
+            db.session.expunge_all()
+            query = Order.query.options(db.selectinload(Order.items).joinedload(OrderItem.product))
+            return encode(reference, [o.to_dict() for o in query.order_by(Order.id)])
+
+        def fast_orders():
+            return encode(fast, order_dicts(ORDER.query(Order.query.order_by(Order.id)).all()))
+
+        failed = False
+        print(f"{args.products} products, {args.orders} orders, orjson "
+              f"{'installed' if serialization.orjson else 'not installed'}")
+        for label, slow_path, fast_path in (("products", orm_products, fast_products),
+                                            ("orders", orm_orders, fast_orders)):
+            expected, slow_ms = timed(slow_path)
+            body, fast_ms = timed(fast_path)
+            same = body == expected
+            failed |= not same
+            print(f"  {'ok  ' if same else 'FAIL'} {label:<9} reference {slow_ms:7.1f} ms   fast {fast_ms:7.1f} ms"
+                  f"   {len(body) // 1024} KB")
+            if not same:
+                at = next((i for i, (a, b) in enumerate(zip(expected, body)) if a != b), min(len(expected), len(body)))
+                print(f"       first difference at byte {at}:\n       {expected[at - 60:at + 40]!r}\n"
+                      f"       {body[at - 60:at + 40]!r}")
+
+        # the provider alone, on documents orjson would write differently
+        for document in ({"a": 1e-05}, {"b": 1e16}, {"c": "ü"}, {"d": "\x7f"}, {2: "x", 1: "y"}, {"e": 10**30},
+                         {"f": [1.5, "e5", "1e5"]}, {"g": datetime(2024, 1, 1)}):
+            same = encode(fast, document) == encode(reference, document)
+            failed |= not same
+            if not same:
+                print(f"  FAIL {document!r}: {encode(fast, document)!r} != {encode(reference, document)!r}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
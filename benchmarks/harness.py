@@ -0,0 +1,84 @@
+"""
+What the load scripts share: a seeded throwaway database and waiting for the services
+
+database() is an app context on a fresh SQLite file with the tables
+created and the services' JWT key, for seeding and minting tokens; seed()
+fills it with a small catalog and accounts. suite.py seeds through
+shared/dataset.py instead, so its data matches init_database.py's for the
+same sizes and seed. The services are then started under unicorn_master,
+whose BOOTSTRAP step migrates the schema and builds the search index.
+"""
+
+import random
+import sys
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# the master's schema step (see shared/migrations.py), as in unicorn_config.json
+BOOTSTRAP = [str(ROOT / "shared" / "migrations.py"), "bootstrap"]
+sys.path.insert(0, str(ROOT / "shared"))
+
+JWT_SECRET_KEY = "jwt-secret-key"   # the services', so the tokens minted here are accepted
+WORDS = ["laptop", "phone", "cable", "charger", "monitor", "keyboard", "mouse", "desk", "lamp", "chair",
+         "speaker", "camera", "router", "tablet", "watch", "headset"]
+
+
+def wait_for_port(port, timeout=60):
+    """Wait until the service on port answers /health"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"service on port {port} did not come up")
+
+
+@contextmanager
+def database(db_path):
+    """App context on db_path with the tables created; tokens() works inside it"""
+    from flask import Flask
+    from flask_jwt_extended import JWTManager
+    from models import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+    db.init_app(app)
+    JWTManager(app)
+    with app.app_context():
+        db.create_all()
+        yield db
+
+
+def tokens(user_ids):
+    """An access token per user id, as the users service would issue it"""
+    from flask_jwt_extended import create_access_token
+    return [create_access_token(identity=str(user_id)) for user_id in user_ids]
+
+
+def seed(db_path, users=1, password_hash="x", products=0, stock=10**9):
+    """users accounts user0, user1, ... and products in 20 categories; returns one token per user
+
+    Product names and descriptions come from WORDS with a fixed seed, so
+    every run searches the same catalog.
+    """
+    from models import User, Product
+
+    rng = random.Random(42)
+    with database(db_path) as db:
+        db.session.execute(db.insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash}
+            for i in range(users)])
+        if products:
+            db.session.execute(db.insert(Product), [
+                {"name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+                 "description": " ".join(rng.choices(WORDS, k=8)), "price": round(rng.uniform(1, 500), 2),
+                 "stock": stock, "category": f"category-{i % 20}"}
+                for i in range(products)])
+        db.session.commit()
+        return tokens(db.session.execute(db.select(User.id).order_by(User.id)).scalars().all())
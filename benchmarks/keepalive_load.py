@@ -0,0 +1,150 @@
+"""
+Many keep-alive clients against one products worker, waitress vs asgi
+
+Boots the products service under unicorn_master (one worker, 4 threads)
+on a throwaway SQLite database, once per serving mode:
+  waitress - the default
+  asgi     - "server": "asgi", shared/asgi.py under uvicorn
+Then --connections clients each open one HTTP/1.1 connection and keep it
+for the whole run. A client fetches a product, waits --think seconds and
+fetches the next one on the same connection. A request that has no
+answer after --timeout seconds counts as timed out. The script prints
+how many clients got any answer, requests/s, latency percentiles and
+failures per mode. Exits 1 if the asgi mode had any failure.
+
+Usage: python benchmarks/keepalive_load.py [--mode both|waitress|asgi] [--connections 2000]
+                                           [--think 5] [--seconds 20] [--timeout 10] [--out results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from harness import BOOTSTRAP, seed, wait_for_port
+from mixed_load import percentile
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+
+PRODUCTS_PORT = 5733
+CONTROL_PORT = 5796
+PRODUCTS = 500
+
+
+async def fetch(reader, writer, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                  if line.lower().startswith(b"content-length:"))
+    await reader.readexactly(length)
+    return status
+
+
+async def client(number, args, deadline, samples, answered):
+    rng = random.Random(number)
+    await asyncio.sleep(rng.uniform(0, args.think))   # spread the connects out
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", PRODUCTS_PORT),
+                                                args.timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        samples.append((type(e).__name__, 0.0))
+        return
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(fetch(reader, writer, f"/api/products/{rng.randint(1, PRODUCTS)}"),
+                                                args.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                samples.append((type(e).__name__, time.perf_counter() - started))
+                return
+            samples.append((status, time.perf_counter() - started))
+            answered.add(number)
+            await asyncio.sleep(args.think)
+    finally:
+        writer.close()
+
+
+async def load(args):
+    samples, answered = [], set()
+    deadline = time.monotonic() + args.seconds
+    await asyncio.gather(*(client(i, args, deadline, samples, answered) for i in range(args.connections)))
+    return samples, answered
+
+
+def run(mode, args, template):
+    workdir = Path(tempfile.mkdtemp(prefix=f"keepalive_load_{mode}_"))
+    db_path = workdir / "products.db"
+    shutil.copy(template, db_path)
+    services = [{"name": "products", "script": str(ROOT / "app" / "products" / "app.py"), "port": PRODUCTS_PORT,
+                 "workers": 1, "server": mode}]
+    (workdir / "unicorn_config.json").write_text(json.dumps({"services": services, "bootstrap": BOOTSTRAP,
+                                                             "control": {"port": CONTROL_PORT}}))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", RATELIMIT_ENABLED="0")
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config",
+                               str(workdir / "unicorn_config.json")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        wait_for_port(PRODUCTS_PORT)
+        samples, answered = asyncio.run(load(args))
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = sorted(seconds for status, seconds in samples if status == 200)
+    statuses = {}
+    for status, seconds in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report = {"answered": len(answered), "per_second": round(len(ok) / args.seconds, 1), "statuses": statuses}
+    if ok:
+        report.update({f"p{p}_ms": round(percentile(ok, p / 100) * 1000, 1) for p in (50, 95, 99)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=["both", "waitress", "asgi"], default="both")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--think", type=float, default=5, help="seconds a client waits between requests")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a request counts as lost")
+    parser.add_argument("--out", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    seed_dir = Path(tempfile.mkdtemp(prefix="keepalive_load_seed_"))
+    template = seed_dir / "seed.db"
+    seed(template, products=PRODUCTS)
+    modes = ["waitress", "asgi"] if args.mode == "both" else [args.mode]
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run(mode, args, template)
+    finally:
+        shutil.rmtree(seed_dir, ignore_errors=True)
+
+    print(f"{args.connections} keep-alive clients, one request per {args.think:g}s each, "
+          f"{args.seconds:.0f}s, 1 products worker")
+    print(f"  {'':<9}{'answered':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    failed = False
+    for mode, row in results.items():
+        print(f"  {mode:<9}{row['answered']:>9}{row['per_second']:>8}{row.get('p50_ms', '-'):>9}"
+              f"{row.get('p95_ms', '-'):>9}{row.get('p99_ms', '-'):>9}  {row['statuses']}")
+        if mode == "asgi":
+            failed |= set(row["statuses"]) != {"200"}
+    if args.out:
+        Path(args.out).write_text(json.dumps({"args": vars(args), "results": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Login throughput and /api/users/me latency while logins hash passwords
+
+Boots the users service under unicorn_master (one worker, 4 threads, rate
+limits off) on a throwaway SQLite database. For a fixed time, login
+threads log in as fast as they can while reader threads call
+/api/users/me and record its latency. It runs twice:
+  inline - PASSWORD_WORKERS=0 and no bound: hashing on the request threads,
+           as before shared/passwords.py
+  pool   - the defaults: one hashing process, at most threads - 1 hashes
+           pending; the rest get 503 with Retry-After
+A login client that gets 503 waits --backoff seconds before trying again.
+Exits 1 if any request fails outright.
+
+Usage: python benchmarks/login_load.py [--mode both|pool|inline] [--logins 8] [--readers 2]
+                                       [--seconds 15] [--workers 1] [--out results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from werkzeug.security import generate_password_hash
+
+from harness import BOOTSTRAP, ROOT, seed, wait_for_port
+from mixed_load import percentile, request
+
+USERS_PORT = 5732
+CONTROL_PORT = 5797
+PASSWORD = "correct horse battery staple"
+
+
+def login(number, deadline, backoff, record):
+    body = {"username": f"user{number}", "password": PASSWORD}
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        status = request("POST", f"http://127.0.0.1:{USERS_PORT}/api/auth/login", "", body)
+        record("login", status, time.perf_counter() - started)
+        if status == 503:
+            time.sleep(backoff)
+
+
+def me(token, deadline, record):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        status = request("GET", f"http://127.0.0.1:{USERS_PORT}/api/users/me", token)
+        record("me", status, time.perf_counter() - started)
+
+
+def run(mode, args, template, token):
+    workdir = Path(tempfile.mkdtemp(prefix=f"login_load_{mode}_"))
+    db_path = workdir / "users.db"
+    shutil.copy(template, db_path)
+    services = [{"name": "users", "script": str(ROOT / "app" / "users" / "app.py"), "port": USERS_PORT,
+                 "workers": args.workers}]
+    (workdir / "unicorn_config.json").write_text(json.dumps({"services": services, "bootstrap": BOOTSTRAP,
+                                                             "control": {"port": CONTROL_PORT}}))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", RATELIMIT_ENABLED="0")
+    if mode == "inline":
+        env.update(PASSWORD_WORKERS="0", PASSWORD_MAX_PENDING="1000")
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config",
+                               str(workdir / "unicorn_config.json")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    samples = {}
+    lock = threading.Lock()
+
+    def record(kind, status, seconds):
+        with lock:
+            samples.setdefault(kind, []).append((status, seconds))
+
+    try:
+        wait_for_port(USERS_PORT)
+        deadline = time.monotonic() + args.seconds
+        threads = [threading.Thread(target=login, args=(i + 1, deadline, args.backoff, record))
+                   for i in range(args.logins)]
+        threads += [threading.Thread(target=me, args=(token, deadline, record)) for _ in range(args.readers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {}
+    for kind, rows in sorted(samples.items()):
+        ok = sorted(seconds for status, seconds in rows if status == 200)
+        statuses = {}
+        for status, seconds in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report[kind] = {"requests": len(rows), "per_second": round(len(ok) / args.seconds, 1),
+                        "statuses": statuses}
+        if ok:
+            report[kind].update({f"p{p}_ms": round(percentile(ok, p / 100) * 1000, 1) for p in (50, 95, 99)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=["both", "pool", "inline"], default="both")
+    parser.add_argument("--logins", type=int, default=8, help="login client threads")
+    parser.add_argument("--readers", type=int, default=2, help="/api/users/me client threads")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--workers", type=int, default=1, help="users workers")
+    parser.add_argument("--backoff", type=float, default=1.0, help="seconds a login client waits after a 503")
+    parser.add_argument("--out", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    seed_dir = Path(tempfile.mkdtemp(prefix="login_load_seed_"))
+    template = seed_dir / "seed.db"
+    # one account per login thread plus a reader, hashed with werkzeug's defaults
+    token = seed(template, users=args.logins + 1, password_hash=generate_password_hash(PASSWORD))[0]
+    modes = ["inline", "pool"] if args.mode == "both" else [args.mode]
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run(mode, args, template, token)
+    finally:
+        shutil.rmtree(seed_dir, ignore_errors=True)
+
+    print(f"{args.logins} login + {args.readers} /me clients for {args.seconds:.0f}s, "
+          f"{args.workers} users worker(s)")
+    print(f"  {'':<8}{'kind':<7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    failed = False
+    for mode, report in results.items():
+        for kind, row in report.items():
+            print(f"  {mode:<8}{kind:<7}{row['per_second']:>8}{row.get('p50_ms', '-'):>9}"
+                  f"{row.get('p95_ms', '-'):>9}{row.get('p99_ms', '-'):>9}  {row['statuses']}")
+            failed |= any(status in ("error", "500") for status in row["statuses"])
+    if args.out:
+        Path(args.out).write_text(json.dumps({"args": vars(args), "results": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Mixed read/write load against products and orders, before and after the SQLite tuning
+
+Boots the products and orders services under unicorn_master on a throwaway
+SQLite database, then for a fixed time runs reader threads (product list
+pages, product search, the buyer's order list) next to writer threads
+(order placement). It does this twice on fresh copies of the same data:
+once with DB_TUNING=0 (rollback journal, Flask-SQLAlchemy's default pool,
+everything on db.session) and once with shared/database.py as configured,
+then prints requests/s and p50/p95/p99 latency for each kind of request.
+Exits 1 if any request fails outright.
+
+Usage: python benchmarks/mixed_load.py [--mode both|tuned|baseline] [--readers 16] [--writers 4]
+                                       [--seconds 20] [--products 20000] [--workers 2] [--out results.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from harness import BOOTSTRAP, ROOT, WORDS, seed, wait_for_port
+
+PRODUCTS_PORT = 5730
+ORDERS_PORT = 5731
+CONTROL_PORT = 5798
+
+
+def request(method, url, token, body=None):
+    headers = {"Authorization": f"Bearer {token}"}
+    data = None
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+        data = json.dumps(body).encode()
+    req = urllib.request.Request(url, method=method, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except OSError:
+        return "error"
+
+
+def reader(token, products, deadline, record):
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        kind = rng.choice(["list", "search", "orders"])
+        if kind == "list":
+            url = (f"http://127.0.0.1:{PRODUCTS_PORT}/api/products?category=category-{rng.randrange(20)}"
+                   f"&after_id={rng.randrange(products)}&limit=50")
+        elif kind == "search":
+            url = f"http://127.0.0.1:{PRODUCTS_PORT}/api/products/search?q={rng.choice(WORDS)}&limit=20"
+        else:
+            url = f"http://127.0.0.1:{ORDERS_PORT}/api/orders?limit=20"
+        started = time.perf_counter()
+        status = request("GET", url, token)
+        record(kind, status, time.perf_counter() - started)
+
+
+def writer(token, products, deadline, record):
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        items = [{"product_id": pid, "quantity": rng.randint(1, 3)}
+                 for pid in rng.sample(range(1, products + 1), rng.randint(1, 4))]
+        started = time.perf_counter()
+        status = request("POST", f"http://127.0.0.1:{ORDERS_PORT}/api/orders", token, {"items": items})
+        record("order", status, time.perf_counter() - started)
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run(mode, args, template, token):
+    workdir = Path(tempfile.mkdtemp(prefix=f"mixed_load_{mode}_"))
+    db_path = workdir / "mixed.db"
+    shutil.copy(template, db_path)
+    services = [{"name": name, "script": str(ROOT / "app" / name / "app.py"), "port": port,
+                 "workers": args.workers}
+                for name, port in (("products", PRODUCTS_PORT), ("orders", ORDERS_PORT))]
+    (workdir / "unicorn_config.json").write_text(json.dumps({"services": services, "bootstrap": BOOTSTRAP,
+                                                             "control": {"port": CONTROL_PORT}}))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", DB_TUNING="1" if mode == "tuned" else "0")
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config",
+                               str(workdir / "unicorn_config.json")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    samples = {}
+    lock = threading.Lock()
+
+    def record(kind, status, seconds):
+        with lock:
+            samples.setdefault(kind, []).append((status, seconds))
+
+    try:
+        wait_for_port(PRODUCTS_PORT)
+        wait_for_port(ORDERS_PORT)
+        deadline = time.monotonic() + args.seconds
+        threads = [threading.Thread(target=reader, args=(token, args.products, deadline, record))
+                   for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer, args=(token, args.products, deadline, record))
+                    for _ in range(args.writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {}
+    for kind, rows in sorted(samples.items()):
+        ok = sorted(seconds for status, seconds in rows if status in (200, 201))
+        statuses = {}
+        for status, seconds in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report[kind] = {"requests": len(rows), "per_second": round(len(ok) / args.seconds, 1),
+                        "statuses": statuses}
+        if ok:
+            report[kind].update({f"p{p}_ms": round(percentile(ok, p / 100) * 1000, 1) for p in (50, 95, 99)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=["both", "tuned", "baseline"], default="both")
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=2, help="workers per service")
+    parser.add_argument("--out", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    seed_dir = Path(tempfile.mkdtemp(prefix="mixed_load_seed_"))
+    template = seed_dir / "seed.db"
+    token = seed(template, products=args.products)[0]
+    modes = ["baseline", "tuned"] if args.mode == "both" else [args.mode]
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run(mode, args, template, token)
+    finally:
+        shutil.rmtree(seed_dir, ignore_errors=True)
+
+    print(f"{args.readers} readers + {args.writers} writers for {args.seconds:.0f}s, "
+          f"{args.workers} workers per service, {args.products} products")
+    print(f"  {'':<9}{'kind':<8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    failed = False
+    for mode, report in results.items():
+        for kind, row in report.items():
+            print(f"  {mode:<9}{kind:<8}{row['per_second']:>8}{row.get('p50_ms', '-'):>9}"
+                  f"{row.get('p95_ms', '-'):>9}{row.get('p99_ms', '-'):>9}  {row['statuses']}")
+            failed |= any(status in ("error", "500") for status in row["statuses"])
+    if args.out:
+        Path(args.out).write_text(json.dumps({"args": vars(args), "results": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Per-worker memory and startup time: spawned workers vs preload-and-fork
+
+Boots unicorn_master twice against a throwaway SQLite database, once with
+plain spawned workers and once with "preload": true, and reports for each:
+  - RSS, USS (memory unique to the worker) and PSS per worker
+  - time from master start until every worker is ready
+  - time from master start until the first /health answer
+  - time for a killed worker to be replaced and ready again
+
+Usage: python benchmarks/preload_memory.py [--service products] [--workers 4] [--out results.json]
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import psutil
+
+from harness import BOOTSTRAP
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+from scoreboard import Scoreboard, STATE_READY
+
+PORTS = {"products": 5710, "orders": 5720, "users": 5730}
+
+
+def wait_for(check, timeout=60, interval=0.005):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(interval)
+    raise TimeoutError("benchmark step timed out")
+
+
+def health_ok(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+            return resp.status == 200
+    except OSError:
+        return False
+
+
+def ready_slots(board, workers):
+    slots = [board.read(i) for i in range(workers)]
+    return slots if all(s["state"] == STATE_READY for s in slots) else None
+
+
+def run(service, workers, preload, workdir):
+    port = PORTS[service]
+    config = {
+        "services": [{"name": service, "script": str(ROOT / "app" / service / "app.py"),
+                      "port": port, "workers": workers, "preload": preload}],
+        "bootstrap": BOOTSTRAP,
+        # measure the restart itself, not the crash backoff of a young worker
+        "restart": {"stable_after": 0},
+    }
+    config_file = workdir / "unicorn_config.json"
+    config_file.write_text(json.dumps(config))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{workdir / 'bench.db'}")
+
+    started = time.monotonic()
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config", str(config_file)],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        wait_for(lambda: health_ok(port))
+        first_request = time.monotonic() - started
+        board = wait_for(lambda: (workdir / "run" / "scoreboard").exists() and Scoreboard(workdir / "run" / "scoreboard"))
+        wait_for(lambda: ready_slots(board, workers))
+        all_ready = time.monotonic() - started
+        time.sleep(1)  # let imports settle before sampling memory
+
+        memory = []
+        for child in psutil.Process(master.pid).children():
+            info = child.memory_full_info()
+            memory.append({"pid": child.pid, "rss_mb": info.rss / 2**20, "uss_mb": info.uss / 2**20,
+                           "pss_mb": getattr(info, "pss", 0) / 2**20})
+
+        victim = board.read(0)["pid"]
+        killed = time.monotonic()
+        os.kill(victim, signal.SIGKILL)
+        wait_for(lambda: board.read(0)["pid"] != victim and board.read(0)["state"] == STATE_READY)
+        restart = time.monotonic() - killed
+    finally:
+        master.terminate()
+        master.wait(timeout=15)
+
+    def avg(key):
+        return sum(m[key] for m in memory) / len(memory)
+
+    return {
+        "mode": "preload" if preload else "spawn",
+        "workers": len(memory),
+        "rss_mb": round(avg("rss_mb"), 1),
+        "uss_mb": round(avg("uss_mb"), 1),
+        "pss_mb": round(avg("pss_mb"), 1),
+        "first_request_s": round(first_request, 3),
+        "all_ready_s": round(all_ready, 3),
+        "restart_to_ready_s": round(restart, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--service", default="products", choices=sorted(PORTS))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--out", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for preload in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            results.append(run(args.service, args.workers, preload, Path(tmp)))
+
+    print(f"{'mode':8} {'RSS MB':>7} {'USS MB':>7} {'PSS MB':>7} {'1st req s':>10} {'ready s':>8} {'restart s':>10}")
+    for r in results:
+        print(f"{r['mode']:8} {r['rss_mb']:7.1f} {r['uss_mb']:7.1f} {r['pss_mb']:7.1f} "
+              f"{r['first_request_s']:10.3f} {r['all_ready_s']:8.3f} {r['restart_to_ready_s']:10.3f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"service": args.service, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Product search: FTS5 index vs the old ILIKE scan
+
+Fills a throwaway SQLite database with synthetic products, builds the
+products_fts index the way the products service does (shared/search.py)
+and times a few kinds of queries both ways:
+  - ilike      the query the endpoint used to run, all matches
+  - ilike 50   the same scan stopped after `limit` matches
+  - fts        search.search_products(q, limit), ranked
+
+Usage: python benchmarks/search_bench.py [--rows 1000000] [--limit 50] [--repeat 5] [--out results.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+
+from flask import Flask
+
+from models import db, Product
+import search
+
+CATEGORIES = ["electronics", "clothing", "footwear", "appliances", "books", "toys", "garden", "sports"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "ve", "dan", "tor", "lex", "mar", "zen", "qua"]
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    # shuffled so frequency is unrelated to spelling; fill() gives word i
+    # a weight of 1/(i+1), a Zipf-ish skew where a few words are everywhere
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def fill(path, rows, seed=42):
+    rng = random.Random(seed)
+    words = vocabulary(20000, rng)
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow().isoformat(" ")
+    chunk = 50000
+    for start in range(0, rows, chunk):
+        batch = []
+        for _ in range(min(chunk, rows - start)):
+            name = " ".join(rng.choices(words, cum_weights=cum_weights, k=3)).title()
+            description = " ".join(rng.choices(words, cum_weights=cum_weights, k=12))
+            batch.append((name, description, round(rng.uniform(1, 500), 2), rng.randint(0, 100),
+                          rng.choice(CATEGORIES), rng.random() > 0.05, now, now))
+        conn.executemany("INSERT INTO products (name, description, price, stock, category, is_active, "
+                         "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+    conn.close()
+    return words
+
+
+def old_search(q, limit=None):
+    query = Product.query.filter(
+        db.or_(Product.name.ilike(f'%{q}%'), Product.description.ilike(f'%{q}%')),
+        Product.is_active == True
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+        db.session.expunge_all()
+    return statistics.median(times) * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="search_bench_")
+    path = os.path.join(workdir, "bench.db")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        words = fill(path, args.rows)
+        print(f"Inserted {args.rows} products in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        search.install(db.engine)
+        build = time.perf_counter() - started
+        print(f"Built products_fts in {build:.1f}s, database is {os.path.getsize(path) / 1e6:.0f} MB")
+
+        queries = {
+            "common word": words[0],
+            "rare word": words[-1],
+            "two words": f"{words[3]} {words[40]}",
+            "prefix": words[10][:3],
+            "no match": "zzzzzz",
+        }
+        results = {"rows": args.rows, "limit": args.limit, "fts_build_seconds": build, "queries": {}}
+        print(f"\n{'query':<12} {'ilike ms':>10} {'hits':>8} {'ilike ' + str(args.limit) + ' ms':>12} "
+              f"{'fts ms':>9} {'hits':>6}")
+        for label, q in queries.items():
+            full_ms, full_hits = timed(lambda: old_search(q), args.repeat)
+            limited_ms, _ = timed(lambda: old_search(q, args.limit), args.repeat)
+            fts_ms, fts_hits = timed(lambda: search.search_products(q, args.limit), args.repeat)
+            print(f"{label:<12} {full_ms:>10.1f} {full_hits:>8} {limited_ms:>12.1f} {fts_ms:>9.1f} {fts_hits:>6}")
+            results["queries"][label] = {"q": q, "ilike_ms": full_ms, "ilike_hits": full_hits,
+                                         "ilike_limited_ms": limited_ms, "fts_ms": fts_ms, "fts_hits": fts_hits}
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Worker startup: what a service's import costs, and how soon a lost worker serves again
+
+For each service script, against a throwaway database that the master's
+bootstrap step (shared/migrations.py) has set up:
+  - imports the script in a fresh interpreter the way the master's preload
+    does, under python -X importtime, and splits the time into the bare
+    interpreter, imports (by top-level package, self time) and the
+    service's own setup (creating the app, init_app calls);
+  - boots it under unicorn_master, spawned and then preloaded, kills a
+    worker --restarts times and takes the time until the replacement is
+    ready and answers /health on its private port. A scale-out starts a
+    worker the same way (start_worker), so it takes as long.
+Exits 1 if any replacement took longer than --budget seconds.
+
+Usage: python benchmarks/startup_time.py [--services products,orders,users] [--restarts 3]
+                                          [--budget 1.0] [--top 8] [--out startup.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import psutil
+
+from harness import BOOTSTRAP
+from preload_memory import health_ok, ready_slots, wait_for
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "shared"))
+from scoreboard import Scoreboard, STATE_READY
+
+PORTS = {"products": 5750, "orders": 5751, "users": 5752, "combined": 5753}
+CONTROL_PORT = 5797
+WORKERS = 2
+
+MARK = "startup probe"
+# what the master's preload_service() does, timed
+PROBE = f"MARK = {MARK!r}" + """
+import importlib.util, sys, time
+print(MARK, file=sys.stderr, flush=True)   # what the interpreter imported at startup came before this
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("startup_probe", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+print(time.perf_counter() - started)
+"""
+
+
+def interpreter_seconds(env, runs=5):
+    """Best wall time of an interpreter that does nothing"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def import_profile(script, env):
+    """(seconds to import script, {top-level package: self seconds}) from -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE, str(script)], env=env,
+                            capture_output=True, text=True, check=True)
+    packages = {}
+    for line in result.stderr.split(MARK, 1)[1].splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.split(":", 1)[1].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return float(result.stdout.split()[-1]), packages
+
+
+def restarts(service, preload, restarts, workdir, env):
+    """Seconds from killing a worker until its replacement is ready and healthy, per kill"""
+    config = {"services": [{"name": service, "script": str(ROOT / "app" / service / "app.py"),
+                            "port": PORTS[service], "workers": WORKERS, "preload": preload}],
+              "bootstrap": BOOTSTRAP, "control": {"port": CONTROL_PORT},
+              # restart at once, as for a worker that had been up a while
+              "restart": {"stable_after": 0}}
+    config_file = workdir / "unicorn_config.json"
+    config_file.write_text(json.dumps(config))
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config", str(config_file)],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    times = []
+    try:
+        board = wait_for(lambda: (workdir / "run" / "scoreboard").exists() and Scoreboard(workdir / "run" / "scoreboard"))
+        wait_for(lambda: ready_slots(board, WORKERS))
+        for n in range(restarts):
+            slot = n % WORKERS
+            victim = board.read(slot)["pid"]
+            killed = time.monotonic()
+            psutil.Process(victim).kill()
+
+            def replaced():
+                state = board.read(slot)
+                return (state["pid"] != victim and state["state"] == STATE_READY
+                        and health_ok(state["health_port"]))
+
+            wait_for(replaced)
+            times.append(time.monotonic() - killed)
+            time.sleep(0.5)
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--services", default="products,orders,users", help="any of " + ",".join(PORTS))
+    parser.add_argument("--restarts", type=int, default=3, help="workers killed per service and mode")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds a replacement may take")
+    parser.add_argument("--top", type=int, default=8, help="packages listed per service")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+    services = [name for name in args.services.split(",") if name]
+    unknown = [name for name in services if name not in PORTS]
+    if unknown:
+        parser.error(f"unknown services {unknown}, pick from {sorted(PORTS)}")
+
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{workdir / 'startup.db'}")
+        subprocess.run([sys.executable, *BOOTSTRAP], env=env, check=True, stdout=subprocess.DEVNULL)
+        interpreter = interpreter_seconds(env)
+        print(f"interpreter start: {interpreter * 1000:.0f} ms")
+        for service in services:
+            seconds, packages = import_profile(ROOT / "app" / service / "app.py", env)
+            imports = sum(packages.values())
+            top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+            replaced = {mode: restarts(service, mode == "preload", args.restarts, workdir, env)
+                        for mode in ("spawn", "preload")}
+            results[service] = {
+                "import_s": round(seconds, 3), "imports_s": round(imports, 3),
+                "setup_s": round(max(seconds - imports, 0), 3),
+                "packages_s": {name: round(value, 3) for name, value in top},
+                "restart_s": {mode: [round(t, 3) for t in times] for mode, times in replaced.items()},
+            }
+            print(f"{service}: import {seconds * 1000:.0f} ms = imports {imports * 1000:.0f} ms"
+                  f" + setup {max(seconds - imports, 0) * 1000:.0f} ms")
+            print("  " + ", ".join(f"{name} {value * 1000:.0f}" for name, value in top))
+            for mode, times in replaced.items():
+                slow = max(times) > args.budget
+                failed |= slow
+                print(f"  {'FAIL' if slow else 'ok  '} {mode:7} restart to ready: median"
+                      f" {statistics.median(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps({"interpreter_s": round(interpreter, 3), "budget_s": args.budget,
+                                              "services": results}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Concurrent order stress test: no overselling
+
+Boots the orders service under unicorn_master (2 workers x 4 threads by
+default) on a throwaway SQLite database holding a few products with little
+stock, then places orders from many client threads at once for a fixed
+time, long enough to sell most of the stock out. Afterwards it checks the database:
+  - no product has negative stock
+  - for every product, stock sold == sum of its order_items quantities
+  - every 201 response has an order row, and no other response does
+Exits 1 if any check fails.
+
+Usage: python benchmarks/stress_inventory.py [--clients 32] [--products 10] [--stock 200] [--seconds 20]
+                                            [--group-commit]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from harness import BOOTSTRAP, ROOT, seed, wait_for_port
+
+PORT = 5720
+
+
+def place_orders(token, product_ids, deadline, results, lock):
+    rng = random.Random()
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    while time.monotonic() < deadline:
+        items = [{"product_id": pid, "quantity": rng.randint(1, 3)}
+                 for pid in rng.sample(product_ids, rng.randint(1, 3))]
+        request = urllib.request.Request(f"http://127.0.0.1:{PORT}/api/orders", method="POST",
+                                         data=json.dumps({"items": items}).encode(), headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as resp:
+                status, body = resp.status, json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            status, body = e.code, json.loads(e.read() or b"{}")
+        except OSError as e:
+            status, body = "error", {"error": repr(e)}
+        with lock:
+            results.setdefault(status, []).append(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--group-commit", action="store_true", help="run the orders service with GROUP_COMMIT=1")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="stress_inventory_"))
+    db_path = workdir / "stress.db"
+    token = seed(db_path, products=args.products, stock=args.stock)[0]
+    config = {"services": [{"name": "orders", "script": str(ROOT / "app" / "orders" / "app.py"),
+                            "port": PORT, "workers": args.workers, "threads": args.threads}],
+              "bootstrap": BOOTSTRAP, "control": {"port": 5799}}
+    (workdir / "unicorn_config.json").write_text(json.dumps(config))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", GROUP_COMMIT="1" if args.group_commit else "0")
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config",
+                               str(workdir / "unicorn_config.json")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    results = {}
+    try:
+        wait_for_port(PORT)
+        product_ids = list(range(1, args.products + 1))
+        lock = threading.Lock()
+        started = time.monotonic()
+        threads = [threading.Thread(target=place_orders, args=(token, product_ids, started + args.seconds,
+                                                               results, lock))
+                   for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+        metrics = {}
+        with urllib.request.urlopen("http://127.0.0.1:5799/metrics") as resp:
+            for line in resp.read().decode().splitlines():
+                if line.startswith("unicorn_group_commit"):
+                    name, value = line.rsplit(" ", 1)
+                    metrics[name.split("{")[0]] = float(value)
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+
+    conn = sqlite3.connect(db_path)
+    stock = dict(conn.execute("SELECT id, stock FROM products"))
+    sold = dict(conn.execute("SELECT product_id, SUM(quantity) FROM order_items GROUP BY product_id"))
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    created = [body["order"]["id"] for body in results.get(201, [])]
+
+    attempts = sum(len(v) for v in results.values())
+    print(f"{attempts} order attempts from {args.clients} clients in {elapsed:.1f}s "
+          f"({attempts / elapsed:.0f}/s) against {args.workers} workers x {args.threads} threads"
+          f"{', group commit' if args.group_commit else ''}")
+    if metrics:
+        transactions = metrics["unicorn_group_commit_transactions_total"]
+        jobs = metrics["unicorn_group_commit_jobs_total"]
+        print(f"  {jobs:.0f} writes in {transactions:.0f} transactions ({jobs / transactions:.1f} per commit)")
+    for status, bodies in sorted(results.items(), key=str):
+        print(f"  {status}: {len(bodies)}")
+    print(f"  units sold {sum(sold.values())} of {args.products * args.stock}, "
+          f"products sold out {sum(1 for s in stock.values() if s == 0)}/{args.products}")
+
+    problems = []
+    for product_id, left in stock.items():
+        if left < 0:
+            problems.append(f"product {product_id} oversold: stock {left}")
+        if args.stock - left != sold.get(product_id, 0):
+            problems.append(f"product {product_id}: stock went down by {args.stock - left} "
+                            f"but order items hold {sold.get(product_id, 0)}")
+    if orders != len(created) or len(set(created)) != len(created):
+        problems.append(f"{len(created)} orders acknowledged but {orders} in the database")
+    if results.get("error") or results.get(500):
+        problems.append("requests failed outright, see above")
+    for problem in problems:
+        print("FAIL " + problem)
+    if not problems:
+        print("ok: no overselling, stock and order items agree")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
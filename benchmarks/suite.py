@@ -0,0 +1,393 @@
+"""
+Load-test suite for all three services, with JSON results to diff
+
+run      Generates a throwaway SQLite database with shared/dataset.py
+         (--users, --products, --items, --seed: the same rows as
+         init_database.py with those sizes and seed) and raises the stock
+         of the active products so the run never sells one out. It then
+         starts products, orders and users under unicorn_master
+         (--workers each, --server waitress|asgi, --preload) and drives
+         them from --clients threads. With --layout combined the three
+         run mounted in one service instead (app/combined/app.py, see
+         shared/combined.py) with --workers workers in all. Each client
+         keeps one keep-alive connection per service and picks its next
+         request from --mix by weight:
+           list    GET  /api/products?category=...&after_id=...&limit=50
+           search  GET  /api/products/search?q=<word from a product name>&limit=20
+           order   POST /api/orders with 1-4 random active products
+           login   POST /api/auth/login
+           me      GET  /api/users/me
+         Requests in the first --warmup seconds are not counted. Then
+         --rounds windows of --seconds each are measured back to back.
+         For each kind it reports requests/s, p50/p95/p99 and mean
+         latency, status counts and a latency histogram over all rounds,
+         plus requests/s and p95 for each round, and the peak memory of
+         the master's child processes while measuring (RSS, USS and, on
+         Linux, PSS, which splits shared pages between the processes;
+         needs psutil). --out saves them as JSON, with
+         the git commit, Python version and machine they came from. Rate
+         limits are off; a login may still get 503 from the hashing bound
+         (shared/passwords.py). Exits 1 if any request fails outright.
+compare  Prints the change per kind between two saved runs. A kind has
+         regressed when its throughput fell, or its p95 rose, by more
+         than --threshold percent and every round of the new run is
+         worse than every round of the base run. Small runs on a busy
+         machine vary by tens of percent, and the round ranges keep
+         that noise from being flagged. Exits 1 if any kind regressed.
+
+The clients run on the same machine as the services, so compare runs made
+on the same machine with the same arguments. The services get this
+script's environment, so settings such as DB_TUNING=0 or
+PASSWORD_WORKERS=2 can be compared without code changes.
+
+Usage: python benchmarks/suite.py run [--clients 16] [--seconds 20] [--rounds 3] [--warmup 5]
+                                      [--mix list=40,search=20,order=10,login=5,me=25]
+                                      [--products 20000] [--users 50] [--items 0] [--workers 2]
+                                      [--server waitress|asgi] [--layout services|combined]
+                                      [--preload] [--seed 1] [--out run.json]
+       python benchmarks/suite.py compare base.json new.json [--threshold 10]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from harness import BOOTSTRAP, ROOT, database, tokens, wait_for_port
+from mixed_load import percentile
+from dataset import CATEGORIES
+
+PORTS = {"products": 5740, "orders": 5741, "users": 5742}
+COMBINED_PORT = 5743
+CONTROL_PORT = 5795
+PASSWORD = "correct horse battery staple"
+KINDS = ["list", "search", "order", "login", "me"]
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def seed(db_path, args):
+    """Generate the dataset; returns what the clients pick from
+
+    The active users' names and tokens, the active product ids, and the
+    words of the first product names as search terms.
+    """
+    import dataset
+    from models import User, Product
+
+    with database(db_path) as db:
+        dataset.generate(db.engine, args.users, args.products, args.items, seed=args.seed, password=PASSWORD)
+        db.session.execute(db.update(Product).where(Product.is_active == True).values(stock=10**9))
+        db.session.commit()
+        users = db.session.execute(db.select(User.id, User.username).where(User.is_active == True)
+                                   .order_by(User.id)).all()
+        names = db.session.execute(db.select(Product.name).order_by(Product.id).limit(1000)).scalars()
+        return {"usernames": [user.username for user in users], "tokens": tokens(user.id for user in users),
+                "products": db.session.execute(db.select(Product.id).where(Product.is_active == True)
+                                               .order_by(Product.id)).scalars().all(),
+                "words": sorted({word.lower() for name in names for word in name.split()})}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in KINDS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"bad mix entry {part!r}, use kind=weight with kind in {KINDS}")
+        mix[kind] = int(weight)
+    return {kind: weight for kind, weight in mix.items() if weight}
+
+
+class Client:
+    """One simulated user: a keep-alive connection per service"""
+
+    def __init__(self, number, args, data):
+        self.rng = random.Random(args.seed * 100003 + number)
+        self.user = number % len(data["tokens"])
+        self.token = data["tokens"][self.user]
+        self.data = data
+        self.args = args
+        self.ports = service_ports(args.layout)
+        self.connections = {}
+
+    def call(self, service, method, path, body=None, auth=True):
+        connection = self.connections.get(service)
+        if connection is None:
+            connection = self.connections[service] = http.client.HTTPConnection("127.0.0.1", self.ports[service],
+                                                                                timeout=30)
+        headers = {"Authorization": f"Bearer {self.token}"} if auth else {}
+        data = None
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            data = json.dumps(body)
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.will_close:
+                self.close(service)
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close(service)
+            return "error"
+
+    def close(self, service):
+        connection = self.connections.pop(service, None)
+        if connection is not None:
+            connection.close()
+
+    def request(self, kind):
+        rng = self.rng
+        if kind == "list":
+            return self.call("products", "GET", f"/api/products?category={rng.choice(CATEGORIES)}"
+                                                f"&after_id={rng.randrange(self.args.products)}&limit=50", auth=False)
+        if kind == "search":
+            return self.call("products", "GET", f"/api/products/search?q={rng.choice(self.data['words'])}&limit=20",
+                             auth=False)
+        if kind == "order":
+            items = [{"product_id": pid, "quantity": rng.randint(1, 3)}
+                     for pid in rng.sample(self.data["products"], rng.randint(1, 4))]
+            return self.call("orders", "POST", "/api/orders", {"items": items})
+        if kind == "login":
+            return self.call("users", "POST", "/api/auth/login",
+                             {"username": self.data["usernames"][self.user], "password": PASSWORD}, auth=False)
+        return self.call("users", "GET", "/api/users/me")
+
+
+def service_ports(layout):
+    """Port of each service; all the same one in the combined layout"""
+    if layout == "combined":
+        return {name: COMBINED_PORT for name in PORTS}
+    return dict(PORTS)
+
+
+def memory(pid):
+    """Memory of pid's descendants in MB summed, or None without psutil"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    total = {"processes": 0, "rss_mb": 0.0, "uss_mb": 0.0, "pss_mb": 0.0}
+    for process in psutil.Process(pid).children(recursive=True):
+        try:
+            info = process.memory_full_info()
+        except psutil.Error:
+            continue
+        total["processes"] += 1
+        total["rss_mb"] += info.rss / 2**20
+        total["uss_mb"] += info.uss / 2**20
+        total["pss_mb"] += getattr(info, "pss", 0) / 2**20
+    return {name: round(value, 1) for name, value in total.items()}
+
+
+def watch_memory(pid, measure_from, deadline, peak):
+    """Keep the largest memory() sample taken while measuring in peak"""
+    while time.monotonic() < deadline:
+        if time.monotonic() >= measure_from:
+            sample = memory(pid)
+            if sample is None:
+                return
+            for name, value in sample.items():
+                peak[name] = max(peak.get(name, 0), value)
+        time.sleep(1)
+
+
+def drive(client, mix, measure_from, deadline, record):
+    kinds, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        kind = client.rng.choices(kinds, weights)[0]
+        started = time.perf_counter()
+        status = client.request(kind)
+        finished = time.monotonic()
+        if measure_from <= finished < deadline:
+            record(kind, status, time.perf_counter() - started, finished - measure_from)
+    for service in list(client.connections):
+        client.close(service)
+
+
+def summarize(rows, seconds, rounds=None):
+    """rows are (status, seconds taken, round); rounds=None skips the per-round figures"""
+    ok = sorted(elapsed for status, elapsed, _ in rows if status in (200, 201))
+    statuses = {}
+    for status, _, _ in rows:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for elapsed in ok:
+        counts[next((i for i, bound in enumerate(BUCKETS_MS) if elapsed * 1000 <= bound), len(BUCKETS_MS))] += 1
+    summary = {"requests": len(rows), "ok": len(ok), "per_second": round(len(ok) / (seconds * (rounds or 1)), 1),
+               "statuses": statuses, "histogram": {"le_ms": BUCKETS_MS + ["inf"], "counts": counts}}
+    if ok:
+        summary["mean_ms"] = round(sum(ok) / len(ok) * 1000, 1)
+        summary.update({f"p{p}_ms": round(percentile(ok, p / 100) * 1000, 1) for p in (50, 95, 99)})
+    if rounds:
+        per_round = [summarize([row for row in rows if row[2] == n], seconds) for n in range(rounds)]
+        summary["rounds"] = {"per_second": [r["per_second"] for r in per_round],
+                             "p95_ms": [r.get("p95_ms") for r in per_round]}
+    return summary
+
+
+def machine():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def run(args):
+    mix = args.mix
+    workdir = Path(tempfile.mkdtemp(prefix="suite_"))
+    db_path = workdir / "suite.db"
+    data = seed(db_path, args)
+    if args.layout == "combined":
+        layout = {"combined": COMBINED_PORT}
+    else:
+        layout = PORTS
+    services = [{"name": name, "script": str(ROOT / "app" / name / "app.py"), "port": port,
+                 "workers": args.workers, "threads": args.threads, "server": args.server,
+                 "preload": args.preload}
+                for name, port in layout.items()]
+    (workdir / "unicorn_config.json").write_text(json.dumps({"services": services, "bootstrap": BOOTSTRAP,
+                                                             "control": {"port": CONTROL_PORT}}))
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", RATELIMIT_ENABLED="0")
+    master = subprocess.Popen([sys.executable, str(ROOT / "unicorn_master.py"), "--config",
+                               str(workdir / "unicorn_config.json")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    samples = {kind: [] for kind in mix}
+    peak = {}
+    lock = threading.Lock()
+
+    def record(kind, status, seconds, since_start):
+        with lock:
+            samples[kind].append((status, seconds, int(since_start // args.seconds)))
+
+    try:
+        for port in layout.values():
+            wait_for_port(port)
+        measure_from = time.monotonic() + args.warmup
+        deadline = measure_from + args.seconds * args.rounds
+        threads = [threading.Thread(target=drive, args=(Client(i, args, data), mix, measure_from, deadline, record))
+                   for i in range(args.clients)]
+        threads.append(threading.Thread(target=watch_memory, args=(master.pid, measure_from, deadline, peak)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {kind: summarize(rows, args.seconds, args.rounds) for kind, rows in samples.items()}
+    results["total"] = summarize([row for rows in samples.values() for row in rows], args.seconds, args.rounds)
+    del results["total"]["histogram"]
+    arguments = {key: value for key, value in vars(args).items() if key not in ("command", "out")}
+    report = {"machine": machine(), "args": arguments, "results": results, "memory": peak or None}
+
+    print(f"{args.clients} clients for {args.rounds} x {args.seconds:g}s (+{args.warmup:g}s warmup), {args.workers} "
+          f"{args.server} worker(s) x {args.threads} threads per service ({args.layout}"
+          f"{', preloaded' if args.preload else ''}), mix " + ",".join(f"{kind}={weight}" for kind, weight in mix.items()))
+    print(f"  {'kind':<8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}  statuses")
+    for kind, row in results.items():
+        print(f"  {kind:<8}{row['per_second']:>8}{row.get('p50_ms', '-'):>9}{row.get('p95_ms', '-'):>9}"
+              f"{row.get('p99_ms', '-'):>9}{row.get('mean_ms', '-'):>9}  {row['statuses']}")
+    if peak:
+        print(f"  memory: {peak['processes']} processes, RSS {peak['rss_mb']} MB, USS {peak['uss_mb']} MB, "
+              f"PSS {peak['pss_mb']} MB (peak)")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"  saved {args.out}")
+    return 1 if "error" in results["total"]["statuses"] else 0
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def slower(old, new, field, sign, threshold):
+    """True if field moved the bad way (sign 1: up, -1: down) past threshold percent and past every base round"""
+    delta = change(old.get(field), new.get(field))
+    if delta is None or delta * sign <= threshold:
+        return False
+    base_rounds = [v for v in old.get("rounds", {}).get(field, []) if v is not None]
+    new_rounds = [v for v in new.get("rounds", {}).get(field, []) if v is not None]
+    if not base_rounds or not new_rounds:
+        return True
+    if sign > 0:
+        return min(new_rounds) > max(base_rounds)
+    return max(new_rounds) < min(base_rounds)
+
+
+def compare(args):
+    base, new = (json.loads(Path(path).read_text()) for path in (args.base, args.new))
+    for key in ("clients", "seconds", "rounds", "mix", "products", "users", "items", "seed", "workers", "threads",
+                "server", "layout", "preload"):
+        if base["args"].get(key) != new["args"].get(key):
+            print(f"  note: {key} differs ({base['args'].get(key)} -> {new['args'].get(key)})")
+    if base["machine"]["platform"] != new["machine"]["platform"]:
+        print(f"  note: different machines ({base['machine']['platform']} -> {new['machine']['platform']})")
+    print(f"  {base['machine']['commit']} -> {new['machine']['commit']}, threshold {args.threshold:g}%")
+    print(f"  {'kind':<8}" + "".join(f" {title:>25}" for title in ("req/s", "p50 ms", "p95 ms", "p99 ms")))
+    regressed = False
+    for kind in list(base["results"]) + [k for k in new["results"] if k not in base["results"]]:
+        old, cur = base["results"].get(kind), new["results"].get(kind)
+        if old is None or cur is None:
+            print(f"  {kind:<8}only in {'new' if old is None else 'base'}")
+            continue
+        cells = []
+        for field in ("per_second", "p50_ms", "p95_ms", "p99_ms"):
+            delta = change(old.get(field), cur.get(field))
+            cells.append(f"{old.get(field, '-')} -> {cur.get(field, '-')}"
+                         + ("" if delta is None else f" ({delta:+.0f}%)"))
+        worse = kind != "total" and (slower(old, cur, "per_second", -1, args.threshold)
+                                     or slower(old, cur, "p95_ms", 1, args.threshold))
+        regressed |= worse
+        print(f"  {kind:<8}" + "".join(f" {cell:>25}" for cell in cells) + ("  REGRESSED" if worse else ""))
+    if base.get("memory") and new.get("memory"):
+        print("  memory  " + ", ".join(f"{name} {base['memory'][name]} -> {new['memory'][name]}"
+                                       for name in ("processes", "rss_mb", "uss_mb", "pss_mb")))
+    return 1 if regressed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="boot the services and load them")
+    run_parser.add_argument("--clients", type=int, default=16)
+    run_parser.add_argument("--seconds", type=float, default=20, help="seconds per measured round")
+    run_parser.add_argument("--rounds", type=int, default=3)
+    run_parser.add_argument("--warmup", type=float, default=5, help="seconds before measuring")
+    run_parser.add_argument("--mix", type=parse_mix, default="list=40,search=20,order=10,login=5,me=25")
+    run_parser.add_argument("--products", type=int, default=20000)
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--items", type=int, default=0, help="order items generated before the run")
+    run_parser.add_argument("--workers", type=int, default=2, help="workers per service")
+    run_parser.add_argument("--layout", choices=["services", "combined"], default="services",
+                            help="a service each, or all three mounted in one (app/combined/app.py)")
+    run_parser.add_argument("--preload", action="store_true", help="fork the workers from a preloaded app")
+    run_parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    run_parser.add_argument("--server", choices=["waitress", "asgi"], default="waitress")
+    run_parser.add_argument("--seed", type=int, default=1, help="seeds the data and every client's choices")
+    run_parser.add_argument("--out", help="write the results as JSON")
+    compare_parser = commands.add_parser("compare", help="diff two saved runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="percent that counts as a regression")
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == "run" else compare(args))
+
+
+if __name__ == "__main__":
+    main()
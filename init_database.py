@@ -1,73 +1,105 @@
 """
-Initialize database with sample data
+Initialize the database: the demo data, or a generated dataset at scale
+
+    python init_database.py                          admin, testuser and 10 sample products
+    python init_database.py --scale large            1M users, 200k products, 10M order items
+    python init_database.py --users 5000 --products 20000 --items 500000 --seed 7
+
+Scales and the shape of the generated data are in shared/dataset.py; the
+same sizes and seed always give the same rows. Never asks: a database that
+already has data is left alone unless --reset is given, which drops and
+recreates every table first. DATABASE_URL (or --database) picks the
+database, as for the services. The schema, migrations and search index
+come from migrations.bootstrap(), the step unicorn_master runs at start.
 """
 
+import argparse
+import os
 import sys
-sys.path.insert(0, 'C:/production/shared')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
 
 from flask import Flask
+
 from models import db, User, Product
 from config import config
+import dataset
+import migrations
+
+DEMO_PRODUCTS = [
+    dict(name='Laptop', description='High-performance laptop', price=999.99, stock=10, category='electronics'),
+    dict(name='Smartphone', description='Latest model smartphone', price=699.99, stock=25, category='electronics'),
+    dict(name='Headphones', description='Noise-cancelling headphones', price=199.99, stock=50, category='electronics'),
+    dict(name='T-Shirt', description='Cotton t-shirt', price=19.99, stock=100, category='clothing'),
+    dict(name='Jeans', description='Denim jeans', price=49.99, stock=75, category='clothing'),
+    dict(name='Running Shoes', description='Comfortable running shoes', price=79.99, stock=40, category='footwear'),
+    dict(name='Coffee Maker', description='Automatic coffee maker', price=89.99, stock=20, category='appliances'),
+    dict(name='Blender', description='High-speed blender', price=59.99, stock=30, category='appliances'),
+    dict(name='Backpack', description='Durable backpack', price=39.99, stock=60, category='accessories'),
+    dict(name='Water Bottle', description='Insulated water bottle', price=24.99, stock=80, category='accessories'),
+]
 
-app = Flask(__name__)
-app.config.from_object(config['production'])
-db.init_app(app)
-
-with app.app_context():
-    # Create tables
-    db.create_all()
-    print("✅ Database tables created")
-    
-    # Check if data already exists
-    if User.query.first() or Product.query.first():
-        print("⚠️  Database already contains data")
-        response = input("Clear and reinitialize? (yes/no): ")
-        if response.lower() != 'yes':
-            print("Aborted")
-            exit()
-        
-        db.drop_all()
-        db.create_all()
-        print("✅ Database cleared and recreated")
-    
-    # Create admin user
-    admin = User(
-        username='admin',
-        email='admin@example.com'
-    )
+
+def demo():
+    """The two accounts and ten products the API docs and test_api.ps1 use"""
+    admin = User(username='admin', email='admin@example.com')
     admin.set_password('admin123')
-    db.session.add(admin)
-    print("✅ Admin user created (username: admin, password: admin123)")
-    
-    # Create test user
-    test_user = User(
-        username='testuser',
-        email='test@example.com'
-    )
+    test_user = User(username='testuser', email='test@example.com')
     test_user.set_password('test123')
-    db.session.add(test_user)
-    print("✅ Test user created (username: testuser, password: test123)")
-    
-    # Create sample products
-    products = [
-        Product(name='Laptop', description='High-performance laptop', price=999.99, stock=10, category='electronics'),
-        Product(name='Smartphone', description='Latest model smartphone', price=699.99, stock=25, category='electronics'),
-        Product(name='Headphones', description='Noise-cancelling headphones', price=199.99, stock=50, category='electronics'),
-        Product(name='T-Shirt', description='Cotton t-shirt', price=19.99, stock=100, category='clothing'),
-        Product(name='Jeans', description='Denim jeans', price=49.99, stock=75, category='clothing'),
-        Product(name='Running Shoes', description='Comfortable running shoes', price=79.99, stock=40, category='footwear'),
-        Product(name='Coffee Maker', description='Automatic coffee maker', price=89.99, stock=20, category='appliances'),
-        Product(name='Blender', description='High-speed blender', price=59.99, stock=30, category='appliances'),
-        Product(name='Backpack', description='Durable backpack', price=39.99, stock=60, category='accessories'),
-        Product(name='Water Bottle', description='Insulated water bottle', price=24.99, stock=80, category='accessories'),
-    ]
-    
-    for product in products:
-        db.session.add(product)
-    
+    db.session.add_all([admin, test_user] + [Product(**product) for product in DEMO_PRODUCTS])
     db.session.commit()
-    print(f"✅ Created {len(products)} sample products")
-    
+    print("✅ Admin user created (username: admin, password: admin123)")
+    print("✅ Test user created (username: testuser, password: test123)")
+    print(f"✅ Created {len(DEMO_PRODUCTS)} sample products")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the tables and fill them with demo or generated data")
+    parser.add_argument("--database", default=None, help="SQLAlchemy URL (default: DATABASE_URL or the production path)")
+    parser.add_argument("--reset", action="store_true", help="drop every table first if the database has data")
+    parser.add_argument("--scale", choices=sorted(dataset.SCALES), help="generate a preset size")
+    parser.add_argument("--users", type=int, help="generate this many users")
+    parser.add_argument("--products", type=int, help="generate this many products")
+    parser.add_argument("--items", type=int, help="generate orders until there are this many order items")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="password of every generated user")
+    args = parser.parse_args()
+
+    sizes = dict(dataset.SCALES[args.scale]) if args.scale else {}
+    sizes.update({name: getattr(args, name) for name in ("users", "products", "items")
+                  if getattr(args, name) is not None})
+    if sizes:
+        sizes = {**dataset.SCALES["small"], **sizes}
+
+    app = Flask(__name__)
+    app.config.from_object(config['production'])
+    if args.database:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+    db.init_app(app)
+
+    with app.app_context():
+        migrations.bootstrap(db.engine)
+        print("✅ Database tables created")
+        if User.query.first() or Product.query.first():
+            if not args.reset:
+                print("⚠️  Database already contains data, left as it is (--reset to recreate it)")
+                return
+            db.drop_all()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+            migrations.bootstrap(db.engine)
+            print("✅ Database cleared and recreated")
+        db.session.remove()
+
+        if sizes:
+            dataset.generate(db.engine, seed=args.seed, password=args.password, **sizes)
+        else:
+            demo()
+
     print("\n" + "=" * 60)
     print("Database initialized successfully!")
-    print("=" * 60)
\ No newline at end of file
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
-Write-Host "Restarting workers..." -ForegroundColor Cyan
-C:\production\nssm\nssm-2.24\win64\nssm.exe restart UnicornMaster
-Start-Sleep -Seconds 15
+Write-Host "Reloading workers..." -ForegroundColor Cyan
+# Rolling reload: each worker is replaced only after its successor passes /health
+C:\production\venv\Scripts\python.exe C:\production\unicorn_master.py --config C:\production\unicorn_config.json reload
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "Master not reachable, restarting the service instead" -ForegroundColor Yellow
+    C:\production\nssm\nssm-2.24\win64\nssm.exe restart UnicornMaster
+    Start-Sleep -Seconds 15
+}
 curl http://localhost/api/products -UseBasicParsing
-Write-Host "Done!" -ForegroundColor Green
\ No newline at end of file
+Write-Host "Done!" -ForegroundColor Green
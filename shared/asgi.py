@@ -0,0 +1,146 @@
+"""
+Asyncio serving mode: the Flask services under uvicorn
+
+waitress gives a worker a fixed set of threads and, by default, at most
+100 open connections; everything beyond waits in the accept queue. In
+this mode uvicorn's event loop owns the sockets instead, so idle
+keep-alive connections only cost a little memory and one worker holds
+thousands of them. The routes do not change: WSGIAdapter runs each
+request through the app's wsgi_app on a pool of UNICORN_THREADS offload
+threads, the same number of threads (and so of database connections,
+see database.py) the waitress mode uses.
+
+asgiref's WsgiToAsgi is not used: it runs every request on one shared
+thread and never calls close() on the response, which is where the
+scoreboard, the metrics and reader() clean up.
+
+Responses up to STREAM_AFTER bytes are sent in one piece once the app has
+finished. Larger ones (stream=1 lists) are passed to the loop chunk by
+chunk as the app produces them.
+
+Enabled with UNICORN_SERVER=asgi ("server": "asgi" in unicorn_config.json);
+serve_app() hands over to serve_asgi(). Needs uvicorn.
+"""
+
+import asyncio
+import io
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from scoreboard import STATE_DRAINING, STATE_READY
+
+STREAM_AFTER = 256 * 1024
+KEEPALIVE_TIMEOUT = 120     # seconds an idle connection stays open, waitress' channel_timeout
+
+
+class WSGIAdapter:
+    """ASGI app that runs a WSGI app on a thread pool"""
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError(f"unsupported ASGI scope {scope['type']!r}")
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        loop = asyncio.get_running_loop()
+        start, body = await loop.run_in_executor(self.executor, self.run, scope, bytes(body), loop, send)
+        if start is not None:
+            await send(start)
+        await send({"type": "http.response.body", "body": body})
+
+    def environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin1"),
+            "PATH_INFO": scope["path"].encode().decode("latin1"),
+            "QUERY_STRING": scope["query_string"].decode("latin1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        if scope.get("client"):
+            environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+        for name, value in scope["headers"]:
+            name = name.decode("latin1").upper().replace("-", "_")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            value = value.decode("latin1")
+            if name in environ:
+                value = environ[name] + ("; " if name == "HTTP_COOKIE" else ",") + value
+            environ[name] = value
+        return environ
+
+    def run(self, scope, body, loop, send):
+        """Call the app on this offload thread; (start message or None if sent, rest of the body)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["start"] = {"type": "http.response.start", "status": int(status[:3]),
+                                 "headers": [(name.lower().encode("latin1"), value.encode("latin1"))
+                                             for name, value in headers]}
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        iterable = self.wsgi_app(self.environ(scope, body), start_response)
+        chunks, size = [], 0
+        try:
+            for chunk in iterable:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_AFTER:
+                    if not response.get("sent"):
+                        send_now(response["start"])
+                        response["sent"] = True
+                    send_now({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                    chunks, size = [], 0
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        return (None if response.get("sent") else response["start"]), b"".join(chunks)
+
+
+def serve_asgi(app, sock, health, slot, threads):
+    """Serve app with uvicorn on the prepared sockets until SIGTERM has drained it"""
+    import uvicorn
+    from server import DRAIN_TIMEOUT
+
+    class DrainingServer(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            # uvicorn stops accepting, closes idle connections and waits for the rest
+            slot.set_state(STATE_DRAINING)
+            super().handle_exit(sig, frame)
+
+    executor = ThreadPoolExecutor(threads, thread_name_prefix="offload")
+    config = uvicorn.Config(WSGIAdapter(app.wsgi_app, executor), lifespan="off", access_log=False,
+                            timeout_keep_alive=KEEPALIVE_TIMEOUT, timeout_graceful_shutdown=DRAIN_TIMEOUT,
+                            log_level="warning")
+    server = DrainingServer(config)
+    # uvicorn raises the signal again once it has shut down; exit cleanly instead
+    signal.signal(signal.SIGBREAK if os.name == "nt" else signal.SIGTERM, lambda signum, frame: None)
+    slot.set_state(STATE_READY, health_port=health.getsockname()[1])
+    host, port = sock.getsockname()[:2]
+    print(f"Serving on http://{host}:{port} (asgi, {threads} offload threads)", flush=True)
+    server.run(sockets=[sock, health])
+    os._exit(0)
@@ -0,0 +1,50 @@
+"""
+Helpers for the bulk create endpoints
+
+A bulk request is a JSON array of records (or {"<name>": [...]}), at most
+MAX_RECORDS of them. Every record is validated on its own and the response
+has one result per record, in request order:
+  {"index": 0, "success": true, "id": 17}
+  {"index": 1, "success": false, "error": "Name and price required"}
+The valid records are written in one transaction.
+"""
+
+from models import db
+
+MAX_RECORDS = 5000
+
+
+def parse_records(data, name):
+    """Request body -> (list of records, error message)"""
+    if isinstance(data, dict):
+        data = data.get(name)
+    if not isinstance(data, list) or not data:
+        return None, f"Expected a non-empty array of {name}"
+    if len(data) > MAX_RECORDS:
+        return None, f"At most {MAX_RECORDS} {name} per request"
+    return data, None
+
+
+def insert_rows(model, rows):
+    """Insert rows with a single executemany and return their new ids in order
+
+    SQLite cannot return ids from a multi-row insert in a guaranteed order,
+    so there the ids are worked out instead: we hold the write lock, and a
+    rowid table gives each row max(rowid) + 1, so the ids are consecutive.
+    """
+    if not rows:
+        return []
+    table = model.__table__
+    if db.session.get_bind().dialect.name != "sqlite":
+        statement = db.insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        return db.session.execute(statement, rows).scalars().all()
+    db.session.execute(db.insert(table), rows)
+    last = db.session.execute(db.select(db.func.max(table.c.id))).scalar()
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def response_body(results):
+    """Summary counts plus the per-record results sorted back into request order"""
+    results.sort(key=lambda r: r["index"])
+    failed = sum(1 for r in results if not r["success"])
+    return {"success": failed == 0, "created": len(results) - failed, "failed": failed, "results": results}
@@ -0,0 +1,246 @@
+"""
+Read-through cache for serialized JSON responses
+
+Entries are the JSON body of a response without its "instance" key, so a
+body cached by one worker can be served by any other; cached_response()
+puts this worker's instance name back in front.
+
+Invalidation is by generation: every write bumps the cache's generation
+and entries stored under an older one are never served again. A write
+that only changes one entry bumps that key's generation instead
+(invalidate(key)), which leaves the other keys cached. The
+generation is shared by all workers of all services, so a stock change
+made by the orders service invalidates what the products workers cached:
+  CACHE_TYPE = "RedisCache"  - generation and entries live in Redis
+                               (CACHE_REDIS_URL), a local LRU sits in front
+  anything else (SimpleCache) - entries are kept per worker, the generation
+                               lives in run/generations, a file the master
+                               shares with every worker (UNICORN_GENERATIONS)
+Every cache in a process uses the same Generations, so without the master
+(python app.py, the combined service) an order still invalidates the
+products cache of the same process.
+Size is bounded by CACHE_THRESHOLD entries and CACHE_MAX_BYTES, LRU first;
+entries expire after CACHE_DEFAULT_TIMEOUT seconds unless the cache was
+given its own timeout.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from metrics import WorkerMetrics, labels
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+MAGIC = b"UCGN"
+HEADER = struct.Struct("<4sII")         # magic, slots, counters per slot
+COUNTER = struct.Struct("<q")
+COUNTERS_PER_SLOT = 16
+
+
+class Generations:
+    """Per-worker generation counters in a shared file
+
+    A worker only increments its own slot; the generation of a cache is the
+    sum of its counter over all slots, so it changes whenever any worker
+    bumps it without needing a cross-process lock. Caches hash onto one of
+    COUNTERS_PER_SLOT counters, a collision only costs extra invalidations.
+    The master never clears this file, so the sums never go backwards.
+    """
+
+    def __init__(self, path=None, slots=None, slot=0):
+        self.slot = slot
+        self.lock = threading.Lock()
+        self.local = [0] * COUNTERS_PER_SLOT  # used when there is no file
+        self._map = None
+        if path is None:
+            return
+        if slots is not None:
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, slots, COUNTERS_PER_SLOT))
+                f.write(b"\0" * (slots * COUNTERS_PER_SLOT * COUNTER.size))
+        self.path = str(path)
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.slots, counters = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or counters != COUNTERS_PER_SLOT:
+            raise ValueError(f"{self.path} is not a generations file")
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("UNICORN_GENERATIONS"), slot=int(os.environ.get("UNICORN_SLOT", 0)))
+
+    def _offset(self, slot, counter):
+        return HEADER.size + (slot * COUNTERS_PER_SLOT + counter) * COUNTER.size
+
+    def _counter(self, name):
+        return zlib.crc32(name.encode()) % COUNTERS_PER_SLOT
+
+    def current(self, name):
+        counter = self._counter(name)
+        if self._map is None:
+            return self.local[counter]
+        return sum(COUNTER.unpack_from(self._map, self._offset(slot, counter))[0]
+                   for slot in range(self.slots))
+
+    def bump(self, name):
+        counter = self._counter(name)
+        with self.lock:
+            if self._map is None:
+                self.local[counter] += 1
+                return
+            offset = self._offset(self.slot, counter)
+            COUNTER.pack_into(self._map, offset, COUNTER.unpack_from(self._map, offset)[0] + 1)
+
+
+shared = {"generations": None, "pid": None}
+shared_lock = threading.Lock()
+
+
+def process_generations():
+    """This process's Generations, one for all its caches (a preloaded app creates them before forking)"""
+    if shared["pid"] != os.getpid():
+        with shared_lock:
+            if shared["pid"] != os.getpid():
+                shared["generations"] = Generations.from_env()
+                shared["pid"] = os.getpid()
+    return shared["generations"]
+
+
+class ResponseCache:
+    """Cache of serialized response bodies for one family of endpoints"""
+
+    def __init__(self, name, app=None, timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> (generation, expires_at, body)
+        self.size = 0
+        self.redis = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        if self.timeout is None:
+            self.timeout = app.config.get("CACHE_DEFAULT_TIMEOUT", 300)
+        self.max_entries = app.config.get("CACHE_THRESHOLD", 500)
+        self.max_bytes = app.config.get("CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        url = app.config.get("CACHE_REDIS_URL")
+        if app.config.get("CACHE_TYPE") == "RedisCache" and url:
+            if redis is None:
+                print(f"[cache] redis is not installed, {self.name} cache is per worker")
+            else:
+                self.redis = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def _count(self, result):
+        WorkerMetrics.current().inc(f"unicorn_cache_requests_total{{{labels(cache=self.name, result=result)}}}")
+
+    def _generation(self, key):
+        """The cache's generation plus key's; a bump of either changes it"""
+        if self.redis is not None:
+            try:
+                return sum(int(value or 0) for value in self.redis.mget(f"cache:{self.name}:gen",
+                                                                        f"cache:{self.name}:gen:{key}"))
+            except redis.RedisError as e:
+                print(f"[cache] redis unavailable, bypassing {self.name} cache: {e}")
+                return None
+        generations = process_generations()
+        return generations.current(self.name) + generations.current(f"{self.name}:{key}")
+
+    def get(self, key):
+        """Cached body for key, or (None, generation) to store a fresh one under"""
+        generation = self._generation(key)
+        if generation is None:
+            return None, None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] == generation and entry[1] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self._count("hit")
+                    return entry[2], generation
+                self._evict(key)
+        if self.redis is not None:
+            try:
+                body = self.redis.get(f"cache:{self.name}:{generation}:{key}")
+            except redis.RedisError:
+                body = None
+            if body is not None:
+                self._store(key, generation, body)
+                self._count("hit")
+                return body, generation
+        self._count("miss")
+        return None, generation
+
+    def set(self, key, generation, body):
+        """Store body under the generation get() returned before it was built"""
+        if generation is None:
+            return
+        if self.redis is not None:
+            try:
+                self.redis.set(f"cache:{self.name}:{generation}:{key}", body, ex=self.timeout)
+            except redis.RedisError:
+                pass
+        self._store(key, generation, body)
+
+    def _store(self, key, generation, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._evict(key)
+            self.entries[key] = (generation, time.monotonic() + self.timeout, body)
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+
+    def _evict(self, key):
+        self.size -= len(self.entries.pop(key)[2])
+
+    def invalidate(self, key=None):
+        """Drop every entry, or only key's, in every worker; call after the write is committed"""
+        if self.redis is not None:
+            try:
+                if key is None:
+                    self.redis.incr(f"cache:{self.name}:gen")
+                else:
+                    # a key's counter may go once the entries made before its bump have
+                    # expired; twice the timeout covers one built while the bump landed
+                    with self.redis.pipeline() as pipe:
+                        pipe.incr(f"cache:{self.name}:gen:{key}").expire(f"cache:{self.name}:gen:{key}",
+                                                                         self.timeout * 2).execute()
+            except redis.RedisError as e:
+                print(f"[cache] could not invalidate {self.name} in redis: {e}")
+        process_generations().bump(self.name if key is None else f"{self.name}:{key}")
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+                self.size = 0
+            elif key in self.entries:
+                self._evict(key)
+
+
+def cached_response(cache, key, build, instance):
+    """jsonify(dict(build(), instance=instance)), with build() cached
+
+    Same bytes as jsonify: sorted keys, compact, trailing newline. "instance"
+    sorts before the keys the cached payloads use, so it is spliced in front.
+    """
+    app = cache.app
+    body, generation = cache.get(key)
+    if body is None:
+        payload = build()
+        if payload is None:
+            return None
+        body = app.json.dumps(payload, separators=(",", ":")).encode() + b"\n"
+        cache.set(key, generation, body)
+    prefix = b'{"instance":' + app.json.dumps(instance).encode() + b","
+    return app.response_class(prefix + body[1:], mimetype=app.json.mimetype)
@@ -0,0 +1,72 @@
+"""
+Single-process mode: several services mounted in one WSGI app
+
+Each service normally runs its own workers, and every worker carries its
+own copy of Python, Flask, SQLAlchemy, the models and the pools. Combined
+loads the services' app.py scripts into one interpreter and hands each
+request to the service that owns its path prefix; the paths are not
+rewritten, so the services' routes and nginx's locations stay the same.
+Anything no service claims (/, /health, /debug/profile) goes to a small
+root app.
+
+Within the process the services share what the shared modules keep per
+process: the engines and pools (database.py), the JWT claims cache
+(identity.py), the limiter (ratelimit.py) and the metrics slot. Response
+caches are still per service.
+
+app/combined/app.py is the entry script; serve_app() (server.py) and the
+master's preload (unicorn_master.py) see the mounted apps through
+Combined.apps and Combined.modules.
+"""
+
+import importlib.util
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def load_service(name):
+    """Import app/<name>/app.py afresh as <name>_app (the scripts are all called app.py)
+
+    Never reuses an earlier import: a rolling reload of a preloaded combined
+    service builds a new Combined, and it must run the new service code.
+    Combined calls it once per service, however many prefixes it has.
+    """
+    module_name = f"{name}_app"
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(APP_DIR, name, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class Combined:
+    """WSGI app that passes each request to the service owning its path prefix"""
+
+    def __init__(self, root, mounts):
+        """mounts: {path prefix: service name}, e.g. {"/api/orders": "orders"}"""
+        self.root = root
+        self.modules = []
+        self.routes = []
+        loaded = {}   # name -> module: a service mounted at several prefixes is loaded once
+        for prefix, name in mounts.items():
+            if name not in loaded:
+                loaded[name] = load_service(name)
+                self.modules.append(loaded[name])
+            self.routes.append((prefix.rstrip("/"), loaded[name].app))
+        # longest prefix first, so a mount can sit under another one
+        self.routes.sort(key=lambda route: len(route[0]), reverse=True)
+        self.apps = [root] + [module.app for module in self.modules]
+        # serve_app() wraps this the way it wraps a Flask app's wsgi_app
+        self.wsgi_app = self.dispatch
+
+    def dispatch(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        for prefix, app in self.routes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return app(environ, start_response)
+        return self.root(environ, start_response)
+
+    def __call__(self, environ, start_response):
+        return self.wsgi_app(environ, start_response)
@@ -15,6 +15,11 @@ class Config:
         'sqlite:///C:/production/database/ecommerce.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False
+
+    # Only init_database.py loads this class. The services' tuning (SQLite
+    # pragmas and pools, password hashing, the JWT claims cache, response
+    # caches, group commit, profiling) is in the DEFAULTS of the shared
+    # module that reads it and is set through the environment.
     
     # JWT
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
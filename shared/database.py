@@ -0,0 +1,163 @@
+"""
+Database engine setup shared by all services
+
+Services call database.init_app(app) instead of db.init_app(app). On
+SQLite every new connection then runs
+
+  PRAGMA busy_timeout = 5000     wait for the write lock instead of failing
+  PRAGMA journal_mode = WAL      readers no longer block behind a writer
+  PRAGMA synchronous = NORMAL    fsync at checkpoints rather than every commit;
+                                 in WAL mode a crash cannot corrupt the file,
+                                 a power cut can lose the last commits
+  PRAGMA mmap_size / cache_size  read pages through the OS page cache
+
+and the pool keeps one connection per waitress thread (plus one for the
+group-commit writer) open for the life of the worker instead of the
+default 5 + 10 overflow.
+
+Read-only routes use reader(): a session on a second pool that opens the
+same file with mode=ro. Reads never take a connection a writer is
+waiting for, and cannot write by accident. In WAL mode a reader sees
+every commit made before its query started, same as db.session.
+
+Every setting below can be set in app.config or the environment.
+DB_TUNING=0 leaves the engine as Flask-SQLAlchemy makes it (and
+reader() returns db.session); benchmarks/mixed_load.py uses that as
+the baseline. WAL sticks to the database file once set, so going back
+needs SQLITE_JOURNAL_MODE=DELETE rather than DB_TUNING=0.
+
+Apps in one process with the same engine settings share the engines and
+so the pools (combined.py mounts all three services in one worker); the
+pool is then sized for the worker's threads, whichever app they serve.
+"""
+
+import os
+from urllib.parse import quote
+
+from flask import g
+from sqlalchemy import engine_from_config, event
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.orm import Session
+
+from models import db
+
+READ_ONLY_BIND = "readonly"
+
+ENGINES = {}    # engine options -> engine, one per distinct configuration in the process
+TUNED = set()   # engines that already run pragmas() on connect
+
+DEFAULTS = {
+    "DB_TUNING": True,
+    "SQLITE_JOURNAL_MODE": "WAL",
+    "SQLITE_SYNCHRONOUS": "NORMAL",
+    "SQLITE_MMAP_SIZE": 256 * 1024 * 1024,
+    "SQLITE_CACHE_SIZE": -64 * 1024,      # negative means KiB: 64 MB per connection
+    "SQLITE_BUSY_TIMEOUT_MS": 5000,
+    "DB_POOL_SIZE": 0,                    # 0: worker threads + 1
+    "DB_MAX_OVERFLOW": 4,
+    "DB_POOL_TIMEOUT": 10,
+    "DB_POOL_RECYCLE": 3600,
+    "DB_READ_ONLY_POOL": True,
+}
+
+
+def setting(app, name, defaults=DEFAULTS):
+    """app.config, then the environment, then defaults, as the default's type"""
+    default = defaults[name]
+    value = app.config.get(name, os.environ.get(name, default))
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() not in ("0", "false", "no", "off", "")
+    return type(default)(value)
+
+
+def is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def read_only_url(url):
+    """sqlite:///path -> the same file opened read-only through an SQLite URI"""
+    url = make_url(url)
+    if url.query.get("uri"):
+        return url.update_query_dict({"mode": "ro"})
+    path = quote(url.database.replace("\\", "/"), safe="/:")
+    return url.set(database=f"file:{path}", query=dict(url.query, mode="ro", uri="true"))
+
+
+def pragmas(app, read_only=False):
+    statements = [f"PRAGMA busy_timeout = {setting(app, 'SQLITE_BUSY_TIMEOUT_MS')}"]
+    if not read_only:
+        # WAL is a property of the file, a read-only connection cannot set it
+        statements.append(f"PRAGMA journal_mode = {setting(app, 'SQLITE_JOURNAL_MODE')}")
+    statements += [
+        f"PRAGMA synchronous = {setting(app, 'SQLITE_SYNCHRONOUS')}",
+        f"PRAGMA mmap_size = {setting(app, 'SQLITE_MMAP_SIZE')}",
+        f"PRAGMA cache_size = {setting(app, 'SQLITE_CACHE_SIZE')}",
+    ]
+    return statements
+
+
+def shared_engine(bind_key, options, app):
+    """Engine factory of models.db: the existing engine for the same options, else a new one"""
+    key = tuple(sorted((name, value.render_as_string(hide_password=False) if isinstance(value, URL) else repr(value))
+                       for name, value in options.items()))
+    engine = ENGINES.get(key)
+    if engine is None:
+        engine = ENGINES[key] = engine_from_config(options, prefix="")
+    return engine
+
+
+def apply_pragmas(statements):
+    def connect(dbapi_connection, record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    return connect
+
+
+def init_app(app):
+    """db.init_app(app) with the pool, pragmas and read-only bind configured"""
+    url = app.config["SQLALCHEMY_DATABASE_URI"]
+    tuned = setting(app, "DB_TUNING") and is_sqlite_file(url)
+    if tuned:
+        pool_size = setting(app, "DB_POOL_SIZE") or int(os.environ.get("UNICORN_THREADS", 4)) + 1
+        options = {
+            "pool_size": pool_size,
+            "max_overflow": setting(app, "DB_MAX_OVERFLOW"),
+            "pool_timeout": setting(app, "DB_POOL_TIMEOUT"),
+            "pool_recycle": setting(app, "DB_POOL_RECYCLE"),
+        }
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).update(options)
+        if setting(app, "DB_READ_ONLY_POOL"):
+            binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+            binds[READ_ONLY_BIND] = dict(options, url=read_only_url(url))
+    db.init_app(app)
+    app.teardown_appcontext(close_reader)
+    if not tuned:
+        return
+
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            if engine not in TUNED:
+                TUNED.add(engine)
+                event.listen(engine, "connect", apply_pragmas(pragmas(app, read_only=bind == READ_ONLY_BIND)))
+
+
+def reader():
+    """Session for read-only routes, on the read-only pool when there is one
+
+    One per app context, closed when the context ends (after a streamed
+    response has been sent).
+    """
+    if READ_ONLY_BIND not in db.engines:
+        return db.session
+    if "db_reader" not in g:
+        g.db_reader = Session(bind=db.engines[READ_ONLY_BIND])
+    return g.db_reader
+
+
+def close_reader(exc):
+    session = g.pop("db_reader", None)
+    if session is not None:
+        session.close()
@@ -0,0 +1,248 @@
+"""
+Synthetic data at production scale, the same for the same seed
+
+generate() fills an empty database with users, products, orders and
+order items. Every value comes from one random.Random(seed) and fixed
+dates, so two runs with the same sizes and seed write the same rows and
+benchmark numbers stay comparable between machines and commits.
+
+The data is skewed the way shop data is:
+  - categories follow a Zipf-like popularity: the first categories have
+    the most products and get most of the sales;
+  - within a category a few bestsellers are in most orders;
+  - most orders have one or two items (P(n) ~ 0.6^n, at most 20), most
+    quantities are 1;
+  - customers who signed up early order the most. An order only goes to
+    a user who existed at the time, and recent orders are still pending,
+    confirmed or shipped.
+Every user has the same password (one hash, computed once, salted from the
+seed as well), and 5% of products are inactive. Names and descriptions are drawn from a Zipf
+vocabulary, so search has common and rare words.
+
+Loading is built for size. The secondary indexes are dropped and rows go
+in with chunked executemany on the raw SQLite connection, ids included,
+with synchronous=OFF. After that the indexes are built once, then the
+products_fts search index, then migrations and ANALYZE, so the planner
+has statistics before the first query.
+"""
+
+import hashlib
+import itertools
+import math
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+
+from werkzeug.security import SALT_CHARS
+
+from models import db
+
+CHUNK = 50000
+END = datetime(2025, 1, 1)          # the newest order; fixed so runs are repeatable
+DAYS = 730                          # users and orders are spread over this many days before END
+CATEGORIES = ["electronics", "clothing", "home", "books", "footwear", "beauty", "sports", "toys",
+              "kitchen", "appliances", "accessories", "garden", "grocery", "health", "office",
+              "automotive", "pets", "baby", "games", "music", "tools", "jewelry", "outdoor", "movies"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "ve", "dan", "tor", "lex", "mar", "zen", "qua"]
+ORDER_SIZES = range(1, 21)
+QUANTITIES = [1, 2, 3, 4, 5]
+QUANTITY_WEIGHTS = [70, 18, 7, 3, 2]
+# werkzeug's default scrypt parameters, written as its "method$salt$hash" format
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 32768, 8, 1
+SETTLED = ["delivered"] * 92 + ["cancelled"] * 8
+OPEN = ["pending"] * 4 + ["confirmed"] * 3 + ["shipped"] * 3
+SCALES = {
+    "small": {"users": 1000, "products": 5000, "items": 50000},
+    "medium": {"users": 50000, "products": 50000, "items": 1000000},
+    "large": {"users": 1000000, "products": 200000, "items": 10000000},
+}
+
+
+def stamp(moment):
+    """How SQLAlchemy stores a DateTime on SQLite"""
+    return moment.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def password_hash(password, rng):
+    """generate_password_hash() with the salt drawn from rng instead of secrets"""
+    salt = "".join(rng.choice(SALT_CHARS) for _ in range(16))
+    hashed = hashlib.scrypt(password.encode(), salt=salt.encode(), n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                            maxmem=132 * SCRYPT_N * SCRYPT_R * SCRYPT_P).hex()
+    return f"scrypt:{SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}${salt}${hashed}"
+
+
+def zipf_cum_weights(n, exponent=1.0):
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+class Loader:
+    """Chunked inserts on one raw connection"""
+
+    def __init__(self, connection, log):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.log = log
+
+    def insert(self, table, columns, rows, total):
+        """Insert an iterable of rows in CHUNK-sized executemany calls"""
+        statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        started = time.perf_counter()
+        done = 0
+        while True:
+            batch = list(itertools.islice(rows, CHUNK))
+            if not batch:
+                break
+            self.cursor.executemany(statement, batch)
+            self.connection.commit()
+            done += len(batch)
+            if done % (CHUNK * 20) == 0:
+                self.log(f"[dataset]   {table}: {done:,} / ~{total:,}")
+        self.log(f"[dataset] {table}: {done:,} rows in {time.perf_counter() - started:.1f}s")
+        return done
+
+
+def user_rows(count, password_hash, rng, start):
+    span = (END - start).total_seconds()
+    for i in range(1, count + 1):
+        created = start + timedelta(seconds=span * (i - 1) / count)
+        yield (i, f"user{i}", f"user{i}@example.com", password_hash, rng.random() > 0.02, stamp(created))
+
+
+def product_rows(count, rng, start, words, categories):
+    """Products spread over the categories by popularity; returns rows via a generator and fills categories"""
+    word_weights = zipf_cum_weights(len(words))
+    category_weights = zipf_cum_weights(len(CATEGORIES), 1.2)
+    medians = [rng.uniform(2.5, 6.0) for _ in CATEGORIES]   # log of a category's typical price
+    created = stamp(start - timedelta(days=1))
+    for i in range(1, count + 1):
+        category = bisect(category_weights, rng.random() * category_weights[-1])
+        price = round(math.exp(rng.gauss(medians[category], 0.6)), 2)
+        categories[category].append((i, price))
+        yield (i, " ".join(rng.choices(words, cum_weights=word_weights, k=3)).title(),
+               " ".join(rng.choices(words, cum_weights=word_weights, k=12)), price,
+               0 if rng.random() < 0.05 else rng.randint(1, 500), CATEGORIES[category], rng.random() > 0.05,
+               created, created)
+
+
+def order_rows(items, users, rng, start, categories, item_rows):
+    """Orders until `items` order items exist; the items go to item_rows as each order is made"""
+    span = (END - start).total_seconds()
+    category_weights = zipf_cum_weights(len(CATEGORIES), 1.2)
+    for products in categories:
+        rng.shuffle(products)   # which products are the bestsellers
+    product_weights = [zipf_cum_weights(len(products)) for products in categories]
+    size_weights = list(itertools.accumulate(0.6 ** n for n in ORDER_SIZES))
+    quantity_weights = list(itertools.accumulate(QUANTITY_WEIGHTS))
+    distinct = sum(len(products) for products in categories)   # an order lists a product once
+    order_id = item_id = 0
+    while item_id < items:
+        order_id += 1
+        progress = item_id / items
+        created = start + timedelta(seconds=span * progress)
+        # users who existed by then, early sign-ups more often
+        user = 1 + int(max(1, int(users * progress)) * rng.random() ** 2)
+        size = min(ORDER_SIZES[bisect(size_weights, rng.random() * size_weights[-1])], items - item_id, distinct)
+        chosen = {}
+        while len(chosen) < size:
+            category = bisect(category_weights, rng.random() * category_weights[-1])
+            weights = product_weights[category]
+            if not weights:
+                continue
+            product, price = categories[category][bisect(weights, rng.random() * weights[-1])]
+            chosen.setdefault(product, price)
+        total = 0.0
+        for product, price in chosen.items():
+            item_id += 1
+            quantity = QUANTITIES[bisect(quantity_weights, rng.random() * quantity_weights[-1])]
+            total += quantity * price
+            item_rows.append((item_id, order_id, product, quantity, price))
+        status = rng.choice(SETTLED if progress < 0.97 else OPEN)
+        yield (order_id, user, status, round(total, 2), stamp(created),
+               stamp(created + timedelta(hours=rng.randint(0, 72))))
+
+
+def generate(engine, users, products, items, seed=42, password="password123", log=print):
+    """Fill the empty tables behind engine; create_all() must have run"""
+    if engine.dialect.name != "sqlite":
+        raise ValueError("the dataset generator loads through sqlite3, SQLite only")
+    if products < 1 or users < 1:
+        raise ValueError("need at least one user and one product")
+    import migrations
+    import search
+
+    rng = random.Random(seed)
+    start = END - timedelta(days=DAYS)
+    started = time.perf_counter()
+    indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+    with engine.begin() as conn:
+        for table in ("order_items", "orders", "products", "users"):
+            if conn.exec_driver_sql(f"SELECT 1 FROM {table} LIMIT 1").first():
+                raise ValueError(f"{table} is not empty; generate into an empty database")
+        # search.install() builds the index and its triggers again in one pass
+        for trigger in ("insert", "delete", "update"):
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS products_fts_{trigger}")
+        conn.exec_driver_sql("DROP TABLE IF EXISTS products_fts")
+        for index in indexes:
+            index.drop(conn, checkfirst=True)
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA cache_size = -262144")
+        loader = Loader(connection, log)
+        loader.insert("users", ["id", "username", "email", "password_hash", "is_active", "created_at"],
+                      user_rows(users, password_hash(password, rng), rng, start), users)
+        categories = [[] for _ in CATEGORIES]
+        loader.insert("products", ["id", "name", "description", "price", "stock", "category", "is_active",
+                                   "created_at", "updated_at"],
+                      product_rows(products, rng, start, vocabulary(20000, rng), categories), products)
+
+        # orders and their items are made together; items are flushed whenever a chunk is full
+        item_rows = []
+        item_columns = ["id", "order_id", "product_id", "quantity", "price"]
+        item_statement = f"INSERT INTO order_items ({', '.join(item_columns)}) VALUES (?, ?, ?, ?, ?)"
+
+        def orders_then_items():
+            for row in order_rows(items, users, rng, start, categories, item_rows):
+                yield row
+                if len(item_rows) >= CHUNK:
+                    cursor.executemany(item_statement, item_rows)
+                    item_rows.clear()
+            if item_rows:
+                cursor.executemany(item_statement, item_rows)
+                item_rows.clear()
+
+        orders = loader.insert("orders", ["id", "user_id", "status", "total_amount", "created_at", "updated_at"],
+                               orders_then_items(), round(items / 2.5))
+        connection.commit()
+        log(f"[dataset] order_items: {items:,} rows with the orders")
+        cursor.close()
+    finally:
+        connection.close()
+
+    phase = time.perf_counter()
+    with engine.begin() as conn:
+        for index in indexes:
+            index.create(conn)
+    log(f"[dataset] built {len(indexes)} indexes in {time.perf_counter() - phase:.1f}s")
+    phase = time.perf_counter()
+    if search.install(engine):
+        log(f"[dataset] built products_fts in {time.perf_counter() - phase:.1f}s")
+    phase = time.perf_counter()
+    if not migrations.migrate(engine):
+        migrations.analyze(engine)
+    log(f"[dataset] migrations and ANALYZE in {time.perf_counter() - phase:.1f}s")
+    log(f"[dataset] {users:,} users, {products:,} products, {orders:,} orders, {items:,} order items "
+        f"in {time.perf_counter() - started:.1f}s (seed {seed})")
+    return {"users": users, "products": products, "orders": orders, "items": items}
@@ -0,0 +1,196 @@
+"""
+Group commit: many requests' writes in one transaction
+
+Request threads hand their write to submit() and wait. One writer thread
+per worker collects whatever arrives within max_wait seconds (or until it
+has max_batch jobs), runs each job inside its own SAVEPOINT of a single
+transaction and commits once, so a burst of N orders costs one fsync and
+one lock handoff instead of N. Each request only gets its result after
+that commit.
+
+A job is a function that writes through db.session without committing
+and returns a value. Raising Rollback(value) undoes just that job's
+writes and still answers with value; any other exception fails only that
+job. If the commit itself fails (the database stayed locked, say), the
+jobs are retried one transaction each so one bad batch does not fail
+everyone.
+
+A request that gets no result within submit()'s timeout raises
+GroupCommitBusy, which the orders service answers like a locked database
+(503 and Retry-After). Its job is cancelled if the writer has not picked
+it up yet; a job already in the running transaction may still commit
+after the request gave up on it.
+
+run_jobs() is the same transaction without the writer thread; the bulk
+order endpoint uses it to place a whole request's orders at once.
+
+On SQLite the writer drives the transaction itself (BEGIN IMMEDIATE and
+real SAVEPOINTs), because pysqlite's implicit transactions do not mix
+with savepoints.
+"""
+
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from metrics import WorkerMetrics
+from models import db
+
+RETRIES = 5
+BACKOFF_INITIAL = 0.01
+BACKOFF_MAX = 0.2
+
+
+class GroupCommitBusy(Exception):
+    """No group transaction took the job within submit()'s timeout"""
+
+
+class Rollback(Exception):
+    """Undo the job's own writes, but answer the request with value"""
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.value = value
+
+
+def restore_isolation_level(dbapi_connection, record):
+    """Pool checkin hook: hand the connection back to other sessions as pysqlite expects it
+
+    Runs before the connection is back in the pool, so no other thread can
+    get it while it is still in manual transaction mode.
+    """
+    if record.info.pop("group_commit", False):
+        dbapi_connection.isolation_level = ""
+
+
+def begin_immediate():
+    """Start the session's transaction, taking SQLite's write lock up front"""
+    connection = db.session.connection()
+    if connection.dialect.name == "sqlite":
+        pooled = connection.connection
+        pooled.driver_connection.isolation_level = None  # we issue BEGIN ourselves
+        pooled.record_info["group_commit"] = True
+        if not event.contains(connection.engine, "checkin", restore_isolation_level):
+            event.listen(connection.engine, "checkin", restore_isolation_level)
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def run_jobs(jobs):
+    """Run (fn, args) jobs in savepoints of one transaction and commit once
+
+    Returns [(value, exception)] in job order. A database error (locked,
+    say) rolls everything back and is raised.
+    """
+    outcomes = []
+    begin_immediate()
+    try:
+        for fn, args in jobs:
+            try:
+                with db.session.begin_nested():
+                    outcomes.append((fn(*args), None))
+            except Rollback as r:
+                outcomes.append((r.value, None))
+            except OperationalError:
+                raise
+            except Exception as e:
+                outcomes.append((None, e))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return outcomes
+
+
+class GroupCommitter:
+    def __init__(self, app, max_batch=64, max_wait=0.002):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _ensure_writer(self):
+        # started lazily: threads do not survive the fork of a preloaded worker
+        with self.lock:
+            if self.pid != os.getpid():
+                self.jobs = queue.Queue()
+                threading.Thread(target=self._run, name="group-commit", daemon=True).start()
+                self.pid = os.getpid()
+
+    def submit(self, fn, *args, timeout=30):
+        """Run fn(*args) in the next group transaction and return its result
+
+        Raises GroupCommitBusy after timeout seconds; the job may still
+        commit if the writer had already started it.
+        """
+        self._ensure_writer()
+        future = Future()
+        self.jobs.put((future, fn, args))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            started = not future.cancel()
+            WorkerMetrics.current().inc("unicorn_group_commit_timeouts_total")
+            raise GroupCommitBusy(f"database is busy: no group commit within {timeout}s"
+                                  + (" (the job may still commit)" if started else "")) from None
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [self.jobs.get()]
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.jobs.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                # drop the jobs whose requests timed out waiting; the rest can no longer be cancelled
+                batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    self._apply(batch)
+                except Exception:
+                    # the group transaction failed as a whole; give every
+                    # job its own transaction instead
+                    for job in batch:
+                        self._apply_alone(job)
+                finally:
+                    db.session.remove()
+
+    def _apply(self, batch):
+        outcomes = run_jobs([(fn, args) for future, fn, args in batch])
+        metrics = WorkerMetrics.current()
+        metrics.inc("unicorn_group_commit_transactions_total")
+        metrics.inc("unicorn_group_commit_jobs_total", len(batch))
+        for (future, fn, args), (value, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    def _apply_alone(self, job):
+        delay = BACKOFF_INITIAL
+        for attempt in range(RETRIES):
+            try:
+                self._apply([job])
+                return
+            except OperationalError as e:
+                if attempt == RETRIES - 1:
+                    job[0].set_exception(e)
+                    return
+                time.sleep(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, BACKOFF_MAX)
+            except Exception as e:
+                job[0].set_exception(e)
+                return
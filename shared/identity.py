@@ -0,0 +1,98 @@
+"""
+Caches for JWT-protected routes
+
+Every protected request verified its token's signature again (about
+0.2 ms of HMAC and JSON work each time), and /api/users/me then loaded
+the same user row again although user rows almost never change.
+
+  - CachingJWTManager is flask_jwt_extended's JWTManager, except that a
+    token whose signature has been verified once keeps its claims in a
+    per-process LRU, keyed by the encoded token, until the token's exp.
+    Later requests with the same token skip the decode. Anything the
+    token is checked against after decoding (token type, freshness)
+    still runs. A token that fails verification or has no exp is never
+    cached, and decodes with a CSRF value or allow_expired are not cached.
+    JWT_CLAIMS_CACHE_SIZE bounds it; 0 turns it off. Services call
+    identity.manager.init_app(app), so apps in one process share it.
+  - identity_cache(app) is a ResponseCache (cache.py) of users' /me
+    bodies keyed by user id. Entries expire after IDENTITY_CACHE_TIMEOUT
+    seconds. A profile write invalidates it in every worker through the
+    shared generation. With CACHE_TYPE=RedisCache the entries are shared
+    by the workers too.
+
+Hits, misses and decode times go to the worker's metrics:
+unicorn_jwt_claims_total and unicorn_jwt_decode_seconds by result, and
+unicorn_cache_requests_total{cache="identity"}; the decode time is also
+the jwt part of the Server-Timing header (profiling.py). Settings come from
+app.config or the environment, as in database.py.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import flask_jwt_extended
+
+from cache import ResponseCache
+from database import setting
+from metrics import WorkerMetrics, labels
+import profiling
+
+DEFAULTS = {
+    "JWT_CLAIMS_CACHE_SIZE": 4096,   # tokens per worker; 0: verify every request
+    "IDENTITY_CACHE_TIMEOUT": 60,    # seconds a cached user is served
+}
+
+
+class CachingJWTManager(flask_jwt_extended.JWTManager):
+    """JWTManager that verifies each token once per worker"""
+
+    def __init__(self, app=None, add_context_processor=False):
+        self.claims = OrderedDict()     # encoded token -> (exp, claims)
+        self.claims_lock = threading.Lock()
+        self.max_claims = DEFAULTS["JWT_CLAIMS_CACHE_SIZE"]
+        super().__init__(app, add_context_processor)
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+        self.max_claims = setting(app, "JWT_CLAIMS_CACHE_SIZE", DEFAULTS)
+
+    def _count(self, result, started):
+        seconds = time.perf_counter() - started
+        profiling.add("jwt", seconds)
+        metrics = WorkerMetrics.current()
+        metrics.inc(f"unicorn_jwt_claims_total{{{labels(result=result)}}}")
+        metrics.observe(f"unicorn_jwt_decode_seconds{{{labels(result=result)}}}", seconds)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if csrf_value is not None or allow_expired or not self.max_claims:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        started = time.perf_counter()
+        with self.claims_lock:
+            entry = self.claims.get(encoded_token)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self.claims.move_to_end(encoded_token)
+                else:
+                    del self.claims[encoded_token]   # let the decode raise ExpiredSignatureError
+                    entry = None
+        if entry is not None:
+            self._count("hit", started)
+            return dict(entry[1])
+        claims = super()._decode_jwt_from_config(encoded_token)
+        if "exp" in claims:
+            with self.claims_lock:
+                self.claims[encoded_token] = (claims["exp"], dict(claims))
+                while len(self.claims) > self.max_claims:
+                    self.claims.popitem(last=False)
+        self._count("miss", started)
+        return claims
+
+
+# one per process: the services mounted together (combined.py) share its cache
+manager = CachingJWTManager()
+
+
+def identity_cache(app):
+    """ResponseCache of user bodies by user id, expiring after IDENTITY_CACHE_TIMEOUT"""
+    return ResponseCache("identity", app, timeout=setting(app, "IDENTITY_CACHE_TIMEOUT", DEFAULTS))
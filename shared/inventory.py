@@ -0,0 +1,172 @@
+"""
+Stock reservation for order placement
+
+An order reserves its stock with a conditional UPDATE,
+
+    UPDATE products SET stock = stock - :qty WHERE id = :id AND is_active AND stock >= :qty
+
+(one statement for all of the order's products, the quantities picked by
+a CASE on id), so the check and the decrement are a single atomic step in
+the database and two workers can never both sell the last unit. The
+reservation and the order rows go in one short transaction. If any product cannot be
+reserved, the whole transaction is rolled back, which releases whatever
+was reserved before it, and every failing item is reported. A product
+that fell short but is in stock again by the time the failures are looked
+up (it was restocked in between) is reported as InventoryBusy, so the
+client retries instead of getting an order without it.
+
+The transaction starts with a write, so SQLite takes the write lock up
+front and waits for it (the driver's busy timeout) instead of failing
+halfway through. If the database is still locked, the whole attempt is
+retried with bounded, jittered backoff.
+"""
+
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Product, Order, OrderItem
+
+RETRIES = 5
+BACKOFF_INITIAL = 0.01
+BACKOFF_MAX = 0.2
+
+
+class InventoryBusy(Exception):
+    """The database stayed locked through every retry, or stock changed mid-reservation"""
+
+
+def parse_items(items):
+    """Request items -> {product_id: total quantity}, or an error message"""
+    if not isinstance(items, list) or not items:
+        return None, "Items required"
+    wanted = {}
+    for item in items:
+        try:
+            product_id, quantity = int(item['product_id']), int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            return None, "Each item needs an integer product_id and quantity"
+        if quantity < 1:
+            return None, f"Quantity for product {product_id} must be positive"
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+    return wanted, None
+
+
+def is_busy(error):
+    return (isinstance(error, InventoryBusy)
+            or "database is locked" in str(error) or "database is busy" in str(error))
+
+
+def reserve(wanted):
+    """Decrement stock inside the current transaction
+
+    One statement for the whole order: each product's quantity comes from a
+    CASE on its id. Returns ({product_id: (name, price)} for what was
+    reserved, failures); the caller rolls back if there are failures.
+    Raises InventoryBusy if a product fell short but no failure can be
+    found for it any more.
+    """
+    table = Product.__table__
+    quantity = db.case(wanted, value=table.c.id)
+    statement = table.update().where(
+        table.c.id.in_(wanted), table.c.is_active == True, table.c.stock >= quantity
+    ).values(stock=table.c.stock - quantity, updated_at=datetime.utcnow())
+
+    if db.session.get_bind().dialect.update_returning:
+        rows = db.session.execute(statement.returning(table.c.id, table.c.name, table.c.price)).all()
+    elif db.session().in_nested_transaction():
+        # a group commit job: undo a short reservation through a savepoint of
+        # its own, not by rolling back the group's transaction
+        savepoint = db.session.begin_nested()
+        rows = reserve_counted(statement, wanted)
+        if rows:
+            savepoint.commit()
+        else:
+            savepoint.rollback()
+    else:
+        rows = reserve_counted(statement, wanted)
+        if not rows:
+            # the reservation opens the transaction (place_order), so this
+            # undoes only the rows it updated, and the lookup below sees the old stock
+            db.session.rollback()
+    reserved = {row.id: (row.name, row.price) for row in rows}
+    if len(reserved) == len(wanted):
+        return reserved, []
+
+    missing = [product_id for product_id in wanted if product_id not in reserved]
+    current = {row.id: row for row in db.session.execute(
+        db.select(table.c.id, table.c.name, table.c.stock, table.c.is_active).where(table.c.id.in_(missing)))}
+    failures = []
+    for product_id in missing:
+        row = current.get(product_id)
+        if row is None or not row.is_active:
+            failures.append({"product_id": product_id, "reason": "not_found"})
+        elif row.stock < wanted[product_id]:
+            failures.append({"product_id": product_id, "name": row.name, "reason": "insufficient_stock",
+                             "requested": wanted[product_id], "available": row.stock})
+    if not failures:
+        # restocked between the UPDATE and the lookup; never place the order without it
+        raise InventoryBusy("stock changed during the reservation")
+    return reserved, failures
+
+
+def reserve_counted(statement, wanted):
+    """Run the UPDATE without RETURNING: the reserved rows if it hit every product, else []"""
+    if db.session.execute(statement).rowcount != len(wanted):
+        return []
+    table = Product.__table__
+    return db.session.execute(
+        db.select(table.c.id, table.c.name, table.c.price).where(table.c.id.in_(wanted))).all()
+
+
+def order_in_transaction(user_id, wanted):
+    """Reserve stock and add the order rows to the current transaction
+
+    Returns (order_id, []) or (None, failures); on failures the caller must
+    roll back. Committing is up to the caller too (place_order, or the
+    group committer in group_commit.py).
+    """
+    reserved, failures = reserve(wanted)
+    if failures:
+        return None, failures
+    total = sum(price * wanted[product_id] for product_id, (name, price) in reserved.items())
+    order = Order(user_id=user_id, total_amount=round(total, 2), status='pending')
+    db.session.add(order)
+    db.session.flush()
+    order_id = order.id
+    db.session.execute(db.insert(OrderItem), [
+        {'order_id': order_id, 'product_id': product_id, 'quantity': wanted[product_id], 'price': price}
+        for product_id, (name, price) in reserved.items()
+    ])
+    return order_id, []
+
+
+def place_order(user_id, wanted):
+    """Reserve stock and create the order in its own transaction
+
+    Returns (order_id, []) or (None, failures). Raises InventoryBusy when
+    the database stayed locked or the stock changed under the reservation.
+    """
+    delay = BACKOFF_INITIAL
+    for attempt in range(RETRIES):
+        try:
+            db.session.rollback()  # make sure the first statement starts the transaction
+            order_id, failures = order_in_transaction(user_id, wanted)
+            if failures:
+                db.session.rollback()
+                return None, failures
+            db.session.commit()
+            return order_id, []
+        except InventoryBusy:
+            db.session.rollback()
+            raise
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_busy(e) or attempt == RETRIES - 1:
+                if is_busy(e):
+                    raise InventoryBusy(str(e)) from e
+                raise
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, BACKOFF_MAX)
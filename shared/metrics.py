@@ -0,0 +1,242 @@
+"""
+Cross-worker metrics in shared memory
+
+unicorn_master owns run/metrics, a file-backed mmap with one slot per worker
+(the same slot number as the scoreboard). A worker only writes its own
+slot: a table of named series, each a counter or a latency histogram. The
+master sums the slots per service and serves them in Prometheus text format
+on its control port (GET /metrics).
+
+Writes are guarded by a sequence number per slot (odd while an update is
+in progress) so the master can read without taking any lock; the threading
+lock only serialises the worker's own threads. Stdlib only, because the
+master imports it too.
+
+Series names are full Prometheus names with labels, e.g.
+    unicorn_http_request_duration_seconds{route="/api/products",method="GET",status="2xx"}
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"UCMR"
+HEADER = struct.Struct("<4sIII")            # magic, slots, entries per slot, entry size
+SLOT_HEADER = struct.Struct("<qq")          # sequence, entries in use
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+ENTRY = struct.Struct(f"<q168sqd{len(BUCKETS)}q")   # kind, name, count, sum, buckets
+ENTRIES_PER_SLOT = 128
+
+COUNTER = 1
+HISTOGRAM = 2
+
+HTTP_SERIES = "unicorn_http_request_duration_seconds"
+
+
+class MetricsRegion:
+    """The mmap'd metrics table; the master creates it, workers attach to it"""
+
+    def __init__(self, path, slots=None, entries=ENTRIES_PER_SLOT):
+        self.path = str(path)
+        if slots is not None:
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, slots, entries, ENTRY.size))
+                f.write(b"\0" * (slots * (SLOT_HEADER.size + entries * ENTRY.size)))
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.slots, self.entries, entry_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or entry_size != ENTRY.size:
+            raise ValueError(f"{self.path} is not a metrics file")
+
+    def _slot_offset(self, slot):
+        if not 0 <= slot < self.slots:
+            raise IndexError(f"metrics slot {slot} out of range")
+        return HEADER.size + slot * (SLOT_HEADER.size + self.entries * ENTRY.size)
+
+    def _entry_offset(self, slot, entry):
+        return self._slot_offset(slot) + SLOT_HEADER.size + entry * ENTRY.size
+
+    def read_slot(self, slot, retries=100):
+        """Consistent snapshot of one slot: {name: (kind, count, sum, buckets)}"""
+        offset = self._slot_offset(slot)
+        for _ in range(retries):
+            seq, used = SLOT_HEADER.unpack_from(self._map, offset)
+            if seq % 2:
+                time.sleep(0)
+                continue
+            series = {}
+            for i in range(min(used, self.entries)):
+                kind, name, count, total, *buckets = ENTRY.unpack_from(self._map, self._entry_offset(slot, i))
+                series[name.rstrip(b"\0").decode()] = (kind, count, total, buckets)
+            if SLOT_HEADER.unpack_from(self._map, offset)[0] == seq:
+                return series
+        return {}
+
+    def clear(self, slot):
+        offset = self._slot_offset(slot)
+        self._map[offset:offset + SLOT_HEADER.size + self.entries * ENTRY.size] = \
+            b"\0" * (SLOT_HEADER.size + self.entries * ENTRY.size)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class WorkerMetrics:
+    """A worker's series, kept in process and mirrored into its slot
+
+    Works without a region too (region=None), in which case the numbers are
+    only visible inside this process.
+    """
+
+    _current = None
+
+    def __init__(self, region=None, slot=0):
+        self.region = region
+        self.slot = slot
+        self.lock = threading.Lock()
+        self.series = {}        # name -> [kind, count, sum, buckets, entry index]
+        self.seq = 0
+        self.overflowed = False
+
+    @classmethod
+    def current(cls):
+        """This process's metrics, attached to the master's region if there is one"""
+        if cls._current is None or cls._current.pid != os.getpid():
+            path = os.environ.get("UNICORN_METRICS")
+            region = MetricsRegion(path) if path else None
+            cls._current = cls(region, int(os.environ.get("UNICORN_SLOT", 0)))
+            cls._current.pid = os.getpid()
+        return cls._current
+
+    def _entry(self, name, kind):
+        entry = self.series.get(name)
+        if entry is None:
+            index = len(self.series)
+            if self.region is not None and index >= self.region.entries:
+                if not self.overflowed:
+                    print(f"[metrics] slot full, not exporting {name} and later series")
+                    self.overflowed = True
+                index = None
+            entry = self.series[name] = [kind, 0, 0.0, [0] * len(BUCKETS), index]
+        return entry
+
+    def _publish(self, name, entry):
+        if self.region is None or entry[4] is None:
+            return
+        offset = self.region._slot_offset(self.slot)
+        self.seq += 1
+        SLOT_HEADER.pack_into(self.region._map, offset, self.seq, len(self.series))
+        ENTRY.pack_into(self.region._map, self.region._entry_offset(self.slot, entry[4]),
+                        entry[0], name.encode()[:168], entry[1], entry[2], *entry[3])
+        self.seq += 1
+        SLOT_HEADER.pack_into(self.region._map, offset, self.seq, min(len(self.series), self.region.entries))
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            entry = self._entry(name, COUNTER)
+            entry[1] += amount
+            self._publish(name, entry)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            entry = self._entry(name, HISTOGRAM)
+            entry[1] += 1
+            entry[2] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[3][i] += 1
+                    break
+            self._publish(name, entry)
+
+
+def labels(**values):
+    return ",".join(f'{key}="{value}"' for key, value in values.items())
+
+
+def route(request):
+    """The route a request matched, as its URL rule"""
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def install(app):
+    """Record per-route request counts and latency for a Flask app"""
+    from flask import g, request
+
+    def record(status):
+        started = g.pop("_metrics_started", None)
+        if started is None:
+            return
+        series = labels(route=route(request), method=request.method, status=f"{status // 100}xx")
+        WorkerMetrics.current().observe(f"{HTTP_SERIES}{{{series}}}", time.perf_counter() - started)
+
+    @app.before_request
+    def start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_response(response):
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_error(exc):
+        # only still pending when the view raised and no response was made
+        record(500)
+
+
+def requests_handled():
+    """Requests this worker has answered, summed over its routes"""
+    metrics = WorkerMetrics.current()
+    with metrics.lock:
+        return sum(entry[1] for name, entry in metrics.series.items() if name.startswith(HTTP_SERIES + "{"))
+
+
+def merge(total, series):
+    """Add one slot's series into an aggregate dict"""
+    for name, (kind, count, value, buckets) in series.items():
+        if name not in total:
+            total[name] = (kind, 0, 0.0, [0] * len(BUCKETS))
+        _, c, v, b = total[name]
+        total[name] = (kind, c + count, v + value, [x + y for x, y in zip(b, buckets)])
+    return total
+
+
+def _with_label(name, extra):
+    """unicorn_x{a="1"} + service="p" -> unicorn_x{service="p",a="1"}"""
+    base, _, rest = name.partition("{")
+    rest = rest.rstrip("}")
+    return base, extra + ("," + rest if rest else "")
+
+
+def render(per_service, gauges=()):
+    """Prometheus text format for {service: aggregated series} plus extra gauges
+
+    gauges is a list of (metric name, labels string, value) tuples. Samples
+    are grouped by metric family, as the format requires.
+    """
+    families = {}
+    for service, series in sorted(per_service.items()):
+        for name, (kind, count, value, buckets) in sorted(series.items()):
+            base, label_set = _with_label(name, labels(service=service))
+            if kind == COUNTER:
+                families.setdefault(base, ("counter", []))[1].append(f"{base}{{{label_set}}} {count}")
+                continue
+            lines = families.setdefault(base, ("histogram", []))[1]
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{base}_bucket{{{label_set},le="{le}"}} {cumulative}')
+            lines.append(f"{base}_sum{{{label_set}}} {value}")
+            lines.append(f"{base}_count{{{label_set}}} {count}")
+    for name, label_set, value in gauges:
+        families.setdefault(name, ("gauge", []))[1].append(f"{name}{{{label_set}}} {value}")
+
+    out = []
+    for base, (kind, lines) in families.items():
+        out.append(f"# TYPE {base} {kind}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
@@ -0,0 +1,161 @@
+"""
+Versioned schema migrations
+
+db.create_all() only creates missing tables; it never changes a table that
+already exists, so indexes added to the models would never reach the
+production database. Changes after the initial schema are listed in
+MIGRATIONS instead, one version each. On SQLite the database's version is
+PRAGMA user_version, and migrate() applies every newer migration and
+bumps it in the same transaction, so a migration is applied completely or
+not at all.
+
+bootstrap() brings a database to the current schema: create_all(), then
+migrate(), then the search index (search.install()). The services no
+longer do this at import. unicorn_master runs it once, before the first
+worker starts and before every rolling reload, as the "bootstrap" command
+in unicorn_config.json:
+
+    "bootstrap": ["shared/migrations.py", "bootstrap"]
+
+So a worker start, crash restart or scale-out never reflects the schema
+or waits for the write lock. migrate() checks the version without a lock
+first, so when nothing is pending the check costs one PRAGMA. Otherwise
+it takes the write lock (BEGIN IMMEDIATE), checks again and applies the
+pending migrations, so two bootstraps at once do the work once.
+
+Migrations can be applied online. Readers keep running (WAL) while an
+index is being built. Writers wait on the lock for up to busy_timeout; the
+order endpoints answer 503 with Retry-After past that. To build a big
+index outside of a deploy:
+
+    python shared/migrations.py status
+    python shared/migrations.py migrate      (DATABASE_URL picks the database)
+    python shared/migrations.py bootstrap    tables, migrations and search index
+    python shared/migrations.py analyze      refresh the planner statistics
+
+The planner statistics (sqlite_stat1) come from ANALYZE. A migration that
+adds an index runs it, and so should a bulk load into a fresh database.
+
+Indexes are also declared on the models, under the same names, so a fresh
+database gets them from create_all() and the migration finds them there
+(IF NOT EXISTS).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+MIGRATIONS = [
+    (1, "indexes for the hot filters", [
+        # get_orders: WHERE user_id = ? ORDER BY id (the rowid is in every index)
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_id ON orders (user_id)",
+        # get_products: WHERE is_active AND category = ? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS ix_products_active_category ON products (is_active, category)",
+        # Order.items: WHERE order_id IN (...)
+        "CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)",
+        # without statistics the planner would serve the unfiltered product
+        # list through ix_products_active_category and sort every active row
+        # for each page, instead of walking the primary key
+        "PRAGMA analysis_limit = 1000",
+        "ANALYZE",
+    ]),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(engine):
+    """Apply pending migrations; returns the versions applied"""
+    if engine.dialect.name != "sqlite":
+        return []
+    conn = engine.raw_connection()
+    isolation_level = conn.isolation_level
+    applied = []
+    try:
+        cursor = conn.cursor()
+        if current_version(cursor) >= LATEST:
+            return []
+        conn.isolation_level = None
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(cursor)
+            for number, description, statements in MIGRATIONS:
+                if number <= version:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {number}")
+                applied.append(number)
+                print(f"[migrations] applied {number}: {description}")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+        conn.close()
+    return applied
+
+
+def bootstrap(engine):
+    """Create missing tables, apply pending migrations and build the search index; returns the versions applied"""
+    from models import db
+    import search
+
+    db.metadata.create_all(engine)
+    applied = migrate(engine)
+    search.install(engine)
+    return applied
+
+
+def analyze(engine):
+    """Refresh sqlite_stat1 so the planner knows how selective each index is"""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA analysis_limit = 1000")
+        cursor.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Show or apply schema migrations")
+    parser.add_argument("command", choices=["status", "migrate", "analyze", "bootstrap"])
+    parser.add_argument("--database", default=os.environ.get(
+        "DATABASE_URL", "sqlite:///C:/production/database/ecommerce.db"))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database)
+    if args.command == "bootstrap":
+        started = time.perf_counter()
+        applied = bootstrap(engine)
+        print(f"[migrations] schema ready in {time.perf_counter() - started:.2f}s"
+              + (f", applied {applied}" if applied else ""))
+        return
+    if engine.dialect.name != "sqlite":
+        sys.exit("migrations are tracked with PRAGMA user_version, SQLite only")
+    if args.command == "migrate":
+        applied = migrate(engine)
+        print(f"applied {applied}" if applied else "nothing to apply")
+    if args.command == "analyze":
+        analyze(engine)
+    conn = engine.raw_connection()
+    try:
+        version = current_version(conn.cursor())
+    finally:
+        conn.close()
+    for number, description, statements in MIGRATIONS:
+        print(f"  {'applied' if number <= version else 'pending'}  {number}: {description}")
+
+
+if __name__ == "__main__":
+    main()
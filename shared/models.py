@@ -6,7 +6,16 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
-db = SQLAlchemy()
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose apps share an engine when their engine options match (see database.py)"""
+
+    def _make_engine(self, bind_key, options, app):
+        # Flask-SQLAlchemy 3.x's engine factory (pinned in requirements.txt); it is
+        # documented as internal, so check its signature when upgrading
+        from database import shared_engine
+        return shared_engine(bind_key, options, app)
+
+db = SharedEngineSQLAlchemy()
 
 class User(db.Model):
     """User model"""
@@ -40,6 +49,7 @@ class User(db.Model):
 class Product(db.Model):
     """Product model"""
     __tablename__ = 'products'
+    __table_args__ = (db.Index('ix_products_active_category', 'is_active', 'category'),)
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -69,7 +79,7 @@ class Order(db.Model):
     __tablename__ = 'orders'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     status = db.Column(db.String(50), default='pending')  # pending, confirmed, shipped, delivered, cancelled
     total_amount = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -94,7 +104,7 @@ class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
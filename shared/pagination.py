@@ -0,0 +1,79 @@
+"""
+Keyset pagination and streamed JSON for list endpoints
+
+Query string:
+  after_id  - only rows with a larger id (the previous page's next_after_id)
+  limit     - page size, 1..MAX_LIMIT; the response then has next_after_id,
+              null on the last page
+  stream=1  - send every row after after_id as one JSON document written
+              row by row, in constant memory (no limit, no next_after_id)
+Without any of them an endpoint returns everything, as it always did.
+
+A keyset page is WHERE id > after_id ORDER BY id LIMIT n, so every page
+costs the same however deep into the table it is, unlike OFFSET.
+"""
+
+from itertools import islice
+
+from flask import current_app, stream_with_context
+
+MAX_LIMIT = 1000
+STREAM_BATCH = 500
+
+
+def page_params(args):
+    """after_id/limit/stream from request.args -> (params, error message)"""
+    try:
+        after_id = int(args.get('after_id', 0))
+        limit = int(args['limit']) if 'limit' in args else None
+    except ValueError:
+        return None, "after_id and limit must be integers"
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        return None, f"limit must be between 1 and {MAX_LIMIT}"
+    stream = args.get('stream') in ('1', 'true')
+    if stream and limit is not None:
+        return None, "limit does not apply to stream=1"
+    return {"after_id": after_id, "limit": limit, "stream": stream}, None
+
+
+def keyset(query, model, params):
+    return query.filter(model.id > params["after_id"]).order_by(model.id)
+
+
+def paginate(query, model, params):
+    """One page of rows and the cursor for the next one (None when done)"""
+    query = keyset(query, model, params)
+    if params["limit"] is None:
+        return query.all(), None
+    rows = query.limit(params["limit"] + 1).all()
+    if len(rows) > params["limit"]:
+        rows = rows[:params["limit"]]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def stream_json(key, query, model, params, instance, to_dicts=lambda rows: [row.to_dict() for row in rows]):
+    """{"instance":..., key: [rows...], "success": true, "total": n} as a generator response
+
+    Keys come out in the order jsonify would sort them, and "total" is last
+    so it can be counted while streaming. to_dicts() gets STREAM_BATCH rows
+    at a time, so it can load what they need in one query.
+    """
+    app = current_app._get_current_object()
+    dumps = lambda obj: app.json.dumps(obj, separators=(",", ":"))
+
+    def generate():
+        yield '{"instance":' + dumps(instance) + ',"' + key + '":['
+        total = 0
+        batch = []
+        rows = iter(keyset(query, model, params).yield_per(STREAM_BATCH))
+        while True:
+            batch = list(islice(rows, STREAM_BATCH))
+            if not batch:
+                break
+            # one encoder call per batch: "[a,b,c]" without its brackets
+            yield ("," if total else "") + dumps(to_dicts(batch))[1:-1]
+            total += len(batch)
+        yield '],"success":true,"total":' + str(total) + '}\n'
+
+    return app.response_class(stream_with_context(generate()), mimetype=app.json.mimetype)
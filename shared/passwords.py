@@ -0,0 +1,151 @@
+"""
+Password hashing off the request threads
+
+werkzeug's password hashes (scrypt by default) cost tens of milliseconds
+of CPU each. Run on the waitress threads, a handful of logins at once held
+all of a users worker's threads and /api/users/me queued behind them. The
+users service hashes through PasswordHasher instead:
+
+  - hashes run in a small process pool owned by the worker
+    (PASSWORD_WORKERS processes), so they do not hold the worker's GIL;
+  - at most PASSWORD_MAX_PENDING hashes wait or run per worker, by
+    default one less than the worker's threads, so one thread is always
+    left for other requests. A hash over the bound raises HashingBusy,
+    which the service answers with 503 and Retry-After;
+  - new hashes use PASSWORD_METHOD. A login whose stored hash was made
+    with other parameters rehashes the password it was just given and
+    saves it (needs_rehash()), so raising the cost reaches every active
+    user without a reset.
+
+PASSWORD_WORKERS=0 hashes on the request thread, still bounded. Settings
+come from app.config or the environment, as in database.py.
+
+serve_app() starts the pool before waitress starts its threads, so on
+POSIX its processes are forked from a single-threaded worker. On Windows
+they are spawned and each imports the service script once; start() does
+nothing in them.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from database import setting
+from metrics import WorkerMetrics, labels
+
+DEFAULTS = {
+    "PASSWORD_METHOD": "scrypt:32768:8:1",   # werkzeug's default, e.g. "pbkdf2:sha256:600000"
+    "PASSWORD_WORKERS": 1,                   # processes per worker; 0: hash on the request thread
+    "PASSWORD_MAX_PENDING": 0,               # 0: worker threads - 1
+}
+
+
+def pool_initializer():
+    """Runs first in every pool process: let go of the worker's socket, die with the worker"""
+    fd = os.environ.get("UNICORN_FD")
+    if fd:
+        os.close(int(fd))   # a forked copy of the listening socket keeps the port bound
+    parent = multiprocessing.parent_process()
+
+    def exit_with_parent():
+        parent.join()
+        os._exit(0)
+
+    # the worker leaves with os._exit() (see server.py), which does not shut the pool down
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+
+
+def method_prefix(method):
+    """What werkzeug writes before the salt for method, e.g. "scrypt" -> "scrypt:32768:8:1"
+
+    Fills in werkzeug's defaults the way generate_password_hash() does,
+    without paying for a hash.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = map(int, args) if args else (2**15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == "pbkdf2" and len(args) <= 2:
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+class HashingBusy(Exception):
+    """Every hashing slot of this worker is taken; try again shortly"""
+
+
+class PasswordHasher:
+    """The users service's hashing pool"""
+
+    def __init__(self, app=None):
+        self.pool = None
+        self.pid = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = setting(app, "PASSWORD_METHOD", DEFAULTS)
+        self.prefix = method_prefix(self.method)
+        self.workers = setting(app, "PASSWORD_WORKERS", DEFAULTS)
+        pending = setting(app, "PASSWORD_MAX_PENDING", DEFAULTS)
+        self.max_pending = pending or max(1, int(os.environ.get("UNICORN_THREADS", 4)) - 1)
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions["passwords"] = self
+
+    def start(self):
+        """Start the pool for this process; call while no other thread runs"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pool = None
+            self.pid = os.getpid()
+            # pool processes spawned on Windows import the service again; they must not start pools
+            if self.workers == 0 or multiprocessing.parent_process() is not None:
+                return
+            context = multiprocessing.get_context("spawn" if os.name == "nt" else "fork")
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=pool_initializer)
+            if os.name != "nt":
+                self.pool.submit(int).result()   # fork them now
+
+    def _run(self, op, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            WorkerMetrics.current().inc(f"unicorn_password_busy_total{{{labels(op=op)}}}")
+            raise HashingBusy()
+        try:
+            started = time.perf_counter()
+            if self.pid != os.getpid():
+                self.start()
+            if self.pool is None:
+                result = fn(*args)
+            else:
+                try:
+                    result = self.pool.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    print("[passwords] hashing pool died, restarting it")
+                    with self.lock:
+                        self.pid = None
+                    raise HashingBusy()
+            WorkerMetrics.current().observe(f"unicorn_password_hash_seconds{{{labels(op=op)}}}",
+                                            time.perf_counter() - started)
+            return result
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """A new hash of password with PASSWORD_METHOD"""
+        return self._run("hash", generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        return self._run("check", check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if password_hash was made with other parameters than PASSWORD_METHOD"""
+        return password_hash.split("$", 1)[0] != self.prefix
@@ -0,0 +1,218 @@
+"""
+Where a request's time goes: per-request timings and a sampling profiler
+
+install(app) times every request of a service and splits it up:
+  total  wall time from before_request to the response
+  cpu    CPU time of the request's thread (time.thread_time)
+  db     SQL statements run on the request's thread, counted and timed
+         through SQLAlchemy's cursor events on every engine of the app;
+         desc gives the count. SQLite returns the first row from execute,
+         so fetching the rest of a big result is not in here
+  jwt    verifying the access token (identity.py; near 0 on a cache hit)
+  json   encoding with app.json (jsonify, cached_response, stream_json)
+  app    what is left: the view, fetching rows, building ORM objects or
+         dicts, Flask itself
+and sends it back as a Server-Timing header, which the browser devtools
+show per request:
+
+  Server-Timing: total;dur=12.4, cpu;dur=9.8, db;dur=3.1;desc="2 queries", jwt;dur=0.0, json;dur=1.2, app;dur=8.1
+
+The worker's metrics get the same per route (route and method labels):
+unicorn_request_cpu_seconds, unicorn_request_sql_seconds,
+unicorn_request_serialization_seconds and unicorn_request_sql_queries_total,
+next to unicorn_http_request_duration_seconds from metrics.py. A streamed
+response sends its header before the body exists; its metrics are recorded
+once the body has been sent and include the body's queries. Work handed
+to another thread (the group-commit writer, the password pool) shows up
+as app time of the request that waits for it.
+
+PROFILER_ENDPOINT=1 adds GET /debug/profile, a sampling profiler for the
+worker that answers it. It samples the stacks of the threads that are
+serving requests (threads=all: every thread) for ?seconds= at ?hz= and
+returns them as folded stacks, one "route;caller;...;callee count" line
+per distinct stack, ready for flamegraph.pl or speedscope. The sampler is
+a thread of the worker, so it only sees where the other threads let go of
+the GIL; time in C code that keeps it shows at the calling line. It only
+answers on loopback without proxy headers, so call a worker directly,
+best on its private health port, which picks the exact process:
+
+  curl "http://127.0.0.1:<port>/debug/profile?seconds=10" > worker.folded
+  flamegraph.pl worker.folded > worker.svg
+
+PROFILING=0 turns the timings off. Settings come from app.config or the
+environment, as in database.py.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, jsonify, request
+from sqlalchemy import event
+
+from database import setting
+from metrics import WorkerMetrics, labels, route
+from models import db
+
+DEFAULTS = {
+    "PROFILING": True,
+    "PROFILER_ENDPOINT": False,
+}
+PROFILE_MAX_SECONDS = 60
+PROFILE_MAX_HZ = 1000
+LOOPBACK = ("127.0.0.1", "::1")
+SERIES = ("unicorn_request_cpu_seconds", "unicorn_request_sql_seconds",
+          "unicorn_request_serialization_seconds", "unicorn_request_sql_queries_total")
+
+local = threading.local()       # .timings of the request this thread is serving
+active = {}                     # thread ident -> "GET /api/orders" while it serves a request
+profile_lock = threading.Lock()
+frame_names = {}                # code object -> "function (dir/file.py:line)"
+series_names = {}               # (route, method) -> the four metric names
+
+
+def add(name, seconds):
+    """Charge seconds to name ("jwt", "json") of the current request, if any"""
+    timings = getattr(local, "timings", None)
+    if timings is not None:
+        timings[name] += seconds
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and getattr(local, "timings", None) is not None:
+        context._profiling_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_profiling_started", None)
+    timings = getattr(local, "timings", None)
+    if started is not None and timings is not None:
+        timings["sql"] += time.perf_counter() - started
+        timings["queries"] += 1
+
+
+def server_timing(timings, total, cpu):
+    ms = {name: timings[name] * 1000 for name in ("sql", "jwt", "json")}
+    rest = max(total * 1000 - sum(ms.values()), 0.0)
+    return (f"total;dur={total * 1000:.1f}, cpu;dur={cpu * 1000:.1f}, "
+            f'db;dur={ms["sql"]:.1f};desc="{timings["queries"]} queries", jwt;dur={ms["jwt"]:.1f}, '
+            f"json;dur={ms['json']:.1f}, app;dur={rest:.1f}")
+
+
+def install(app):
+    """Time every request of app; call after database.init_app and serialization.install"""
+    if setting(app, "PROFILER_ENDPOINT", DEFAULTS):
+        app.add_url_rule("/debug/profile", "debug_profile", profile)
+    if not setting(app, "PROFILING", DEFAULTS):
+        return
+
+    with app.app_context():
+        # a combined root app (combined.py) has no database of its own
+        engines = db.engines.values() if "sqlalchemy" in app.extensions else ()
+        for engine in engines:
+            # apps in one process can share an engine (database.py)
+            if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+                event.listen(engine, "before_cursor_execute", before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+    provider = app.json
+    dumps = provider.dumps
+
+    def timed_dumps(obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return dumps(obj, **kwargs)
+        finally:
+            add("json", time.perf_counter() - started)
+
+    provider.dumps = timed_dumps
+
+    @app.before_request
+    def start_timings():
+        local.timings = {"sql": 0.0, "queries": 0, "jwt": 0.0, "json": 0.0}
+        local.started = time.perf_counter()
+        local.cpu_started = time.thread_time()
+        local.route = (route(request), request.method)
+        active[threading.get_ident()] = f"{local.route[1]} {local.route[0]}"
+
+    @app.after_request
+    def add_header(response):
+        timings = getattr(local, "timings", None)
+        if timings is not None:
+            response.headers["Server-Timing"] = server_timing(
+                timings, time.perf_counter() - local.started, time.thread_time() - local.cpu_started)
+        return response
+
+    @app.teardown_request
+    def record(exc):
+        timings = getattr(local, "timings", None)
+        local.timings = None
+        active.pop(threading.get_ident(), None)
+        if timings is None:
+            return
+        names = series_names.get(local.route)
+        if names is None:
+            series = labels(route=local.route[0], method=local.route[1])
+            names = series_names[local.route] = [f"{name}{{{series}}}" for name in SERIES]
+        metrics = WorkerMetrics.current()
+        metrics.observe(names[0], time.thread_time() - local.cpu_started)
+        metrics.observe(names[1], timings["sql"])
+        metrics.observe(names[2], timings["json"])
+        metrics.inc(names[3], timings["queries"])
+
+
+def frame_name(code):
+    name = frame_names.get(code)
+    if name is None:
+        path = code.co_filename.replace("\\", "/").rsplit("/", 2)[-2:]
+        name = frame_names[code] = f"{code.co_name} ({'/'.join(path)}:{code.co_firstlineno})"
+    return name
+
+
+def sample(seconds, hz, all_threads=False):
+    """Folded stacks of this process's request threads (or all threads), sampled for seconds"""
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    counts = Counter()
+    interval = 1 / hz
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            root = active.get(ident)
+            if ident == me or (root is None and not all_threads):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            counts[(root or names.get(ident, f"thread-{ident}"), tuple(reversed(stack)))] += 1
+        samples += 1
+        time.sleep(interval)
+    lines = [";".join([root] + [frame_name(code) for code in stack]) + f" {count}"
+             for (root, stack), count in counts.most_common()]
+    return lines, samples
+
+
+def profile():
+    """GET /debug/profile?seconds=10&hz=100[&threads=all]: folded stacks of this worker"""
+    if request.remote_addr not in LOOPBACK or "X-Forwarded-For" in request.headers \
+            or "X-Real-IP" in request.headers:
+        return jsonify({"success": False, "error": "Profiling is only served to local clients"}), 403
+    try:
+        seconds = min(float(request.args.get("seconds", 10)), PROFILE_MAX_SECONDS)
+        hz = min(max(float(request.args.get("hz", 100)), 1), PROFILE_MAX_HZ)
+    except ValueError:
+        return jsonify({"success": False, "error": "seconds and hz must be numbers"}), 400
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"success": False, "error": "A profile is already running"}), 409
+    try:
+        lines, samples = sample(seconds, hz, request.args.get("threads") == "all")
+    finally:
+        profile_lock.release()
+    response = current_app.response_class("".join(line + "\n" for line in lines), mimetype="text/plain")
+    response.headers["X-Profile-Samples"] = str(samples)
+    response.headers["X-Profile-Pid"] = str(os.getpid())
+    return response
@@ -0,0 +1,311 @@
+"""
+Rate-limit storage shared by all workers (flask-limiter's "unicorn://")
+
+With storage_uri="memory://" every worker counted on its own, so a limit
+of 10 per hour really allowed 10 per worker. This backend keeps the
+counters in run/limits, a file-backed mmap the master shares with every
+worker (UNICORN_LIMITS), the same way as run/generations: a worker only
+writes its own slot, and a key's count is the sum of its counter over
+all slots. No lock is shared between processes and there is no network
+round trip; the threading lock only serialises the worker's own threads.
+
+Each slot is a hash table of ENTRIES_PER_SLOT counters. A counter holds a
+key fingerprint, the window length, the window number (time / length)
+and the counts of that window and the one before it, which is all the
+sliding window counter strategy needs:
+
+    weighted = previous * (part of the previous window still in range) + current
+
+A hit is added to the worker's own counter first and the sum is read
+after; if it went over the limit the hit is taken back and refused.
+Two workers racing for the last hit can both refuse it, but more hits
+than the limit are never let through. Writes bump the slot's sequence
+number (odd while writing) so readers in other workers see whole
+entries without taking a lock, as in metrics.py.
+
+The master never clears a slot, so a restarted worker keeps counting
+where its slot left off. Outside the master (python app.py, tests) the
+counters live in anonymous memory and are per process. Stdlib only,
+apart from the limits base classes, because the master imports it too;
+limiter() refuses to start on a limits release older than LIMITS_REQUIRED.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import lru_cache
+from math import floor
+
+try:
+    from limits import __version__ as LIMITS_VERSION
+    from limits.storage import SlidingWindowCounterSupport, Storage
+except ImportError:  # the master only creates the file; limiter() reports it
+    LIMITS_VERSION = Storage = None
+
+# incr(key, expiry, amount) without elastic_expiry, and SlidingWindowCounterSupport
+LIMITS_REQUIRED = 5
+
+MAGIC = b"UCRL"
+HEADER = struct.Struct("<4sII")         # magic, slots, entries per slot
+SEQUENCE = struct.Struct("<q")
+ENTRY = struct.Struct("<qqqqq")         # fingerprint, window length, window number, current, previous
+FINGERPRINT = struct.Struct("<q")
+ENTRIES_PER_SLOT = 4096
+MAX_PROBES = 32
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(key):
+    """Stable 64-bit hash of a key, never 0 (0 marks an empty entry)"""
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little", signed=True)
+    return value or 1
+
+
+def window_counts(window, current, previous, now_window):
+    """(previous, current) counts of an entry as seen from window now_window"""
+    if window == now_window:
+        return previous, current
+    if window == now_window - 1:
+        return current, 0
+    return 0, 0
+
+
+class LimitRegion:
+    """The mmap'd counter tables; the master creates the file, workers attach to it
+
+    path=None keeps the tables in anonymous memory, private to this process.
+    """
+
+    def __init__(self, path=None, slots=None, entries=ENTRIES_PER_SLOT):
+        self.path = None if path is None else str(path)
+        self._file = None
+        if self.path is None:
+            slots = slots or 1
+            self._map = mmap.mmap(-1, self._size(slots, entries))
+            HEADER.pack_into(self._map, 0, MAGIC, slots, entries)
+        else:
+            if slots is not None:
+                with open(self.path, "wb") as f:
+                    f.write(HEADER.pack(MAGIC, slots, entries))
+                    f.write(b"\0" * (self._size(slots, entries) - HEADER.size))
+            self._file = open(self.path, "r+b")
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.slots, self.entries = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a rate limit file")
+        self.slot_size = SEQUENCE.size + self.entries * ENTRY.size
+
+    @staticmethod
+    def _size(slots, entries):
+        return HEADER.size + slots * (SEQUENCE.size + entries * ENTRY.size)
+
+    def _slot_offset(self, slot):
+        if not 0 <= slot < self.slots:
+            raise IndexError(f"rate limit slot {slot} out of range")
+        return HEADER.size + slot * self.slot_size
+
+    def probes(self, slot, key_fingerprint):
+        """Offsets of the entries key_fingerprint may occupy in a slot, in probe order"""
+        base = self._slot_offset(slot) + SEQUENCE.size
+        start = key_fingerprint % self.entries
+        for i in range(min(MAX_PROBES, self.entries)):
+            yield base + (start + i) % self.entries * ENTRY.size
+
+    def find(self, slot, key_fingerprint):
+        """The key's entry in a slot, (offset, values) or None"""
+        for offset in self.probes(slot, key_fingerprint):
+            stored = FINGERPRINT.unpack_from(self._map, offset)[0]
+            if stored == key_fingerprint:
+                return offset, ENTRY.unpack_from(self._map, offset)
+            if stored == 0:
+                return None
+        return None
+
+    def read(self, slot, key_fingerprint, retries=100):
+        """Consistent copy of the key's entry in a slot another worker may be writing"""
+        offset = self._slot_offset(slot)
+        for _ in range(retries):
+            seq = SEQUENCE.unpack_from(self._map, offset)[0]
+            if seq % 2:
+                time.sleep(0)
+                continue
+            found = self.find(slot, key_fingerprint)
+            if SEQUENCE.unpack_from(self._map, offset)[0] == seq:
+                return found and found[1]
+        return None
+
+    def read_all(self, key_fingerprint):
+        """The key's entry in every slot that has one"""
+        first = HEADER.size + SEQUENCE.size + key_fingerprint % self.entries * ENTRY.size
+        found = []
+        for slot in range(self.slots):
+            # most workers never saw the key: its first probe is still empty
+            if FINGERPRINT.unpack_from(self._map, first + slot * self.slot_size)[0] != 0:
+                values = self.read(slot, key_fingerprint)
+                if values is not None:
+                    found.append(values)
+        return found
+
+    def write(self, slot, offset, values):
+        """Replace an entry in this worker's own slot"""
+        seq_offset = self._slot_offset(slot)
+        seq = SEQUENCE.unpack_from(self._map, seq_offset)[0]
+        SEQUENCE.pack_into(self._map, seq_offset, seq + 1)
+        ENTRY.pack_into(self._map, offset, *values)
+        SEQUENCE.pack_into(self._map, seq_offset, seq + 2)
+
+    def clear(self):
+        self._map[HEADER.size:] = b"\0" * (len(self._map) - HEADER.size)
+
+    def close(self):
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+
+if Storage is not None:
+
+    class UnicornStorage(Storage, SlidingWindowCounterSupport):
+        """limits storage over the master's LimitRegion ("unicorn://")
+
+        Supports the fixed window and sliding window counter strategies.
+        """
+
+        STORAGE_SCHEME = ["unicorn"]
+
+        def __init__(self, uri=None, wrap_exceptions=False, **options):
+            self.lock = threading.Lock()
+            self.pid = None
+            self.overflowed = False
+            super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+        @property
+        def base_exceptions(self):
+            return ValueError
+
+        def _attach(self):
+            """The region and slot of this process (preloaded apps create the storage before forking)"""
+            if self.pid != os.getpid():
+                path = os.environ.get("UNICORN_LIMITS")
+                if not path:
+                    print("[ratelimit] not running under unicorn_master, limits are per process")
+                self.region = LimitRegion(path or None)
+                self.slot = int(os.environ.get("UNICORN_SLOT", 0)) if path else 0
+                self.pid = os.getpid()
+            return self.region
+
+        def _add(self, key, expiry, amount, now):
+            """Add amount to the current window of key in this worker's slot"""
+            region = self._attach()
+            key_fingerprint = fingerprint(key)
+            now_window = int(now // expiry)
+            previous = current = 0
+            target = None
+            for offset in region.probes(self.slot, key_fingerprint):
+                values = ENTRY.unpack_from(region._map, offset)
+                if values[0] == key_fingerprint:
+                    target = offset
+                    if values[1] == expiry:
+                        previous, current = window_counts(*values[2:], now_window)
+                    break
+                # an empty entry, or another key's whose windows have both passed
+                if target is None and (values[0] == 0
+                                       or window_counts(*values[2:], int(now // values[1])) == (0, 0)):
+                    target = offset
+                if values[0] == 0:
+                    break
+            if target is None:
+                if not self.overflowed:
+                    print(f"[ratelimit] slot {self.slot} is full, hits on some keys are not counted")
+                    self.overflowed = True
+                return
+            region.write(self.slot, target, (key_fingerprint, expiry, now_window, current + amount, previous))
+
+        def _counts(self, key, now, expiry=None):
+            """(previous, current, window length) of key summed over every worker"""
+            previous = current = 0
+            for values in self._attach().read_all(fingerprint(key)):
+                if expiry is not None and values[1] != expiry:
+                    continue
+                expiry = values[1]
+                p, c = window_counts(*values[2:], int(now // expiry))
+                previous += p
+                current += c
+            return previous, current, expiry
+
+        def incr(self, key, expiry, amount=1):
+            now = time.time()
+            with self.lock:
+                self._add(key, expiry, amount, now)
+                return self._counts(key, now, expiry)[1]
+
+        def get(self, key):
+            return self._counts(key, time.time())[1]
+
+        def get_expiry(self, key):
+            now = time.time()
+            expiry = self._counts(key, now)[2]
+            return now if expiry is None else (int(now // expiry) + 1) * expiry
+
+        def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+            if amount > limit:
+                return False
+            now = time.time()
+            weight = 1 - now / expiry % 1   # part of the previous window still in range
+            with self.lock:
+                self._add(key, expiry, amount, now)
+                previous, current, _ = self._counts(key, now, expiry)
+                if floor(previous * weight + current) > limit:
+                    self._add(key, expiry, -amount, now)
+                    return False
+                return True
+
+        def get_sliding_window(self, key, expiry):
+            now = time.time()
+            previous, current, _ = self._counts(key, now, expiry)
+            left = (1 - now / expiry % 1) * expiry
+            return previous, (left if previous else 0.0), current, left + expiry
+
+        def clear_sliding_window(self, key, expiry):
+            self.clear(key)
+
+        def clear(self, key):
+            """Zero the key in every slot (an admin action; may race a worker's hit)"""
+            region = self._attach()
+            key_fingerprint = fingerprint(key)
+            with self.lock:
+                for slot in range(region.slots):
+                    found = region.find(slot, key_fingerprint)
+                    if found is not None:
+                        region.write(slot, found[0], (key_fingerprint, found[1][1], found[1][2], 0, 0))
+
+        def check(self):
+            return True
+
+        def reset(self):
+            self._attach().clear()
+            return None
+
+
+shared = {"limiter": None}
+
+
+def limiter(app):
+    """The process's flask-limiter Limiter on unicorn://, initialised for app as well
+
+    One per process, so the services mounted together (combined.py) share it.
+    """
+    if Storage is None or int(LIMITS_VERSION.split(".")[0]) < LIMITS_REQUIRED:
+        raise RuntimeError(f"the unicorn:// rate-limit storage needs limits>={LIMITS_REQUIRED} "
+                           f"(see requirements.txt), found {LIMITS_VERSION or 'none'}")
+    from flask_limiter import Limiter
+    from flask_limiter.util import get_remote_address
+
+    if shared["limiter"] is None:
+        shared["limiter"] = Limiter(key_func=get_remote_address, storage_uri="unicorn://",
+                                    strategy="sliding-window-counter")
+    shared["limiter"].init_app(app)
+    return shared["limiter"]
@@ -0,0 +1,110 @@
+"""
+Scoreboard shared between unicorn_master and its workers
+
+A small file-backed mmap with one fixed-size slot per worker. A worker only
+ever writes its own slot, so there is no cross-process locking; the master
+reads all slots to see how busy each service is. Stdlib only, because the
+master imports it too.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"UCSB"
+HEADER = struct.Struct("<4sII")            # magic, slot count, slot size
+SLOT = struct.Struct("<qqqqddq")           # pid, state, in_flight, requests, busy_seconds, started_at, health_port
+SLOT_SIZE = 64
+
+STATE_FREE = 0
+STATE_STARTING = 1
+STATE_READY = 2
+STATE_DRAINING = 3
+
+
+class Scoreboard:
+    """The mmap'd slot table; the master creates it, workers attach to it"""
+
+    def __init__(self, path, slots=None):
+        self.path = str(path)
+        if slots is not None:
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, slots, SLOT_SIZE))
+                f.write(b"\0" * (slots * SLOT_SIZE))
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.slots, slot_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            raise ValueError(f"{self.path} is not a scoreboard file")
+
+    def _offset(self, slot):
+        if not 0 <= slot < self.slots:
+            raise IndexError(f"scoreboard slot {slot} out of range")
+        return HEADER.size + slot * SLOT_SIZE
+
+    def read(self, slot):
+        pid, state, in_flight, requests, busy, started, health_port = SLOT.unpack_from(self._map, self._offset(slot))
+        return {"pid": pid, "state": state, "in_flight": in_flight, "requests": requests,
+                "busy_seconds": busy, "started_at": started, "health_port": health_port}
+
+    def clear(self, slot):
+        SLOT.pack_into(self._map, self._offset(slot), 0, STATE_FREE, 0, 0, 0.0, 0.0, 0)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class WorkerSlot:
+    """A worker's own view of its slot
+
+    Counters are kept in process and mirrored into the scoreboard after every
+    change; the lock only serialises this worker's threads. Works without a
+    scoreboard too (board=None), so the drain logic can always ask in_flight.
+    """
+
+    def __init__(self, board=None, slot=0):
+        self.board = board
+        self.slot = slot
+        self.lock = threading.Lock()
+        self.state = STATE_STARTING
+        self.in_flight = 0
+        self.requests = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.time()
+        self.health_port = 0
+        self._publish()
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get("UNICORN_SCOREBOARD")
+        if not path:
+            return cls()
+        return cls(Scoreboard(path), int(os.environ.get("UNICORN_SLOT", 0)))
+
+    def _publish(self):
+        if self.board is not None:
+            SLOT.pack_into(self.board._map, self.board._offset(self.slot), os.getpid(), self.state,
+                           self.in_flight, self.requests, self.busy_seconds, self.started_at,
+                           self.health_port)
+
+    def set_state(self, state, health_port=None):
+        with self.lock:
+            self.state = state
+            if health_port is not None:
+                self.health_port = health_port
+            self._publish()
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+            self._publish()
+
+    def request_finished(self, seconds):
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.busy_seconds += seconds
+            self._publish()
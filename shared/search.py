@@ -0,0 +1,125 @@
+"""
+Full-text product search
+
+On SQLite the products are indexed in products_fts, an FTS5 table with
+products as its external content. Triggers keep it in sync: a product is
+in the index while it is active, so a soft delete (is_active = False)
+removes it and reactivating adds it back. Stock and price updates do not
+touch the index.
+
+Every word of the query matches as a prefix ("lap pro" finds "Laptop Pro
+15"); results are ranked by bm25 with name hits weighted above description
+hits. Without FTS5 (other databases, or an SQLite built without it) search
+falls back to the old ILIKE scan.
+
+install() runs once per database, from migrations.bootstrap(); a worker
+looks for products_fts on its first search instead.
+"""
+
+import re
+
+from sqlalchemy import text
+
+from models import db, Product
+from serialization import PRODUCT
+
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE products_fts USING fts5(
+           name, description, content='products', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER products_fts_insert AFTER INSERT ON products WHEN new.is_active BEGIN
+           INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+       END""",
+    """CREATE TRIGGER products_fts_delete AFTER DELETE ON products WHEN old.is_active BEGIN
+           INSERT INTO products_fts(products_fts, rowid, name, description)
+           VALUES ('delete', old.id, old.name, old.description);
+       END""",
+    """CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description, is_active ON products BEGIN
+           INSERT INTO products_fts(products_fts, rowid, name, description)
+           SELECT 'delete', old.id, old.name, old.description WHERE old.is_active;
+           INSERT INTO products_fts(rowid, name, description)
+           SELECT new.id, new.name, new.description WHERE new.is_active;
+       END""",
+]
+
+POPULATE = "INSERT INTO products_fts(rowid, name, description) SELECT id, name, description FROM products WHERE is_active"
+
+state = {"fts": None}   # None until this process has looked for products_fts
+
+
+def install(engine):
+    """Create and fill the index if it is missing; returns True when FTS5 is in use"""
+    if engine.dialect.name != "sqlite":
+        return False
+    conn = engine.raw_connection()
+    isolation_level = conn.isolation_level
+    try:
+        cursor = conn.cursor()
+        # take the write lock before looking, so two workers starting at
+        # once cannot both decide to fill the index
+        conn.isolation_level = None
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'").fetchone()
+            if not exists:
+                for statement in SCHEMA:
+                    cursor.execute(statement)
+                cursor.execute(POPULATE)
+                print(f"[search] built products_fts ({cursor.rowcount} products)")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        if "fts5" not in str(e):
+            raise
+        print("[search] SQLite has no FTS5, search falls back to ILIKE")
+        return False
+    finally:
+        conn.isolation_level = isolation_level
+        conn.close()
+    state["fts"] = True
+    return True
+
+
+def installed(session):
+    """True if products_fts exists in the database session reads"""
+    if session.get_bind().dialect.name != "sqlite":
+        return False
+    return session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")).first() is not None
+
+
+def match_query(q):
+    """User input -> FTS5 query: every word as a quoted prefix term"""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_products(q, limit, session=None):
+    """Active products matching q, best first, as serialization.PRODUCT rows"""
+    session = session or db.session
+    if state["fts"] is None:
+        state["fts"] = installed(session)
+    if not state["fts"]:
+        return PRODUCT.query(session.query(Product)).filter(
+            db.or_(Product.name.ilike(f'%{q}%'), Product.description.ilike(f'%{q}%')),
+            Product.is_active == True
+        ).limit(limit).all()
+
+    match = match_query(q)
+    if not match:
+        return []
+    # rank inside the index first, so only the top rows are joined; the
+    # columns come back as stored, which is what PRODUCT rows hold
+    columns = ", ".join(f"products.{column.name}" for column in PRODUCT.columns)
+    statement = text(
+        f"SELECT {columns} FROM ("
+        f"  SELECT rowid, bm25(products_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS score"
+        "  FROM products_fts WHERE products_fts MATCH :match ORDER BY score LIMIT :limit"
+        ") AS hits JOIN products ON products.id = hits.rowid ORDER BY hits.score")
+    return session.execute(statement, {"match": match, "limit": limit}).all()
@@ -0,0 +1,166 @@
+"""
+Worker-side serving helper shared by all services
+
+unicorn_master tells a worker how to listen through environment variables:
+  UNICORN_FD         - fd of a listening socket bound by the master (pre-fork)
+  UNICORN_SHARE      - "stdin" on Windows: a socket.share() blob follows on stdin
+  UNICORN_REUSEPORT  - "1" to bind our own SO_REUSEPORT socket on PORT
+  UNICORN_THREADS    - overrides the waitress thread count
+  UNICORN_SCOREBOARD / UNICORN_SLOT - where to report in-flight requests
+  UNICORN_METRICS    - shared metrics file for per-route counters (see metrics.py)
+  UNICORN_PRELOADED  - "1" when we were forked from a master that imported the app
+  UNICORN_SERVER     - "asgi" to serve under uvicorn instead of waitress (see asgi.py)
+Without any of them the worker binds host:port itself like it always did.
+
+Every worker also serves on a private 127.0.0.1 port of its own, published
+in its scoreboard slot, so the master can health-check this exact process
+even when the main socket is shared.
+
+SIGTERM (CTRL_BREAK on Windows) drains the worker: it stops accepting,
+lets in-flight requests finish and then exits.
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import metrics
+from scoreboard import WorkerSlot, STATE_READY, STATE_DRAINING
+
+DRAIN_TIMEOUT = 30
+
+
+def listen_socket(host, port):
+    """Return the pre-bound socket for this worker, or None to bind normally"""
+    fd = os.environ.get("UNICORN_FD")
+    if fd:
+        # family/type are auto-detected from the inherited descriptor
+        return socket.socket(fileno=int(fd))
+
+    if os.environ.get("UNICORN_SHARE") == "stdin":
+        return socket.fromshare(sys.stdin.buffer.read())
+
+    if os.environ.get("UNICORN_REUSEPORT") == "1" and hasattr(socket, "SO_REUSEPORT"):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(1024)
+        return sock
+
+    return None
+
+
+def bind_socket(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if os.name != "nt":
+        # same as waitress; on Windows this would allow port hijacking
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def track_requests(wsgi_app, slot):
+    """WSGI middleware that keeps the worker's scoreboard slot up to date"""
+    from werkzeug.wsgi import ClosingIterator
+
+    def tracked(environ, start_response):
+        started = time.perf_counter()
+        slot.request_started()
+        try:
+            result = wsgi_app(environ, start_response)
+        except BaseException:
+            slot.request_finished(time.perf_counter() - started)
+            raise
+        return ClosingIterator(result, lambda: slot.request_finished(time.perf_counter() - started))
+
+    return tracked
+
+
+def install_drain_handler(socket_map, slot, timeout=DRAIN_TIMEOUT):
+    """Stop accepting on SIGTERM and exit once in-flight requests are done"""
+    from waitress.channel import HTTPChannel
+    from waitress.server import BaseWSGIServer
+
+    listeners = [d for d in socket_map.values() if isinstance(d, BaseWSGIServer)]
+
+    def stop_accepting():
+        # runs inside the waitress loop; closing a socket from the signal
+        # handler would pull it out from under select()
+        for listener in listeners:
+            listener.del_channel()
+            listener.socket.close()
+
+    def busy():
+        if slot.in_flight > 0:
+            return True
+        # a connection may have been accepted without its request parsed yet
+        return any(c.requests or c.request is not None or c.total_outbufs_len
+                   for c in list(socket_map.values()) if isinstance(c, HTTPChannel))
+
+    def wait_and_exit():
+        deadline = time.monotonic() + timeout
+        time.sleep(0.2)
+        while busy() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        os._exit(0)
+
+    def drain(signum, frame):
+        if slot.state == STATE_DRAINING:
+            return
+        slot.set_state(STATE_DRAINING)
+        listeners[0].trigger.pull_trigger(stop_accepting)
+        threading.Thread(target=wait_and_exit, daemon=True).start()
+
+    signal.signal(signal.SIGBREAK if os.name == "nt" else signal.SIGTERM, drain)
+
+
+def reset_after_fork(app):
+    """Drop state inherited from the master's copy of a preloaded app
+
+    The pool may hold connections the master opened while importing or
+    reloading the app; they must not be shared between processes.
+    """
+    db = app.extensions.get("sqlalchemy")
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def serve_app(app, port, host='127.0.0.1', threads=4, **kw):
+    """Run app (a Flask app or a combined.Combined) under waitress or uvicorn on the socket unicorn_master prepared for us"""
+    # idempotent if logging has already been set up, same as waitress.serve()
+    logging.basicConfig()
+    threads = int(os.environ.get("UNICORN_THREADS", threads))
+    # a Combined app (combined.py) carries the Flask apps it mounts
+    apps = getattr(app, "apps", [app])
+    for flask_app in apps:
+        if os.environ.get("UNICORN_PRELOADED") == "1":
+            reset_after_fork(flask_app)
+        hasher = flask_app.extensions.get("passwords")
+        if hasher is not None:
+            hasher.start()  # fork the hashing pool before waitress starts its threads
+        metrics.install(flask_app)
+    slot = WorkerSlot.from_env()
+    app.wsgi_app = track_requests(app.wsgi_app, slot)
+
+    sock = listen_socket(host, port) or bind_socket(host, port)
+    health = bind_socket('127.0.0.1', 0, backlog=16)
+    if os.environ.get("UNICORN_SERVER", "waitress") == "asgi":
+        from asgi import serve_asgi
+        return serve_asgi(app, sock, health, slot, threads)
+
+    from waitress.server import create_server
+    socket_map = {}
+    server = create_server(app, map=socket_map, sockets=[sock, health], threads=threads, **kw)
+
+    install_drain_handler(socket_map, slot)
+    slot.set_state(STATE_READY, health_port=health.getsockname()[1])
+    server.print_listen("Serving on http://{}:{}")
+    server.run()
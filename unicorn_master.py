@@ -1,99 +1,911 @@
 """
 Unicorn Master - Universal Worker Manager
-Copy this file to any project and it just works!
+Copy this file (and shared/scoreboard.py, metrics.py, cache.py, ratelimit.py) to any project and it just works!
 
 ZERO dependencies on your app structure.
 Just configure unicorn_config.json and run.
+
+Two ways to describe a service in unicorn_config.json:
+
+  {"name": "products_0", "script": "app/products/app.py", "port": 5010}
+      One worker on its own port (the original layout).
+
+  {"name": "products", "script": "app/products/app.py", "port": 5010, "workers": 4}
+      Pre-fork: the master binds port 5010 once and every worker accepts
+      on that same socket, so the kernel balances connections and nginx
+      needs a single upstream per service. "socket" picks how it is shared:
+        "inherit"   - master binds, workers inherit it (default). On POSIX the
+                      fd is passed down, on Windows the master hands each
+                      worker a socket.share() blob over its stdin.
+        "reuseport" - each worker binds with SO_REUSEPORT (Linux)
+        "ports"     - no sharing, worker i listens on port + i
+
+Dead workers are noticed the moment they exit (SIGCHLD on POSIX, process
+handles on Windows) and restarted on their own schedule: immediately if
+they had been up for a while, otherwise with exponential backoff. A worker
+that keeps crashing is parked for a cooldown instead of spinning. Tune it
+with the "restart" block:
+
+  "restart": {"backoff_initial": 0.5, "backoff_max": 30, "stable_after": 30,
+              "crash_loop_restarts": 5, "crash_loop_window": 60,
+              "crash_loop_cooldown": 120}
+
+Autoscaling: give a pre-fork service "min_workers" and "max_workers" and the
+master keeps the worker count between them. Workers report in-flight
+requests and busy time through a shared scoreboard file (run/scoreboard);
+the master adds a worker when the service is busy (thread utilisation,
+accept-queue backlog on Linux, or CPU via psutil when installed) and
+drains the idlest one after it has been quiet for a while. Thresholds go
+in the "autoscale" block, see AUTOSCALE_DEFAULTS.
+
+Preload (POSIX only): with "preload": true the master imports the service
+script once and forks its workers from that, so Flask, SQLAlchemy and the
+models are loaded a single time and shared copy-on-write. The module must
+expose a WSGI app (named by "app", default "app"); module-level PORT and
+INSTANCE_NAME globals are refreshed in each forked worker.
+
+Schema bootstrap: "bootstrap" names a script (plus arguments) that the
+master runs once with its own Python and environment. It runs before the
+first worker starts and again before every rolling reload:
+    "bootstrap": ["shared/migrations.py", "bootstrap"]
+Workers then never set up the schema themselves. Starting, restarting or
+adding one costs only the import. If the script fails at startup, the
+master exits. If it fails before a reload, the running workers are kept.
+
+Combined mode: app/combined/app.py mounts products, orders and users in
+one process (shared/combined.py), so a machine runs one set of workers
+instead of three and the services share the interpreter, the engines and
+the JWT cache. Point nginx's upstreams at its port:
+    {"name": "combined", "script": "app/combined/app.py", "port": 5000,
+     "workers": 4, "preload": true}
+
+Async serving: "server": "asgi" runs a service's workers under uvicorn
+instead of waitress (shared/asgi.py). An event loop holds the connections,
+so one worker keeps thousands of keep-alive clients open. Requests still run
+on "threads" offload threads. Needs uvicorn installed; waitress is the
+default.
+
+Rolling reload: SIGHUP or `python unicorn_master.py reload` replaces the
+workers of every service one at a time. A replacement is started first and
+must answer /health on its private health port before the old worker is
+drained and stopped, so capacity never drops. Services that cannot run two
+workers on one port ("single" entries and "ports" mode) stop the old worker
+first and lean on their siblings meanwhile. Preloaded services re-import
+their script before forking the replacements; changes to modules they
+share (shared/*.py) still need a full restart there.
+
+The master listens for commands on a local control port, "control" in the
+config (default 127.0.0.1:5099).
+
+Metrics: every worker records per-route request counts and latency
+histograms in its slot of a shared metrics file (run/metrics, see
+shared/metrics.py). GET /metrics on the control port returns them summed
+per service in Prometheus text format, so one scrape covers all workers.
+
+Rate limits: workers count flask-limiter hits in run/limits (UNICORN_LIMITS,
+see shared/ratelimit.py), so a limit holds across all workers of a service
+instead of applying to each one separately.
+
+Usage: python unicorn_master.py [--config unicorn_config.json] [run|reload]
 """
 
+import argparse
+import gc
+import importlib.util
 import json
+import selectors
+import signal
+import socket
 import subprocess
 import time
+import urllib.request
 import os
 import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / "shared"))
+from cache import Generations
+from metrics import MetricsRegion, labels, merge, render
+from ratelimit import LimitRegion
+from scoreboard import Scoreboard, STATE_READY
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 CONFIG_FILE = "unicorn_config.json"
 LOG_DIR = Path("logs")
+RUN_DIR = Path("run")
+
+# every listening socket the master owns; forked workers close the ones
+# that belong to other services
+LISTEN_SOCKETS = []
+
+# the shared metrics file, plus per-service totals of workers whose slot was
+# reset, so exported counters never go backwards when a worker restarts
+METRICS = {"region": None, "retired": {}, "generations": None, "limits": None}
+
+RESTART_DEFAULTS = {
+    "backoff_initial": 0.5,     # first delay after a crash of a young worker
+    "backoff_max": 30,          # delays double up to this
+    "stable_after": 30,         # uptime that counts as healthy, resets backoff
+    "crash_loop_restarts": 5,   # this many crashes...
+    "crash_loop_window": 60,    # ...within this many seconds is a crash loop
+    "crash_loop_cooldown": 120, # how long a crash-looping worker stays parked
+}
+
+AUTOSCALE_DEFAULTS = {
+    "interval": 5,              # seconds between scaling decisions
+    "scale_up_utilization": 0.75,   # busy threads / total threads
+    "scale_down_utilization": 0.25,
+    "scale_up_cpu": 80,         # average worker CPU %, needs psutil
+    "scale_down_cpu": 30,
+    "scale_down_after": 6,      # quiet intervals in a row before retiring one
+    "drain_timeout": 30,        # seconds a retiring worker gets to finish
+}
+
+RELOAD_DEFAULTS = {
+    "health_timeout": 30,       # seconds a replacement gets to pass /health
+    "drain_timeout": 30,        # seconds an old worker gets to finish
+}
+
+CONTROL_DEFAULTS = {"host": "127.0.0.1", "port": 5099}
+
+
+class ForkedProcess:
+    """Just enough of the Popen interface for a worker forked from the master"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid, status = self.pid, 0
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"pid {self.pid}", timeout)
+            time.sleep(0.01)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+def bind_shared_socket(host, port, backlog=1024):
+    """Bind the listening socket that all workers of a service accept on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    LISTEN_SOCKETS.append(sock)
+    return sock
+
+
+def socket_mode(service):
+    mode = service.get("socket", "inherit")
+    if mode == "reuseport" and not hasattr(socket, "SO_REUSEPORT"):
+        print(f"  [WARN] SO_REUSEPORT not available, {service['name']} falls back to a shared socket")
+        mode = "inherit"
+    return mode
+
+
+def server_kind(service):
+    kind = service.get("server", "waitress")
+    if kind not in ("waitress", "asgi"):
+        print(f"  [WARN] unknown server {kind!r} for {service['name']}, using waitress")
+        kind = "waitress"
+    if kind == "asgi" and importlib.util.find_spec("uvicorn") is None:
+        print(f"  [WARN] uvicorn is not installed, {service['name']} runs under waitress")
+        kind = "waitress"
+    return kind
+
+
+def build_services(config):
+    """Turn the services in config into service dicts that own their workers"""
+    services = []
+    for entry in config["services"]:
+        if not entry.get("enabled", True):
+            continue
+
+        service = {"name": entry["name"], "script": entry["script"], "port": entry["port"],
+                   "threads": entry.get("threads", 4), "server": server_kind(entry),
+                   "sock": None, "workers": [],
+                   "quiet_ticks": 0, "reload": None}
+
+        if "workers" not in entry:
+            # legacy single-process entry, keeps its name and port
+            service.update(mode="single", min_workers=1, max_workers=1, initial=1)
+        else:
+            service["mode"] = socket_mode(entry)
+            service["initial"] = int(entry["workers"])
+            service["min_workers"] = int(entry.get("min_workers", service["initial"]))
+            service["max_workers"] = int(entry.get("max_workers", service["initial"]))
+            if service["mode"] == "inherit":
+                service["sock"] = bind_shared_socket(entry.get("host", "127.0.0.1"), entry["port"])
+
+        service["module"] = None
+        service["app"] = entry.get("app", "app")
+        if entry.get("preload"):
+            if hasattr(os, "fork"):
+                service["module"] = preload_service(service)
+            else:
+                print(f"  [WARN] preload needs fork(), {service['name']} starts workers the usual way")
+
+        services.append(service)
+    return services
+
+
+def run_bootstrap(config):
+    """Run the "bootstrap" script, if any, to completion; False if it failed"""
+    command = config.get("bootstrap")
+    if not command:
+        return True
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *command])
+    if result.returncode != 0:
+        print(f"  [WARN] bootstrap {' '.join(command)} exited with {result.returncode}")
+        return False
+    print(f"  Bootstrapped with {' '.join(command)} in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def preload_service(service):
+    """Import a service script once in the master so workers can fork from it"""
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(f"unicorn_preload_{service['name']}", service["script"])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    print(f"  Preloaded {service['script']} in {time.perf_counter() - started:.2f}s")
+    return module
+
+
+def all_workers(services):
+    return [w for s in services for w in s["workers"]]
+
+
+def new_worker(service, free_slots):
+    """Add a worker entry to a service, taking the lowest free index"""
+    used = {w["index"] for w in service["workers"]}
+    index = next(i for i in range(len(used) + 1) if i not in used)
+
+    if service["mode"] == "single":
+        name, port = service["name"], service["port"]
+    else:
+        name = f"{service['name']}_{index}"
+        port = service["port"] + index if service["mode"] == "ports" else service["port"]
+
+    worker = {"name": name, "index": index, "port": port, "service": service,
+              "slot": free_slots.pop(0), "process": None, "backoff": 0, "crashes": [],
+              "started_at": None, "next_start": None, "retiring": False,
+              "stop_deadline": None, "ps": None, "busy_seen": 0.0}
+    service["workers"].append(worker)
+    return worker
+
+
+def fork_worker(worker, env, log_file, log_mode):
+    """Fork a worker from the preloaded service module (POSIX only)"""
+    service = worker["service"]
+    pid = os.fork()
+    if pid:
+        return ForkedProcess(pid)
+
+    # child: never return into the master's loop
+    try:
+        for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        os.environ.update(env)
+        os.environ["UNICORN_PRELOADED"] = "1"
+
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if log_mode == "w" else os.O_APPEND)
+        log_fd = os.open(log_file, flags, 0o644)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(log_fd)
+
+        for sock in LISTEN_SOCKETS:
+            if sock is not service["sock"]:
+                sock.close()
+
+        module = service["module"]
+        app = getattr(module, service["app"])
+        # a combined app (shared/combined.py) also carries the service modules it mounts
+        for target in [module, *getattr(app, "modules", ())]:
+            for name, value in (("PORT", worker["port"]), ("INSTANCE_NAME", worker["name"])):
+                if hasattr(target, name):
+                    setattr(target, name, type(getattr(target, name))(value))
+
+        from server import serve_app
+        print(f"[{worker['name']}] Forked from preloaded {service['script']} (PID: {os.getpid()})", flush=True)
+        serve_app(app, worker["port"], threads=service["threads"])
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+
+def spawn_worker(worker, env, log_file, log_mode):
+    """Start a worker as a fresh interpreter running the service script"""
+    service = worker["service"]
+    env = dict(os.environ, **env)
+    kwargs = {}
+    if os.name == "nt":
+        # lets stop_worker() deliver CTRL_BREAK to this worker alone
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        if service["sock"] is not None:
+            env["UNICORN_SHARE"] = "stdin"
+            kwargs["stdin"] = subprocess.PIPE
+    elif service["sock"] is not None:
+        kwargs["pass_fds"] = (service["sock"].fileno(),)
+
+    with open(log_file, log_mode) as log:
+        process = subprocess.Popen(
+            [sys.executable, service["script"]],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            **kwargs
+        )
+
+    if kwargs.get("stdin") is not None:
+        # Windows sockets can only be duplicated for a known target pid
+        process.stdin.write(service["sock"].share(process.pid))
+        process.stdin.close()
+    return process
+
+
+def start_worker(worker, board, log_mode="w"):
+    service = worker["service"]
+
+    # Setup environment
+    env = {
+        "PORT": str(worker["port"]),
+        "WORKER_ID": worker["name"],
+        "INSTANCE_NAME": worker["name"],
+        "UNICORN_THREADS": str(service["threads"]),
+        "UNICORN_SERVER": service["server"],
+        "UNICORN_SCOREBOARD": board.path,
+        "UNICORN_SLOT": str(worker["slot"]),
+        "UNICORN_METRICS": METRICS["region"].path,
+        "UNICORN_GENERATIONS": METRICS["generations"].path,
+        "UNICORN_LIMITS": METRICS["limits"].path,
+    }
+    if service["sock"] is not None and os.name != "nt":
+        env["UNICORN_FD"] = str(service["sock"].fileno())
+    if service["mode"] == "reuseport":
+        env["UNICORN_REUSEPORT"] = "1"
+
+    reset_slot(worker, board)
+    log_file = LOG_DIR / f"{worker['name']}.log"
+    if service["module"] is not None:
+        worker["process"] = fork_worker(worker, env, log_file, log_mode)
+    else:
+        worker["process"] = spawn_worker(worker, env, log_file, log_mode)
+
+    worker["started_at"] = time.monotonic()
+    worker["next_start"] = None
+    worker["ps"] = None
+    worker["busy_seen"] = 0.0
+
+
+def stop_worker(worker, timeout):
+    """Ask a worker to drain and exit; it is killed if still alive after timeout"""
+    if os.name == "nt":
+        worker["process"].send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        worker["process"].terminate()
+    worker["stop_deadline"] = time.monotonic() + timeout
+
+
+def retire_worker(worker, timeout):
+    """Drain a worker for good; the main loop drops it once it has exited"""
+    worker["retiring"] = True
+    worker["next_start"] = None
+    if worker["process"] is not None:
+        stop_worker(worker, timeout)
+
+
+def reset_slot(worker, board):
+    """Fold the slot's metrics into the service totals, then free it"""
+    region = METRICS["region"]
+    totals = METRICS["retired"].setdefault(worker["service"]["name"], {})
+    merge(totals, region.read_slot(worker["slot"]))
+    region.clear(worker["slot"])
+    board.clear(worker["slot"])
+
+
+def drop_worker(worker, board, free_slots):
+    worker["service"]["workers"].remove(worker)
+    reset_slot(worker, board)
+    free_slots.append(worker["slot"])
+
+
+def worker_healthy(worker, board):
+    """True once the worker is serving and its /health answers 200"""
+    slot = board.read(worker["slot"])
+    if worker["process"] is None or slot["pid"] != worker["process"].pid:
+        return False
+    if slot["state"] != STATE_READY or not slot["health_port"]:
+        return False
+    try:
+        url = f"http://127.0.0.1:{slot['health_port']}/health"
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status == 200
+    except OSError:
+        return False
+
+
+def begin_reload(service):
+    if service["reload"] is not None:
+        print(f"[RELOAD] {service['name']} is already reloading")
+        return
+    if service["module"] is not None:
+        try:
+            service["module"] = preload_service(service)
+        except Exception as e:
+            print(f"[RELOAD] {service['name']} failed to import, keeping the running workers: {e!r}")
+            return
+    old = [w for w in service["workers"] if not w["retiring"]]
+    print(f"[RELOAD] {service['name']}: replacing {len(old)} workers one at a time")
+    service["reload"] = {"pending": old, "old": None, "new": None, "deadline": None}
+
+
+def advance_reload(service, board, settings, free_slots, now):
+    """Move a service's rolling reload forward by whatever step is ready
+
+    Surge order (shared socket): start new -> new healthy -> drain old -> old gone.
+    Stop-first order (one port per worker): drain old -> old gone -> start new -> new healthy.
+    """
+    state = service["reload"]
+    surge = service["mode"] in ("inherit", "reuseport")
+
+    if state["new"] is not None:
+        new = state["new"]
+        if new["process"] is None or new["process"].poll() is not None or now > state["deadline"]:
+            print(f"[RELOAD] {new['name']} never became healthy, aborting reload of {service['name']}")
+            if surge:
+                retire_worker(new, settings["drain_timeout"])
+            service["reload"] = None
+            return
+        if not worker_healthy(new, board):
+            return
+        print(f"[RELOAD] {new['name']} is healthy")
+        state["new"] = None
+        if surge:
+            retire_worker(state["old"], settings["drain_timeout"])
+            return
+        state["old"] = None
+
+    if state["old"] is not None:
+        if state["old"] in service["workers"]:
+            return  # still draining
+        if not surge:
+            state["new"] = new_worker(service, free_slots)
+            state["deadline"] = now + settings["health_timeout"]
+            start_worker(state["new"], board, log_mode="a")
+            return
+        state["old"] = None
+
+    # pick the next old worker; skip ones that died or were retired meanwhile
+    while state["pending"] and state["pending"][0] not in service["workers"]:
+        state["pending"].pop(0)
+    if not state["pending"]:
+        print(f"[RELOAD] {service['name']} reloaded")
+        service["reload"] = None
+        return
+
+    state["old"] = state["pending"].pop(0)
+    if surge:
+        if not free_slots:
+            print(f"[RELOAD] no free scoreboard slot for a surge worker, aborting reload of {service['name']}")
+            service["reload"] = None
+            return
+        state["new"] = new_worker(service, free_slots)
+        state["deadline"] = now + settings["health_timeout"]
+        start_worker(state["new"], board, log_mode="a")
+    else:
+        retire_worker(state["old"], settings["drain_timeout"])
+
+
+def render_metrics(services, board):
+    """All workers' metrics summed per service, in Prometheus text format"""
+    per_service = {}
+    gauges = []
+    for service in services:
+        totals = merge({}, METRICS["retired"].get(service["name"], {}))
+        in_flight = 0
+        for worker in service["workers"]:
+            merge(totals, METRICS["region"].read_slot(worker["slot"]))
+            in_flight += board.read(worker["slot"])["in_flight"]
+        per_service[service["name"]] = totals
+        running = [w for w in service["workers"] if w["process"] is not None and not w["retiring"]]
+        gauges.append(("unicorn_workers", labels(service=service["name"]), len(running)))
+        gauges.append(("unicorn_requests_in_flight", labels(service=service["name"]), in_flight))
+    return render(per_service, gauges)
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """Local control endpoint; requests are queued for the main loop"""
+
+    def do_GET(self):
+        if self.path == "/metrics" and self.server.metrics is not None:
+            self.reply(200, self.server.metrics(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self.reply(404, "not found\n")
+
+    def do_POST(self):
+        if self.path == "/reload":
+            self.server.commands.append("reload")
+            self.reply(202, "reload scheduled\n")
+        else:
+            self.reply(404, "unknown command\n")
+
+    def reply(self, status, body, content_type="text/plain; charset=utf-8"):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_control_server(config):
+    settings = dict(CONTROL_DEFAULTS, **config.get("control", {}))
+    server = HTTPServer((settings["host"], settings["port"]), ControlHandler)
+    server.timeout = 0  # handle_request() never blocks the main loop
+    server.commands = []
+    server.metrics = None  # set by main() once the services exist
+    LISTEN_SOCKETS.append(server.socket)
+    return server
+
+
+def send_command(config, command):
+    settings = dict(CONTROL_DEFAULTS, **config.get("control", {}))
+    url = f"http://{settings['host']}:{settings['port']}/{command}"
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method="POST"), timeout=5) as resp:
+            print(resp.read().decode().strip())
+    except OSError as e:
+        print(f"ERROR: could not reach the master at {url}: {e}")
+        sys.exit(1)
+
+
+def restart_settings(config):
+    settings = dict(RESTART_DEFAULTS)
+    if "restart_delay" in config:
+        # older configs only had a fixed delay; treat it as the backoff ceiling
+        settings["backoff_max"] = config["restart_delay"]
+    settings.update(config.get("restart", {}))
+    return settings
+
+
+def schedule_restart(worker, settings, now):
+    """Decide when a worker that just exited comes back"""
+    code = worker["process"].returncode
+    uptime = now - worker["started_at"]
+    worker["process"] = None
+
+    worker["crashes"] = [t for t in worker["crashes"] if now - t < settings["crash_loop_window"]]
+    worker["crashes"].append(now)
+
+    if len(worker["crashes"]) >= settings["crash_loop_restarts"]:
+        delay = settings["crash_loop_cooldown"]
+        worker["crashes"] = []
+        worker["backoff"] = settings["backoff_max"]
+        print(f"[CRASH-LOOP] {worker['name']} exited {settings['crash_loop_restarts']} times "
+              f"in {settings['crash_loop_window']}s (code {code}), parking for {delay}s")
+    elif uptime >= settings["stable_after"]:
+        delay = 0
+        worker["backoff"] = 0
+        print(f"[RESTART] {worker['name']} died (code {code}) after {uptime:.0f}s, restarting now")
+    else:
+        delay = min(max(worker["backoff"] * 2, settings["backoff_initial"]), settings["backoff_max"])
+        worker["backoff"] = delay
+        print(f"[RESTART] {worker['name']} died (code {code}) after {uptime:.1f}s, restarting in {delay:.1f}s")
+
+    worker["next_start"] = now + delay
+
+
+def listen_backlog(port):
+    """Connections waiting in the accept queue of a listening port
+
+    Read from /proc/net/tcp, where rx_queue of a LISTEN socket is its current
+    backlog. Returns None where that is not available (Windows, macOS).
+    """
+    total = None
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                total = (total or 0) + int(fields[4].split(":")[1], 16)
+    return total
+
+
+def sample_load(service, board, interval):
+    """Utilisation, backlog and CPU of a service over the last interval"""
+    workers = [w for w in service["workers"] if w["process"] is not None and not w["retiring"]]
+    busy = 0.0
+    cpu = []
+    for worker in workers:
+        slot = board.read(worker["slot"])
+        # busy_seconds grows by the duration of every finished request, so its
+        # rate is the average number of busy threads (Little's law)
+        busy += max(0.0, slot["busy_seconds"] - worker["busy_seen"]) / interval
+        worker["busy_seen"] = slot["busy_seconds"]
+        if psutil is not None:
+            try:
+                if worker["ps"] is None:
+                    worker["ps"] = psutil.Process(worker["process"].pid)
+                cpu.append(worker["ps"].cpu_percent(None))
+            except psutil.Error:
+                pass
+    # requests still running have not been added to busy_seconds yet
+    busy = max(busy, sum(board.read(w["slot"])["in_flight"] for w in workers))
+
+    ports = {w["port"] for w in workers}
+    backlogs = [listen_backlog(port) for port in ports]
+    backlog = sum(b for b in backlogs if b is not None) if any(b is not None for b in backlogs) else None
+
+    return {
+        "workers": len(workers),
+        "utilization": busy / (max(len(workers), 1) * service["threads"]),
+        "backlog": backlog,
+        "cpu": sum(cpu) / len(cpu) if cpu else None,
+    }
+
+
+def autoscale(service, board, settings, free_slots):
+    """Grow or shrink one service by a single worker based on its load"""
+    if service["min_workers"] == service["max_workers"] or service["reload"] is not None:
+        return
+
+    load = sample_load(service, board, settings["interval"])
+    count = load["workers"]
+    busy = (load["utilization"] >= settings["scale_up_utilization"]
+            or (load["backlog"] or 0) > 0
+            or (load["cpu"] or 0) >= settings["scale_up_cpu"])
+    quiet = (load["utilization"] <= settings["scale_down_utilization"]
+             and not load["backlog"]
+             and (load["cpu"] or 0) <= settings["scale_down_cpu"])
+
+    if busy and count < service["max_workers"] and free_slots:
+        service["quiet_ticks"] = 0
+        worker = new_worker(service, free_slots)
+        cpu = "n/a" if load["cpu"] is None else f"{load['cpu']:.0f}%"
+        print(f"[SCALE] {service['name']} busy (util {load['utilization']:.0%}, "
+              f"backlog {load['backlog']}, cpu {cpu}), adding {worker['name']}")
+        start_worker(worker, board)
+        return
+
+    service["quiet_ticks"] = service["quiet_ticks"] + 1 if quiet else 0
+    if service["quiet_ticks"] >= settings["scale_down_after"] and count > service["min_workers"]:
+        service["quiet_ticks"] = 0
+        candidates = [w for w in service["workers"] if w["process"] is not None and not w["retiring"]]
+        # retire the idlest worker, newest first on ties
+        worker = min(candidates, key=lambda w: (board.read(w["slot"])["in_flight"], -w["index"]))
+        print(f"[SCALE] {service['name']} quiet, retiring {worker['name']}")
+        retire_worker(worker, settings["drain_timeout"])
+
+
+class ChildWatcher:
+    """Wakes the monitor loop as soon as any worker exits
+
+    POSIX: SIGCHLD is routed into a socketpair through signal.set_wakeup_fd,
+    so a selector sleeps until a child dies or the next restart is due.
+    Windows: waits directly on the process handles.
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.signals = []
+        if os.name != "nt":
+            self.rsock, self.wsock = socket.socketpair()
+            self.rsock.setblocking(False)
+            self.wsock.setblocking(False)
+            signal.set_wakeup_fd(self.wsock.fileno())
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.rsock, selectors.EVENT_READ)
+            # SIGHUP asks for a rolling reload; the handler only flags it
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.signals.append("reload"))
+            os.register_at_fork(after_in_child=self._close_in_child)
+
+    def _close_in_child(self):
+        signal.set_wakeup_fd(-1)
+        self.selector.close()
+        self.rsock.close()
+        self.wsock.close()
+
+    def add_reader(self, sock):
+        """Also wake up when sock becomes readable (POSIX; Windows wakes every second anyway)"""
+        if self.selector is not None:
+            self.selector.register(sock, selectors.EVENT_READ)
+
+    def wait(self, processes, timeout):
+        if self.selector is not None:
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is not self.rsock:
+                    continue
+                try:
+                    while self.rsock.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            return
+
+        import _winapi
+        # stay responsive to Ctrl+C, which cannot interrupt the wait itself
+        timeout = 1.0 if timeout is None else min(timeout, 1.0)
+        handles = [w["process"]._handle for w in processes if w["process"] is not None]
+        if not handles:
+            time.sleep(timeout)
+            return
+        # WaitForMultipleObjects takes at most 64 handles; the rest are
+        # caught by poll() on the next wakeup
+        _winapi.WaitForMultipleObjects(handles[:64], False, int(timeout * 1000))
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Unicorn Master - worker manager")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"config file (default {CONFIG_FILE})")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "reload"],
+                        help="run the master (default) or tell a running one to reload")
+    args = parser.parse_args()
+
     # Load config
-    if not Path(CONFIG_FILE).exists():
-        print(f"ERROR: {CONFIG_FILE} not found!")
+    if not Path(args.config).exists():
+        print(f"ERROR: {args.config} not found!")
         print("Create it first. See unicorn_config.json example.")
         sys.exit(1)
-    
-    with open(CONFIG_FILE) as f:
+
+    with open(args.config) as f:
         config = json.load(f)
-    
+
+    if args.command != "run":
+        send_command(config, args.command)
+        return
+
     LOG_DIR.mkdir(exist_ok=True)
-    processes = []
-    restart_delay = config.get("restart_delay", 5)
-    
+    RUN_DIR.mkdir(exist_ok=True)
+    settings = restart_settings(config)
+    scaling = dict(AUTOSCALE_DEFAULTS, **config.get("autoscale", {}))
+    reloading = dict(RELOAD_DEFAULTS, **config.get("reload", {}))
+
     print("[UNICORN] Starting workers...")
-    
+
+    # Watch for child exits before the first child can exit
+    watcher = ChildWatcher()
+    control = start_control_server(config)
+    watcher.add_reader(control.socket)
+
+    if not run_bootstrap(config):
+        print("ERROR: bootstrap failed, not starting any workers")
+        sys.exit(1)
+    services = build_services(config)
+    if any(s["module"] is not None for s in services):
+        # keep the preloaded objects out of the collector so forked workers
+        # do not dirty the shared pages just by running gc
+        gc.collect()
+        gc.freeze()
+    # one spare slot per service for the surge worker of a rolling reload
+    board = Scoreboard(RUN_DIR / "scoreboard", slots=sum(s["max_workers"] + 1 for s in services))
+    free_slots = list(range(board.slots))
+    METRICS["region"] = MetricsRegion(RUN_DIR / "metrics", slots=board.slots)
+    # response cache generations (shared/cache.py), never cleared per slot
+    METRICS["generations"] = Generations(RUN_DIR / "generations", slots=board.slots)
+    # rate-limit counters (shared/ratelimit.py), also kept when a slot is reused
+    METRICS["limits"] = LimitRegion(RUN_DIR / "limits", slots=board.slots)
+    control.metrics = lambda: render_metrics(services, board)
+
     # Start all workers
-    for service in config["services"]:
-        if not service.get("enabled", True):
-            continue
-        
-        name = service["name"]
-        script = service["script"]
-        port = service["port"]
-        
-        # Setup environment
-        env = os.environ.copy()
-        env["PORT"] = str(port)
-        env["WORKER_ID"] = name
-        
-        # Prepare command
-        cmd = [sys.executable, script]
-        log_file = LOG_DIR / f"{name}.log"
-        
-        print(f"  Starting {name} on port {port}")
-        
-        # Start process
-        with open(log_file, "w") as log:
-            proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
-        
-        processes.append({"name": name, "port": port, "script": script, "process": proc})
-    
-    print(f"[UNICORN] {len(processes)} workers running. Monitoring...")
-    
-    # Monitor and restart
+    for service in services:
+        for _ in range(service["initial"]):
+            worker = new_worker(service, free_slots)
+            shared = "" if service["mode"] in ("single", "ports") else " (shared socket)"
+            print(f"  Starting {worker['name']} on port {worker['port']}{shared}")
+            start_worker(worker, board)
+
+    print(f"[UNICORN] {len(all_workers(services))} workers running. Monitoring...")
+
+    if os.name != "nt":
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Monitor, restart and scale
+    next_scale = time.monotonic() + scaling["interval"]
     try:
         while True:
-            time.sleep(10)
-            
-            for worker in processes:
-                if worker["process"].poll() is not None:
-                    print(f"[RESTART] {worker['name']} died! Restarting in {restart_delay}s...")
-                    time.sleep(restart_delay)
-                    
-                    # Restart
-                    env = os.environ.copy()
-                    env["PORT"] = str(worker["port"])
-                    env["WORKER_ID"] = worker["name"]
-                    
-                    log_file = LOG_DIR / f"{worker['name']}.log"
-                    with open(log_file, "a") as log:
-                        worker["process"] = subprocess.Popen(
-                            [sys.executable, worker["script"]], 
-                            env=env, 
-                            stdout=log, 
-                            stderr=subprocess.STDOUT
-                        )
-    
-    except KeyboardInterrupt:
+            now = time.monotonic()
+            deadlines = [next_scale]
+            for worker in all_workers(services):
+                deadlines += [d for d in (worker["next_start"], worker["stop_deadline"]) if d is not None]
+            if any(s["reload"] is not None for s in services):
+                deadlines.append(now + 0.1)  # keep probing replacements
+            watcher.wait(all_workers(services), max(0, min(deadlines) - now))
+
+            control.handle_request()
+            if watcher.signals or control.commands:
+                watcher.signals.clear()
+                control.commands.clear()
+                print("[RELOAD] Rolling reload requested")
+                if run_bootstrap(config):
+                    for service in services:
+                        begin_reload(service)
+                else:
+                    print("[RELOAD] bootstrap failed, keeping the running workers")
+
+            now = time.monotonic()
+            for worker in all_workers(services):
+                process = worker["process"]
+                if process is None:
+                    if worker["retiring"]:
+                        drop_worker(worker, board, free_slots)
+                    continue
+                if process.poll() is not None:
+                    if worker["retiring"]:
+                        print(f"[STOP] {worker['name']} retired")
+                        drop_worker(worker, board, free_slots)
+                    else:
+                        schedule_restart(worker, settings, now)
+                elif worker["stop_deadline"] is not None and worker["stop_deadline"] <= now:
+                    print(f"[STOP] {worker['name']} did not drain in time, killing it")
+                    process.kill()
+                    worker["stop_deadline"] = None
+
+            for worker in all_workers(services):
+                if worker["next_start"] is not None and worker["next_start"] <= now:
+                    start_worker(worker, board, log_mode="a")
+
+            for service in services:
+                if service["reload"] is not None:
+                    advance_reload(service, board, reloading, free_slots, now)
+
+            if now >= next_scale:
+                for service in services:
+                    autoscale(service, board, scaling, free_slots)
+                next_scale = now + scaling["interval"]
+
+    except (KeyboardInterrupt, SystemExit):
         print("\n[UNICORN] Stopping...")
-        for worker in processes:
+        running = [w for w in all_workers(services) if w["process"] is not None]
+        for worker in running:
+            worker["process"].terminate()
+        for worker in running:
             try:
-                worker["process"].terminate()
                 worker["process"].wait(timeout=5)
-            except:
+            except subprocess.TimeoutExpired:
                 worker["process"].kill()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()